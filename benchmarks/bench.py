@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Benchmarks for the class file parser and the jnm/jdump pipelines.
+
+Each benchmark is run over each of the synthetic jars from synth.py, in a
+separate process so that its peak memory can be measured (and so that the
+jnm and jdump versions of ClassFile.dump don't meet).  Results can be saved
+as a baseline, and later runs are compared against it.  Timings only compare
+on the same machine, so the baseline is local (and ignored by git); record one
+with --save before making changes.
+"""
+import os
+import sys
+import imp
+import gc
+import time
+import json
+import getopt
+import resource
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, TOP_DIR)
+
+from javaclass.jarfile import iter_jar_class_data
+import synth
+
+DEFAULT_JAR_DIR = os.path.join(BENCH_DIR, "jars")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+# Number of timed runs of each benchmark; the fastest is reported
+DEFAULT_REPEAT = 3
+# Slowdown (as a fraction of the baseline) beyond which a result is flagged
+DEFAULT_TOLERANCE = 0.10
+
+
+def _class_data(jar):
+    return [data for info, data in iter_jar_class_data(jar)]
+
+
+def _classes(jar):
+    from javaclass.classfile import ClassFile
+    return [ClassFile(data) for data in _class_data(jar)]
+
+
+def _symbols(jar):
+    from javaclass.jnm import load_symbols
+    return list(load_symbols([jar]))
+
+
+# Each benchmark is a pair of functions: setup(jar) returns the input, which
+# is not timed, and run(input) does the work and returns a count of the items
+# it produced.
+def _setup_parse(jar):
+    return _class_data(jar)
+
+
+def _run_parse(datas):
+    from javaclass.classfile import ClassFile
+    for data in datas:
+        ClassFile(data)
+    return len(datas)
+
+
+def _setup_dump(jar):
+    import javaclass.jnm
+    return _classes(jar)
+
+
+def _run_dump(classes):
+    count = 0
+    for c in classes:
+        count += len(c.dump())
+    return count
+
+
+def _run_resolve(symbols):
+    from javaclass.jnm import resolve_all
+    return len(list(resolve_all(symbols)))
+
+
+def _run_sort(symbols):
+    from javaclass.jnm import alphabetic_sort, numeric_sort
+    return len(list(alphabetic_sort(symbols))) + len(list(numeric_sort(symbols)))
+
+
+def _setup_jdump(jar):
+    # jdump is a script rather than a module; loading it replaces the jnm
+    # version of ClassFile.dump with the disassembler.
+    imp.load_source("jdump", os.path.join(TOP_DIR, "jdump"))
+    return _classes(jar)
+
+
+def _run_jdump(classes):
+    size = 0
+    for c in classes:
+        size += len(u"".join(c.dump()))
+    return size
+
+
+def _run_serialize(classes):
+    size = 0
+    for c in classes:
+        size += len(c.serialize())
+    return size
+
+
+# Benchmark name => (setup function, run function, units counted by run)
+BENCHMARKS = {"parse": (_setup_parse, _run_parse, "classes"),
+              "dump": (_setup_dump, _run_dump, "symbols"),
+              "resolve": (_symbols, _run_resolve, "symbols"),
+              "sort": (_symbols, _run_sort, "symbols"),
+              "jdump": (_setup_jdump, _run_jdump, "chars"),
+              "serialize": (_classes, _run_serialize, "bytes")}
+
+
+USAGE = """bench.py [options] [benchmark[:workload] ...]
+
+Run benchmarks over synthetic jar files, optionally saving the results as a
+baseline or comparing them with a stored baseline.
+
+Benchmarks: %s
+Workloads: %s
+""" % (", ".join(sorted(BENCHMARKS)), ", ".join(sorted(synth.WORKLOADS)))
+
+
+def _peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # Reported in bytes rather than kilobytes
+        peak //= 1024
+    return peak
+
+
+def run_one(name, jar, repeat):
+    """Run a single benchmark in this process, returning a dict of results"""
+    setup, run, units = BENCHMARKS[name]
+    state = setup(jar)
+    gc.collect()
+    setup_kb = _peak_rss_kb()
+    wall_times = []
+    cpu_times = []
+    for ii in xrange(repeat):
+        wall_start, cpu_start = time.time(), time.clock()
+        count = run(state)
+        wall_times.append(time.time() - wall_start)
+        cpu_times.append(time.clock() - cpu_start)
+    peak_kb = _peak_rss_kb()
+    return {"wall": min(wall_times),
+            "cpu": min(cpu_times),
+            "count": count,
+            "units": units,
+            "peak_kb": peak_kb,
+            "growth_kb": peak_kb - setup_kb}
+
+
+def run_isolated(name, workload, jar, repeat):
+    """Run a single benchmark in a child process, returning a dict of results"""
+    child = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                              "--child", "--repeat=%d" % repeat, name, jar],
+                             stdout=subprocess.PIPE)
+    output, _ = child.communicate()
+    if child.returncode != 0:
+        raise RuntimeError("Benchmark %s:%s failed" % (name, workload))
+    return json.loads(output)
+
+
+def load_baseline(filename):
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def save_baseline(filename, results):
+    with open(filename, "w") as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+        f.write("\n")
+
+
+def report(results, baseline, tolerance, out=sys.stdout):
+    """Write a table of results (compared with baseline if present); return the number of regressions"""
+    regressions = 0
+    out.write("%-22s %10s %10s %12s %10s %10s %9s  %s\n" %
+              ("benchmark", "wall(s)", "cpu(s)", "rate(/s)", "peak(KB)", "run(KB)", "vs base", ""))
+    for key in sorted(results):
+        result = results[key]
+        rate = result["count"] / result["wall"] if result["wall"] > 0 else 0
+        comparison = ""
+        flag = ""
+        if key in baseline:
+            ratio = result["wall"] / baseline[key]["wall"] if baseline[key]["wall"] > 0 else 1.0
+            comparison = "%8.2fx" % ratio
+            if ratio > 1 + tolerance:
+                flag = "SLOWER"
+                regressions += 1
+            elif ratio < 1 - tolerance:
+                flag = "faster"
+            if result["count"] != baseline[key]["count"]:
+                flag += " (%s changed: %d => %d)" % (result["units"], baseline[key]["count"], result["count"])
+        out.write("%-22s %10.3f %10.3f %12d %10d %10d %9s  %s\n" %
+                  (key, result["wall"], result["cpu"], rate, result["peak_kb"], result["growth_kb"],
+                   comparison, flag))
+    return regressions
+
+
+def _selected(args):
+    # Generate (benchmark, workload) for each benchmark[:workload] argument
+    if not args:
+        args = sorted(BENCHMARKS)
+    for arg in args:
+        if ":" in arg:
+            name, workload = arg.split(":", 1)
+            workloads = [workload]
+        else:
+            name, workloads = arg, sorted(synth.WORKLOADS)
+        if name not in BENCHMARKS:
+            raise KeyError("Unknown benchmark %s" % name)
+        for workload in workloads:
+            if workload not in synth.WORKLOADS:
+                raise KeyError("Unknown workload %s" % workload)
+            yield name, workload
+
+
+def usage(err):
+    print >> sys.stderr, USAGE
+    print >> sys.stderr, "Options:"
+    print >> sys.stderr, "   -h/--help               : show this help"
+    print >> sys.stderr, "   -d/--jar-dir arg        : Directory for generated jars (default %s)" % DEFAULT_JAR_DIR
+    print >> sys.stderr, "   -b/--baseline arg       : Baseline file (default %s)" % DEFAULT_BASELINE
+    print >> sys.stderr, "   -s/--save               : Save the results as the baseline"
+    print >> sys.stderr, "   -n/--repeat arg         : Timed runs of each benchmark (default %d)" % DEFAULT_REPEAT
+    print >> sys.stderr, "   -t/--tolerance arg      : Fractional slowdown to flag (default %g)" % DEFAULT_TOLERANCE
+    sys.exit(err)
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "hd:b:sn:t:",
+                                   ["help", "jar-dir=", "baseline=", "save", "repeat=", "tolerance=", "child"])
+    except getopt.GetoptError:
+        usage(2)
+    jar_dir = DEFAULT_JAR_DIR
+    baseline_file = DEFAULT_BASELINE
+    save = False
+    child = False
+    repeat = DEFAULT_REPEAT
+    tolerance = DEFAULT_TOLERANCE
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage(0)
+        elif opt in ("-d", "--jar-dir"):
+            jar_dir = arg
+        elif opt in ("-b", "--baseline"):
+            baseline_file = arg
+        elif opt in ("-s", "--save"):
+            save = True
+        elif opt in ("-n", "--repeat"):
+            repeat = int(arg)
+        elif opt in ("-t", "--tolerance"):
+            tolerance = float(arg)
+        elif opt == "--child":
+            child = True
+
+    if child:
+        # Internal use: run_isolated passes a benchmark name and jar file
+        json.dump(run_one(args[0], args[1], repeat), sys.stdout)
+        return 0
+
+    try:
+        selected = list(_selected(args))
+    except KeyError, e:
+        print >> sys.stderr, e.args[0]
+        usage(1)
+    results = {}
+    for name, workload in selected:
+        jar = synth.workload_jar(jar_dir, workload)
+        results["%s:%s" % (name, workload)] = run_isolated(name, workload, jar, repeat)
+    baseline = load_baseline(baseline_file)
+    if not baseline and not save:
+        print >> sys.stderr, "No baseline in %s; run with --save to record one on this machine" % baseline_file
+    regressions = report(results, baseline, tolerance)
+    if save:
+        baseline.update(results)
+        save_baseline(baseline_file, baseline)
+    elif regressions:
+        print >> sys.stderr, "%d benchmark(s) slower than the baseline" % regressions
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Generator for synthetic class files and jars, for benchmarking.
+
+Classes are assembled as ClassFile objects and written out with
+ClassFile.serialize, so no Java compiler is needed.  The generated bytecode is
+well-formed enough for jnm and jdump to walk, but is not meant to pass the JVM
+verifier.
+"""
+import os
+import zipfile
+
+from javaclass.classfile import ClassFile, Utf8Info, ClassInfo, StringInfo, IntegerInfo, LongInfo
+from javaclass.classfile import FieldRefInfo, MethodRefInfo, NameAndTypeInfo
+from javaclass.classfile import FieldInfo, MethodInfo, CodeAttributeInfo, SourceFileAttributeInfo
+from javaclass.classfile import su1, su2, ss4, ss8
+from javaclass import jvmspec
+
+# Opcodes used in generated code
+ALOAD_0 = 42
+ILOAD_1 = 27
+POP = 87
+POP2 = 88
+LDC_W = 19
+LDC2_W = 20
+GETFIELD = 180
+GETSTATIC = 178
+INVOKEVIRTUAL = 182
+INVOKESTATIC = 184
+NEW = 187
+TABLESWITCH = 170
+LOOKUPSWITCH = 171
+RETURN = 177
+
+# Largest code array allowed in a method; JVMSpec 4.10
+MAX_CODE_LENGTH = 65535
+
+
+class ClassBuilder(object):
+    """Incrementally assemble a ClassFile; constants are shared where possible"""
+
+    def __init__(self, name, super_name=u"java/lang/Object", interfaces=()):
+        cf = ClassFile.__new__(ClassFile)
+        cf.size = 0
+        cf.attribute_class_to_index = None
+        cf.sourcefile_attribute = None
+        cf.code_filter = None
+        cf.decode_code = True
+        cf.minorv = 0
+        cf.majorv = 50
+        cf.constants = []
+        cf.access_flags = jvmspec.PUBLIC | jvmspec.SUPER
+        cf.fields = []
+        cf.methods = []
+        cf.attributes = []
+        self.class_file = cf
+        self._pool = {}  # (constant class, key) => index
+        self.name = name
+        cf.this_class = cf.constants[self.class_index(name) - 1]
+        cf.super_class = cf.constants[self.class_index(super_name) - 1]
+        cf.interfaces = [cf.constants[self.class_index(interface) - 1] for interface in interfaces]
+        self.code_name_index = self.utf8_index(u"Code")
+
+    def _add(self, const, key, **values):
+        index = self._pool.get((const, key))
+        if index is None:
+            c = const()
+            c.class_file = self.class_file
+            for attr, value in values.iteritems():
+                setattr(c, attr, value)
+            self.class_file.constants.append(c)
+            index = len(self.class_file.constants)
+            if const is LongInfo:
+                self.class_file.constants.append(None)
+            self._pool[(const, key)] = index
+        return index
+
+    def utf8_index(self, text):
+        data = text.encode("utf-8")
+        return self._add(Utf8Info, data, length=len(data), bytes=data)
+
+    def class_index(self, name):
+        return self._add(ClassInfo, name, name_index=self.utf8_index(name))
+
+    def string_index(self, text):
+        return self._add(StringInfo, text, string_index=self.utf8_index(text))
+
+    def integer_index(self, value):
+        return self._add(IntegerInfo, value, bytes=ss4(value))
+
+    def long_index(self, value):
+        data = ss8(value)
+        return self._add(LongInfo, value, high_bytes=data[:4], low_bytes=data[4:])
+
+    def name_and_type_index(self, name, descriptor):
+        return self._add(NameAndTypeInfo, (name, descriptor),
+                         name_index=self.utf8_index(name), descriptor_index=self.utf8_index(descriptor))
+
+    def field_ref_index(self, owner, name, descriptor):
+        return self._add(FieldRefInfo, (owner, name, descriptor),
+                         class_index=self.class_index(owner),
+                         name_and_type_index=self.name_and_type_index(name, descriptor))
+
+    def method_ref_index(self, owner, name, descriptor):
+        return self._add(MethodRefInfo, (owner, name, descriptor),
+                         class_index=self.class_index(owner),
+                         name_and_type_index=self.name_and_type_index(name, descriptor))
+
+    def add_field(self, name, descriptor, access_flags=jvmspec.PUBLIC):
+        f = FieldInfo()
+        f.class_file = self.class_file
+        f.access_flags = access_flags
+        f.name_index = self.utf8_index(name)
+        f.descriptor_index = self.utf8_index(descriptor)
+        f.attributes = []
+        self.class_file.fields.append(f)
+
+    def add_method(self, name, descriptor, code, access_flags=jvmspec.PUBLIC, max_stack=4, max_locals=4):
+        assert len(code) <= MAX_CODE_LENGTH, "Method %s too long" % name
+        code_attr = CodeAttributeInfo()
+        code_attr.class_file = self.class_file
+        code_attr.attribute_name_index = self.code_name_index
+        code_attr.max_stack = max_stack
+        code_attr.max_locals = max_locals
+        code_attr.code_length = len(code)
+        code_attr.code = code
+        code_attr.exception_table_length = 0
+        code_attr.exception_table = []
+        code_attr.attributes = []
+        code_attr.attribute_length = 12 + len(code)
+        m = MethodInfo()
+        m.class_file = self.class_file
+        m.access_flags = access_flags
+        m.name_index = self.utf8_index(name)
+        m.descriptor_index = self.utf8_index(descriptor)
+        m.attributes = [code_attr]
+        self.class_file.methods.append(m)
+
+    def set_source_file(self, filename):
+        attr = SourceFileAttributeInfo()
+        attr.class_file = self.class_file
+        attr.attribute_name_index = self.utf8_index(u"SourceFile")
+        attr.attribute_length = 2
+        attr.sourcefile_index = self.utf8_index(filename)
+        self.class_file.attributes.append(attr)
+        self.class_file.sourcefile_attribute = attr
+
+    def serialize(self):
+        return self.class_file.serialize()
+
+
+def op(opcode, index=None):
+    """Encode an instruction with an optional u2 constant pool index"""
+    if index is None:
+        return su1(opcode)
+    return su1(opcode) + su2(index)
+
+
+def tableswitch(pc, low, high, default, offsets):
+    """Encode a tableswitch instruction at code offset pc"""
+    pad = "\0" * ((4 - ((pc + 1) % 4)) % 4)
+    return (su1(TABLESWITCH) + pad + ss4(default) + ss4(low) + ss4(high) +
+            "".join([ss4(offset) for offset in offsets]))
+
+
+def lookupswitch(pc, default, pairs):
+    """Encode a lookupswitch instruction at code offset pc"""
+    pad = "\0" * ((4 - ((pc + 1) % 4)) % 4)
+    return (su1(LOOKUPSWITCH) + pad + ss4(default) + ss4(len(pairs)) +
+            "".join([ss4(match) + ss4(offset) for match, offset in pairs]))
+
+
+def _class_name(package, ii):
+    return u"%s/C%05d" % (package, ii)
+
+
+def many_constants(count=200, constants=1500):
+    """Generate (entry name, data) for classes with large constant pools"""
+    for ii in xrange(count):
+        name = _class_name(u"constants", ii)
+        builder = ClassBuilder(name)
+        builder.set_source_file(u"C%05d.java" % ii)
+        code = []
+        for jj in xrange(constants // 6):
+            code.append(op(LDC_W, builder.string_index(u"string constant %d/%d" % (ii, jj))) + op(POP))
+            code.append(op(LDC_W, builder.integer_index(ii * 100000 + jj)) + op(POP))
+            code.append(op(LDC2_W, builder.long_index((ii << 32) + jj)) + op(POP2))
+            code.append(op(GETSTATIC, builder.field_ref_index(u"java/lang/System", u"f%d" % jj,
+                                                                u"Ljava/lang/String;")) + op(POP))
+            code.append(op(INVOKESTATIC, builder.method_ref_index(u"java/lang/Math", u"m%d" % jj, u"(IJ)V")))
+        code.append(op(RETURN))
+        builder.add_method(u"<clinit>", u"()V", "".join(code), jvmspec.STATIC)
+        for jj in xrange(constants // 30):
+            builder.add_field(u"field%d" % jj, u"[Ljava/util/Map;", jvmspec.PRIVATE | jvmspec.STATIC)
+        yield name + u".class", builder.serialize()
+
+
+def huge_methods(count=20, methods=4):
+    """Generate (entry name, data) for classes with methods near the maximum code size"""
+    for ii in xrange(count):
+        name = _class_name(u"methods", ii)
+        builder = ClassBuilder(name)
+        builder.add_field(u"value", u"I", jvmspec.PRIVATE)
+        for mm in xrange(methods):
+            code = []
+            length = 0
+            jj = 0
+            while length < MAX_CODE_LENGTH - 64:
+                callee = builder.method_ref_index(name, u"helper%d" % (jj % 97), u"(ILjava/lang/String;)V")
+                chunk = (op(ALOAD_0) + op(GETFIELD, builder.field_ref_index(name, u"value", u"I")) + op(POP) +
+                         op(ALOAD_0) + op(ILOAD_1) + op(LDC_W, builder.string_index(u"s%d" % (jj % 251))) +
+                         op(INVOKEVIRTUAL, callee))
+                code.append(chunk)
+                length += len(chunk)
+                jj += 1
+            code.append(op(RETURN))
+            builder.add_method(u"huge%d" % mm, u"(I)V", "".join(code))
+        for jj in xrange(97):
+            builder.add_method(u"helper%d" % jj, u"(ILjava/lang/String;)V", op(RETURN))
+        yield name + u".class", builder.serialize()
+
+
+def deep_hierarchy(chains=10, depth=150):
+    """Generate (entry name, data) for long chains of subclasses.
+
+    Every class uses a field and a method that are only defined at the root of
+    its chain, so resolving them has to walk the whole chain."""
+    for cc in xrange(chains):
+        package = u"hierarchy/chain%d" % cc
+        root = _class_name(package, 0)
+        builder = ClassBuilder(root, interfaces=(u"java/lang/Runnable",))
+        builder.add_field(u"rootField", u"J", jvmspec.PROTECTED)
+        builder.add_method(u"rootMethod", u"(Ljava/lang/Object;)V", op(RETURN))
+        builder.add_method(u"run", u"()V", op(RETURN))
+        yield root + u".class", builder.serialize()
+        for dd in xrange(1, depth):
+            name = _class_name(package, dd)
+            builder = ClassBuilder(name, _class_name(package, dd - 1))
+            builder.add_field(u"level%d" % dd, u"I")
+            code = (op(NEW, builder.class_index(_class_name(package, dd - 1))) + op(POP) +
+                    op(ALOAD_0) + op(GETFIELD, builder.field_ref_index(name, u"rootField", u"J")) + op(POP2) +
+                    op(ALOAD_0) + op(ALOAD_0) +
+                    op(INVOKEVIRTUAL, builder.method_ref_index(name, u"rootMethod", u"(Ljava/lang/Object;)V")) +
+                    op(ALOAD_0) + op(INVOKEVIRTUAL, builder.method_ref_index(name, u"run", u"()V")) +
+                    op(RETURN))
+            builder.add_method(u"level%d" % dd, u"()V", code)
+            yield name + u".class", builder.serialize()
+
+
+def big_switches(count=40, cases=4000):
+    """Generate (entry name, data) for classes with very large switch statements"""
+    for ii in xrange(count):
+        name = _class_name(u"switches", ii)
+        builder = ClassBuilder(name)
+        # Each branch target is the return at the end of the method
+        switch_pc = 1
+        table_size = len(tableswitch(switch_pc, 0, cases - 1, 0, [0] * cases))
+        lookup_pc = switch_pc + table_size + 1
+        lookup_size = len(lookupswitch(lookup_pc, 0, [(0, 0)] * cases))
+        return_pc = lookup_pc + lookup_size
+        code = (op(ILOAD_1) +
+                tableswitch(switch_pc, 0, cases - 1, return_pc - switch_pc,
+                            [return_pc - switch_pc] * cases) +
+                op(ILOAD_1) +
+                lookupswitch(lookup_pc, return_pc - lookup_pc,
+                             [(jj * 7919, return_pc - lookup_pc) for jj in xrange(cases)]) +
+                op(RETURN))
+        assert len(code) == return_pc + 1
+        builder.add_method(u"dispatch", u"(I)V", code, max_locals=2)
+        yield name + u".class", builder.serialize()
+
+
+# Workload name => generator of (entry name, data)
+WORKLOADS = {"constants": many_constants,
+             "methods": huge_methods,
+             "hierarchy": deep_hierarchy,
+             "switches": big_switches}
+
+
+def write_jar(filename, entries):
+    """Write (entry name, data) pairs to a new jar file"""
+    zf = zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED)
+    try:
+        zf.writestr("META-INF/MANIFEST.MF", "Manifest-Version: 1.0\n")
+        for entry_name, data in entries:
+            zf.writestr(entry_name.encode("utf-8"), data)
+    finally:
+        zf.close()
+
+
+def workload_jar(directory, workload):
+    """Return the path of the jar for a workload, generating it if necessary"""
+    filename = os.path.join(directory, "%s.jar" % workload)
+    if not os.path.exists(filename):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        write_jar(filename + ".tmp", WORKLOADS[workload]())
+        os.rename(filename + ".tmp", filename)
+    return filename
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 2:
+        print >> sys.stderr, "Usage: %s directory [workload ...]" % sys.argv[0]
+        sys.exit(1)
+    for workload in sys.argv[2:] or sorted(WORKLOADS):
+        print workload_jar(sys.argv[1], workload)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Decoding of the instructions in a method's code, for the analyses that
+need each instruction's offset and operands rather than jnm's symbols."""
+import struct
+
+import jvmspec
+
+# Opcodes of interest to the analyses
+INVOKEVIRTUAL = 182
+INVOKESPECIAL = 183
+INVOKESTATIC = 184
+INVOKEINTERFACE = 185
+INVOKE_OPCODES = frozenset((INVOKEVIRTUAL, INVOKESPECIAL, INVOKESTATIC, INVOKEINTERFACE))
+# Invocations whose target depends on the class of the receiver
+VIRTUAL_OPCODES = frozenset((INVOKEVIRTUAL, INVOKEINTERFACE))
+
+_TABLESWITCH = 170
+_LOOKUPSWITCH = 171
+_WIDE = 196
+_IINC = 132
+
+# Instructions that may transfer control to an offset within the method
+BRANCH_OPCODES = frozenset([opcode for opcode, (name, size, struct_code, info_types) in jvmspec.BYTECODES.items()
+                            if "o" in info_types] + [_TABLESWITCH, _LOOKUPSWITCH])
+
+# Fixed-size instructions: opcode => (operand size, struct format)
+_FIXED = dict([(opcode, (size, ">" + struct_code))
+               for opcode, (name, size, struct_code, info_types) in jvmspec.BYTECODES.items()
+               if size is not None])
+
+
+def iter_instructions(code):
+    """Generate (offset, opcode, operands) for each instruction in a code array.
+
+    The operands are the unpacked values that follow the opcode; for
+    tableswitch they are (default, low, high, offsets...) and for
+    lookupswitch (default, npairs, match, offset, ...), without the padding.
+    Instructions modified by wide are reported with the opcode they modify."""
+    ii = 0
+    length = len(code)
+    while ii < length:
+        opcode = ord(code[ii])
+        fixed = _FIXED.get(opcode)
+        if fixed is not None:
+            size, fmt = fixed
+            if size:
+                yield ii, opcode, struct.unpack(fmt, code[ii + 1:ii + 1 + size])
+            else:
+                yield ii, opcode, ()
+            ii += size + 1
+        elif opcode == _TABLESWITCH:
+            args_offset = ii + 1 + ((4 - ((ii + 1) % 4)) % 4)
+            default, low, high = struct.unpack(">iii", code[args_offset:args_offset + 12])
+            count = high - low + 1
+            end = args_offset + 12 + 4 * count
+            yield ii, opcode, (default, low, high) + struct.unpack(">%di" % count, code[args_offset + 12:end])
+            ii = end
+        elif opcode == _LOOKUPSWITCH:
+            args_offset = ii + 1 + ((4 - ((ii + 1) % 4)) % 4)
+            default, npairs = struct.unpack(">ii", code[args_offset:args_offset + 8])
+            end = args_offset + 8 + 8 * npairs
+            yield ii, opcode, (default, npairs) + struct.unpack(">%di" % (2 * npairs), code[args_offset + 8:end])
+            ii = end
+        elif opcode == _WIDE:
+            modified = ord(code[ii + 1])
+            if modified == _IINC:
+                yield ii, modified, struct.unpack(">Hh", code[ii + 2:ii + 6])
+                ii += 6
+            else:  # *load, *store or ret
+                yield ii, modified, struct.unpack(">H", code[ii + 2:ii + 4])
+                ii += 4
+        else:
+            raise ValueError("Unknown opcode %d at offset %d" % (opcode, ii))
+
+
+def branch_targets(offset, opcode, operands):
+    """Return the code offsets that an instruction at offset may branch to"""
+    if opcode == _TABLESWITCH:
+        return [offset + operands[0]] + [offset + rel for rel in operands[3:]]
+    elif opcode == _LOOKUPSWITCH:
+        return [offset + operands[0]] + [offset + rel for rel in operands[3::2]]
+    info_types = jvmspec.BYTECODES[opcode][3]
+    return [offset + value for value, info_type in zip(operands, info_types) if info_type == "o"]
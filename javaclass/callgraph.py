@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Method-level call graph over a set of class and jar files.
+
+Every method that is declared or invoked is a node, named as for jnm's T and R
+symbols (com.foo.Bar.baz:(I)V) and numbered in sorted name order.  The calls
+made by each invoke instruction are resolved through the class hierarchy of
+the input files: a static or special invocation calls the method that the
+referenced class declares or inherits, and a virtual or interface invocation
+may also call any override of it in a subtype of the referenced class.
+
+The edges are held in compressed sparse row form: for each node, an array of
+offsets gives the range of its callees (or callers) in a single array of node
+ids, so the graph takes a few bytes per edge, and queries read the edges in
+place rather than copying them.
+"""
+import array
+import bisect
+
+from classfile import CodeAttributeInfo
+from jvmspec import fqcn, ABSTRACT, PRIVATE, STATIC
+from jnm import load_classes
+from bytecode import iter_instructions, INVOKE_OPCODES, VIRTUAL_OPCODES
+from refindex import PickledArrays, _ids
+from stats import run_stats
+
+GRAPH_VERSION = 1
+
+# Flags value for a method that is referenced but not declared in the input
+UNDECLARED = 0xFFFF
+
+
+class CallGraphBuilder(object):
+    """Accumulate methods and the calls between them from class and jar files"""
+
+    def __init__(self):
+        self.nodes = {}  # method unique name => node id
+        self.node_list = []
+        self.flags = array.array('H')  # node id => access flags, or UNDECLARED
+        self.node_classes = []  # node id => (class name, "name:descriptor")
+        self.class_parent = {}  # class name => superclass name
+        self.class_interfaces = {}  # class name => list of interface names
+        self.declared = {}  # class name => {"name:descriptor": node id}
+        # Call sites, as referenced (before resolution) and deduplicated per method
+        self.call_src = array.array('I')
+        self.call_dst = array.array('I')
+        self.call_virtual = array.array('B')
+        self.site_counts = {}  # (referenced node id, virtual) => number of invoke instructions
+
+    def _node(self, jcls, member):
+        node_id = self.nodes.get(u"%s.%s" % (jcls, member))
+        if node_id is None:
+            node_id = _ids(self.nodes, self.node_list, u"%s.%s" % (jcls, member))
+            self.flags.append(UNDECLARED)
+            self.node_classes.append((jcls, member))
+        return node_id
+
+    def add_class(self, class_file):
+        jcls = fqcn(unicode(class_file.this_class))
+        if class_file.super_class is not None:
+            self.class_parent[jcls] = fqcn(unicode(class_file.super_class))
+        self.class_interfaces[jcls] = [fqcn(unicode(interf)) for interf in class_file.interfaces]
+        declared = self.declared.setdefault(jcls, {})
+        constants = class_file.constants
+        targets = {}  # constant index => node id, as each method ref is usually invoked repeatedly
+        for m in class_file.methods:
+            member = u"%s:%s" % (constants[m.name_index - 1], m.get_descriptor())
+            src = declared[member] = self._node(jcls, member)
+            self.flags[src] = m.access_flags
+            seen = set()
+            for attr in m.attributes:
+                if not isinstance(attr, CodeAttributeInfo):
+                    continue
+                for offset, opcode, operands in iter_instructions(attr.code):
+                    if opcode not in INVOKE_OPCODES:
+                        continue
+                    dst = targets.get(operands[0])
+                    if dst is None:
+                        ref = constants[operands[0] - 1]
+                        dst = targets[operands[0]] = self._node(fqcn(unicode(ref.get_class())),
+                                                                u"%s:%s" % (ref.get_name(), ref.get_descriptor()))
+                    virtual = opcode in VIRTUAL_OPCODES
+                    site = (dst, virtual)
+                    self.site_counts[site] = self.site_counts.get(site, 0) + 1
+                    if site in seen:
+                        continue
+                    seen.add(site)
+                    self.call_src.append(src)
+                    self.call_dst.append(dst)
+                    self.call_virtual.append(virtual)
+
+    def add(self, filenames):
+        """Add the methods and calls from the given class/jar files"""
+        count = 0
+        for jarfile, classfile, class_file in load_classes(filenames):
+            with run_stats.phase("graph", classfile):
+                self.add_class(class_file)
+            count += 1
+        return count
+
+    def _resolve(self, jcls, member, memo):
+        # Return the node id of the method that jcls declares or inherits as member, or None
+        key = (jcls, member)
+        if key in memo:
+            return memo[key]
+        result = None
+        declared = self.declared.get(jcls)
+        if declared is not None:
+            result = declared.get(member)
+            if result is None:
+                for parent in [self.class_parent.get(jcls)] + self.class_interfaces[jcls]:
+                    if parent is not None:
+                        result = self._resolve(parent, member, memo)
+                        if result is not None:
+                            break
+        memo[key] = result
+        return result
+
+    def _subtypes(self):
+        # Return class name => list of direct subclasses and implementing classes
+        subtypes = {}
+        for jcls in self.declared:
+            for parent in [self.class_parent.get(jcls)] + self.class_interfaces[jcls]:
+                if parent is not None:
+                    subtypes.setdefault(parent, []).append(jcls)
+        return subtypes
+
+    def _dispatch_targets(self, node_id, subtypes, memo):
+        # Return the node ids that a virtual call to node_id may reach
+        jcls, member = self.node_classes[node_id]
+        targets = set()
+        resolved = self._resolve(jcls, member, memo)
+        targets.add(node_id if resolved is None else resolved)
+        pending = list(subtypes.get(jcls, ()))
+        visited = set(pending)
+        while pending:
+            subtype = pending.pop()
+            impl = self._resolve(subtype, member, memo)
+            if impl is not None and not (self.flags[impl] & (ABSTRACT | PRIVATE | STATIC)):
+                targets.add(impl)
+            for further in subtypes.get(subtype, ()):
+                if further not in visited:
+                    visited.add(further)
+                    pending.append(further)
+        return targets
+
+    def call_site_counts(self):
+        """Return method unique name => number of invoke instructions that may call it.
+
+        A virtual or interface call counts once for every method it may
+        dispatch to."""
+        subtypes = self._subtypes()
+        memo = {}
+        counts = {}
+        for (dst, virtual), count in self.site_counts.iteritems():
+            if virtual:
+                targets = self._dispatch_targets(dst, subtypes, memo)
+            else:
+                jcls, member = self.node_classes[dst]
+                target = self._resolve(jcls, member, memo)
+                targets = (dst if target is None else target,)
+            for target in targets:
+                name = self.node_list[target]
+                counts[name] = counts.get(name, 0) + count
+        return counts
+
+    def finish(self):
+        """Return a CallGraph holding the resolved calls"""
+        subtypes = self._subtypes()
+        memo = {}
+        direct = {}  # referenced node id => resolved node id
+        dispatch = {}  # referenced node id => resolved node ids for a virtual call
+        edges = {}  # source node id => set of target node ids
+        for ii in xrange(len(self.call_src)):
+            dst = self.call_dst[ii]
+            if self.call_virtual[ii]:
+                targets = dispatch.get(dst)
+                if targets is None:
+                    targets = dispatch[dst] = self._dispatch_targets(dst, subtypes, memo)
+                edges.setdefault(self.call_src[ii], set()).update(targets)
+            else:
+                target = direct.get(dst)
+                if target is None:
+                    jcls, member = self.node_classes[dst]
+                    target = self._resolve(jcls, member, memo)
+                    direct[dst] = target = dst if target is None else target
+                edges.setdefault(self.call_src[ii], set()).add(target)
+
+        # Renumber the nodes in name order, so that names can be found by binary search
+        order = sorted(xrange(len(self.node_list)), key=self.node_list.__getitem__)
+        new_ids = array.array('I', [0]) * len(order)
+        for new_id, old_id in enumerate(order):
+            new_ids[old_id] = new_id
+        flags = array.array('H', [self.flags[old_id] for old_id in order])
+        callee_offsets = array.array('I', [0])
+        callees = array.array('I')
+        for old_id in order:
+            targets = edges.get(old_id)
+            if targets:
+                callees.extend(sorted([new_ids[target] for target in targets]))
+            callee_offsets.append(len(callees))
+        caller_offsets, callers = _transpose(callee_offsets, callees)
+        return CallGraph([self.node_list[old_id] for old_id in order], flags,
+                         callee_offsets, callees, caller_offsets, callers)
+
+
+def _transpose(offsets, targets):
+    # Return the (offsets, sources) arrays for the reverse of a CSR graph, by counting sort
+    count = len(offsets) - 1
+    reverse_offsets = array.array('I', [0]) * (count + 1)
+    for target in targets:
+        reverse_offsets[target + 1] += 1
+    for node in xrange(count):
+        reverse_offsets[node + 1] += reverse_offsets[node]
+    fill = array.array('I', reverse_offsets)
+    sources = array.array('I', [0]) * len(targets)
+    for node in xrange(count):
+        for ii in xrange(offsets[node], offsets[node + 1]):
+            target = targets[ii]
+            sources[fill[target]] = node
+            fill[target] += 1
+    return reverse_offsets, sources
+
+
+class CallGraph(PickledArrays):
+    """Callers, callees and reachability of methods"""
+
+    _ARRAYS = ("flags", "callee_offsets", "callee_ids", "caller_offsets", "caller_ids")
+    _LISTS = ("names",)
+    VERSION = GRAPH_VERSION
+    DESCRIPTION = "call graph"
+
+    def __init__(self, names, flags, callee_offsets, callee_ids, caller_offsets, caller_ids):
+        self.names = names
+        self.flags = flags
+        self.callee_offsets = callee_offsets
+        self.callee_ids = callee_ids
+        self.caller_offsets = caller_offsets
+        self.caller_ids = caller_ids
+
+    def is_declared(self, node_id):
+        """Indicate whether a method is declared in the files the graph was built from"""
+        return self.flags[node_id] != UNDECLARED
+
+    def lookup(self, name):
+        """Return the node ids for a method name, with or without its descriptor.
+
+        A name without a descriptor (com.foo.Bar.baz) matches every overload."""
+        lo = bisect.bisect_left(self.names, name)
+        if u":" in name:
+            if lo < len(self.names) and self.names[lo] == name:
+                return [lo]
+            return []
+        prefix = name + u":"
+        lo = bisect.bisect_left(self.names, prefix, lo)
+        hi = lo
+        while hi < len(self.names) and self.names[hi].startswith(prefix):
+            hi += 1
+        return range(lo, hi)
+
+    def callees(self, node_id):
+        """Generate the node ids that a method may call"""
+        for ii in xrange(self.callee_offsets[node_id], self.callee_offsets[node_id + 1]):
+            yield self.callee_ids[ii]
+
+    def callers(self, node_id):
+        """Generate the node ids of the methods that may call a method"""
+        for ii in xrange(self.caller_offsets[node_id], self.caller_offsets[node_id + 1]):
+            yield self.caller_ids[ii]
+
+    def reachable(self, node_ids, reverse=False):
+        """Return the node ids reachable from the given nodes (including them), in breadth-first order.
+
+        If reverse is set, return the methods from which the given nodes are reachable."""
+        if reverse:
+            offsets, targets = self.caller_offsets, self.caller_ids
+        else:
+            offsets, targets = self.callee_offsets, self.callee_ids
+        visited = bytearray(len(self.names))
+        order = array.array('I')
+        for node_id in node_ids:
+            if not visited[node_id]:
+                visited[node_id] = 1
+                order.append(node_id)
+        ii = 0
+        while ii < len(order):
+            node_id = order[ii]
+            ii += 1
+            for jj in xrange(offsets[node_id], offsets[node_id + 1]):
+                target = targets[jj]
+                if not visited[target]:
+                    visited[target] = 1
+                    order.append(target)
+        return order
+
+
+def build_graph(filenames):
+    """Return a CallGraph for the given class/jar files, built in one pass"""
+    builder = CallGraphBuilder()
+    builder.add(filenames)
+    return builder.finish()
@@ -300,7 +300,14 @@ class FieldInfo(ItemInfo):
 
 
 class MethodInfo(ItemInfo):
-    pass
+    def init(self, data, class_file):
+        if class_file.code_filter is not None:
+            name = unicode(class_file.constants[u2(data[2:4]) - 1])
+            descriptor = unicode(class_file.constants[u2(data[4:6]) - 1])
+            class_file.decode_code = class_file.code_filter(name, descriptor)
+        data = ItemInfo.init(self, data, class_file)
+        class_file.decode_code = True
+        return data
 
 
 class AttributeInfo(object):
@@ -318,6 +325,11 @@ class UnknownAttributeInfo(AttributeInfo):
     pass
 
 
+class UndecodedCodeAttributeInfo(AttributeInfo):
+    """Code attribute left as raw bytes because its method was not selected for decoding"""
+    pass
+
+
 class SourceFileAttributeInfo(AttributeInfo):
     def init(self, data, class_file):
         self.class_file = class_file
@@ -1041,15 +1053,21 @@ ATTR_NAMES_TO_CLASS = {"SourceFile": SourceFileAttributeInfo,
 class ClassFile(object):
     "A class representing a Java class file."
 
-    def __init__(self, s):
+    def __init__(self, s, code_filter=None):
 
         """
         Process the given string 's', populating the object with the class
         file's details.
+
+        If given, code_filter(name, descriptor) is called for each method, and
+        the method's Code attribute is only decoded if it returns True;
+        otherwise it is kept as an UndecodedCodeAttributeInfo.
         """
         self.size = len(s)
         self.attribute_class_to_index = None
         self.sourcefile_attribute = None
+        self.code_filter = code_filter
+        self.decode_code = True
         magic = u4(s[0:])
         if magic != 0xCAFEBABE:
             raise UnknownAttribute("%08x" % magic)
@@ -1127,11 +1145,14 @@ class ClassFile(object):
     def _get_attribute_from_table(self, s):
         attribute_name_index = u2(s[0:2])
         constant_name = self.constants[attribute_name_index - 1].bytes
-        if constant_name in ATTR_NAMES_TO_CLASS:
+        if constant_name == "Code" and not self.decode_code:
+            attribute = UndecodedCodeAttributeInfo()
+        elif constant_name in ATTR_NAMES_TO_CLASS:
             attribute = ATTR_NAMES_TO_CLASS[constant_name]()
         else:
             attribute = UnknownAttributeInfo()
         s = attribute.init(s[2:], self)
+        attribute.attribute_name_index = attribute_name_index
         return attribute, s
 
     def _get_attributes_from_table(self, number, s):
@@ -1211,10 +1232,14 @@ class ClassFile(object):
                 if isinstance(c, Utf8Info) and unicode(c) in ATTR_NAMES_TO_CLASS.keys():
                     self.attribute_class_to_index[ATTR_NAMES_TO_CLASS[unicode(c)]] = index
         for attribute in attrs:
-            for (classtype, name_index) in self.attribute_class_to_index.iteritems():
-                if isinstance(attribute, classtype):
-                    od += su2(name_index)
-                    break
+            if hasattr(attribute, "attribute_name_index"):
+                # Attributes read from a class file remember their name
+                od += su2(attribute.attribute_name_index)
+            else:
+                for (classtype, name_index) in self.attribute_class_to_index.iteritems():
+                    if isinstance(attribute, classtype):
+                        od += su2(name_index)
+                        break
             od += attribute.serialize()
         return od
 
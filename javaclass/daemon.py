@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Long-running analysis daemon for jnm and jldd.
+
+The daemon listens on a Unix domain socket and runs jnm/jldd requests one at a
+time, keeping the symbols of every class/jar file it has parsed (keyed by path,
+modification time, size and pointer size), the classes available on each jar
+in a class path, and the boot class path in memory between requests.  Cached
+entries that no request has used for CACHE_IDLE_REQUESTS requests, and those
+whose files have gone, are dropped.
+
+A request is a single line of JSON:
+
+    {"tool": "jnm"|"jldd"|"status"|"stop", "argv": [...], "cwd": ..., "classpath": ...}
+
+and the reply is a sequence of frames, each a channel byte followed by a u4
+length and that many bytes of data:
+
+    "1"  data for stdout
+    "2"  data for stderr
+    "x"  exit status of the request, as decimal text; always the last frame
+"""
+import os
+import sys
+import json
+import errno
+import socket
+import struct
+import tempfile
+import traceback
+import SocketServer
+
+import jvmspec
+import jnm
+import nm
+import ldd
+from classfile import su4
+from jvmspec import fqcn
+from jnm import load_classes, load_counters, _class_parent, _class_interfaces
+from stats import run_stats
+from tracing import tracer
+
+DEFAULT_SOCKET = os.environ.get("JNMD_SOCKET",
+                                os.path.join(tempfile.gettempdir(), "jnmd-%d.sock" % os.getuid()))
+
+STDOUT_CHANNEL = "1"
+STDERR_CHANNEL = "2"
+EXIT_CHANNEL = "x"
+
+# Global settings that options may change, restored before each request
+_DEFAULT_POINTER_SIZE = jvmspec.POINTER_SIZE
+_DEFAULT_SORT_MEMORY_LIMIT = jnm.SORT_MEMORY_LIMIT
+
+# Cached entries that this many requests in a row haven't used are dropped
+CACHE_IDLE_REQUESTS = 100
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return (st.st_mtime, st.st_size)
+
+
+class AnalysisCache(object):
+    """Parsed symbols and class path listings, reused while files are unchanged"""
+
+    def __init__(self):
+        # Each entry also holds the number of the request that last used it, and
+        # the classes are a list of (classfile, jcls, parent, interfaces, symbols)
+        self.files = {}  # (abspath, pointer size) => (stamp, classes, request)
+        self.classpath_jars = {}  # (abspath, jarfile) => (stamp, {classname: jarfile}, request)
+        self.request = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def _stamp(self, cache, key):
+        # Stamp of the file for a cache key, dropping its entry if the file has gone
+        try:
+            return _stamp(key[0])
+        except OSError:
+            if cache.pop(key, None) is not None:
+                self.evicted += 1
+            raise
+
+    def _classes(self, arg):
+        key = (os.path.abspath(arg), jvmspec.POINTER_SIZE)
+        stamp = self._stamp(self.files, key)
+        entry = self.files.get(key)
+        if entry is not None and entry[0] == stamp:
+            self.files[key] = (stamp, entry[1], self.request)
+            self.hits += 1
+            load_counters.classes += len(entry[1])
+            load_counters.reused += len(entry[1])
+            load_counters.reused_bytes += stamp[1]
+            return entry[1]
+        self.misses += 1
+        classes = []
+        for jarfile, classfile, c in load_classes([arg]):
+            with run_stats.phase("scan", classfile):
+                symbols = c.dump()
+            run_stats.symbols += len(symbols)
+            load_counters.classes += 1
+            load_counters.parsed += 1
+            jcls = fqcn(unicode(c.this_class))
+            classes.append((classfile, jcls, _class_parent[jcls], _class_interfaces[jcls], symbols))
+        self.files[key] = (stamp, classes, self.request)
+        return classes
+
+    def load_symbols(self, filenames):
+        """Equivalent of jnm.load_symbols, using cached symbols where possible"""
+        # The class hierarchy only covers the files in this request, and is
+        # filled in as each class is reached, just as it would be when parsing.
+        _class_parent.clear()
+        _class_interfaces.clear()
+        for arg in filenames:
+            if arg.endswith(".jar"):
+                jarfile = arg
+            else:
+                jarfile = None
+            for classfile, jcls, parent, interfaces, symbols in self._classes(arg):
+                _class_parent[jcls] = parent
+                _class_interfaces[jcls] = interfaces
+                if jarfile is None:
+                    classfile = arg
+                for sym in symbols:
+                    yield (jarfile, classfile, sym)
+
+    def get_classes(self, classpath):
+        """Equivalent of ldd.get_classes, using cached listings of jar files"""
+        results = {}
+        for top in classpath:
+            if top.endswith(".jar") and os.path.isfile(top):
+                # Results name the jar as given, so key on that as well as the real path
+                key = (os.path.abspath(top), top)
+                stamp = self._stamp(self.classpath_jars, key)
+                entry = self.classpath_jars.get(key)
+                if entry is None or entry[0] != stamp:
+                    top_classes = ldd.get_classes([top])
+                else:
+                    top_classes = entry[1]
+                self.classpath_jars[key] = (stamp, top_classes, self.request)
+            else:
+                top_classes = ldd.get_classes([top])
+            for classname, owner in top_classes.iteritems():
+                if classname not in results:
+                    results[classname] = owner
+        return results
+
+    def end_request(self):
+        """Drop the entries that the last CACHE_IDLE_REQUESTS requests haven't used"""
+        for cache in (self.files, self.classpath_jars):
+            for key, entry in cache.items():
+                if self.request - entry[2] >= CACHE_IDLE_REQUESTS:
+                    del cache[key]
+                    self.evicted += 1
+        self.request += 1
+
+    def status(self):
+        return (u"%d cached files, %d cached class path jars, %d hits, %d misses, %d evicted\n" %
+                (len(self.files), len(self.classpath_jars), self.hits, self.misses, self.evicted))
+
+
+class _FrameWriter(object):
+    """Buffered binary file-like object that sends its data as frames on a channel"""
+
+    def __init__(self, wfile, channel):
+        self.wfile = wfile
+        self.channel = channel
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode("utf-8")
+        self.parts.append(data)
+        self.size += len(data)
+        if self.size >= jnm.OUTPUT_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            data = "".join(self.parts)
+            self.wfile.write(self.channel + su4(len(data)) + data)
+            self.parts = []
+            self.size = 0
+        self.wfile.flush()
+
+
+def _run_jnm(cache, argv, stream):
+    nm.main(argv, cache.load_symbols, stream, allow_watch=False)
+
+
+def _run_jldd(cache, argv, stream):
+    ldd.main(argv, cache.load_symbols, stream, cache.get_classes)
+
+
+def _run_status(cache, argv, stream):
+    stream.write(cache.status())
+
+
+TOOLS = {"jnm": _run_jnm,
+         "jldd": _run_jldd,
+         "status": _run_status}
+
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        self.server.run_request(request, self.wfile)
+
+
+class AnalysisServer(SocketServer.UnixStreamServer):
+    """Sequential server; requests share the module-level state of jnm and jvmspec"""
+
+    def __init__(self, socket_path):
+        SocketServer.UnixStreamServer.__init__(self, socket_path, _RequestHandler)
+        self.cache = AnalysisCache()
+        self.stopping = False
+
+    def run_request(self, request, wfile):
+        out = _FrameWriter(wfile, STDOUT_CHANNEL)
+        err = _FrameWriter(wfile, STDERR_CHANNEL)
+        saved_stderr = sys.stderr
+        saved_cwd = os.getcwd()
+        saved_classpath = os.environ.get("CLASSPATH")
+        status = 0
+        try:
+            sys.stderr = err
+            os.chdir(request.get("cwd", saved_cwd))
+            _set_classpath(request.get("classpath"))
+            jvmspec.set_pointer_size(_DEFAULT_POINTER_SIZE)
+            jnm.set_sort_memory_limit(_DEFAULT_SORT_MEMORY_LIMIT)
+            tool = request.get("tool")
+            if tool == "stop":
+                self.stopping = True
+            elif tool in TOOLS:
+                TOOLS[tool](self.cache, [arg.encode("utf-8") for arg in request.get("argv", [])], out)
+            else:
+                print >> err, "Unknown tool %s" % tool
+                status = 1
+        except SystemExit, e:
+            if isinstance(e.code, int):
+                status = e.code
+            elif e.code is not None:
+                print >> err, e.code
+                status = 1
+        except Exception:
+            traceback.print_exc(file=err)
+            status = 1
+        finally:
+            sys.stderr = saved_stderr
+            os.chdir(saved_cwd)
+            _set_classpath(saved_classpath)
+            # A failed request may leave --stats or --trace collecting
+            run_stats.reset()
+            tracer.stop()
+            self.cache.end_request()
+        try:
+            out.flush()
+            err.flush()
+            wfile.write(EXIT_CHANNEL + su4(len(str(status))) + str(status))
+        except socket.error:
+            pass  # client went away
+
+    def serve_until_stopped(self):
+        while not self.stopping:
+            self.handle_request()
+
+
+def _set_classpath(classpath):
+    if classpath is None:
+        os.environ.pop("CLASSPATH", None)
+    else:
+        os.environ["CLASSPATH"] = classpath
+
+
+def serve(socket_path=DEFAULT_SOCKET):
+    """Run the daemon on the given socket until it is asked to stop"""
+    if os.path.exists(socket_path):
+        # Only replace the socket if nothing is listening on it
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except socket.error:
+            os.remove(socket_path)
+        else:
+            raise EnvironmentError(errno.EADDRINUSE, "Daemon already running", socket_path)
+        finally:
+            probe.close()
+    server = AnalysisServer(socket_path)
+    try:
+        server.serve_until_stopped()
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+def request(tool, argv, socket_path=DEFAULT_SOCKET):
+    """Send a request to the daemon, copying its output to stdout/stderr; returns the exit status"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    try:
+        sock.sendall(json.dumps({"tool": tool,
+                                 "argv": [arg.decode("utf-8") for arg in argv],
+                                 "cwd": os.getcwd().decode("utf-8"),
+                                 "classpath": os.environ.get("CLASSPATH")}) + "\n")
+        rfile = sock.makefile("rb")
+        streams = {STDOUT_CHANNEL: sys.stdout, STDERR_CHANNEL: sys.stderr}
+        while True:
+            header = rfile.read(5)
+            if len(header) < 5:
+                print >> sys.stderr, "Connection to daemon lost"
+                return 1
+            channel = header[0]
+            length = struct.unpack(">L", header[1:])[0]
+            data = rfile.read(length)
+            if channel == EXIT_CHANNEL:
+                sys.stdout.flush()
+                return int(data)
+            elif channel in streams:
+                streams[channel].write(data)
+    finally:
+        sock.close()
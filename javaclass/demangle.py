@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Demangling of name:descriptor text in arbitrary (byte string) input.
+
+Fields and methods are found with a single regular expression pass, and the
+demangled form of each distinct descriptor is remembered.  Input is processed
+in blocks of whole lines; since no match can span a newline, each block can be
+demangled independently, including in separate processes.
+"""
+import re
+import os
+import multiprocessing
+
+from jvmspec import demangle_field_descriptor, demangle_method_descriptor, fqcn
+from stats import run_stats
+
+BASE_TYPE = r'[BCDFIJSZ]'
+BASE_TYPE_V = r'[BCDFIJSZV]'  # V for void, allowed as return type
+OBJECT_TYPE = r'L\S+;'
+
+FIELD_DESCRIPTOR = r'\[*(?:' + BASE_TYPE + r'|' + OBJECT_TYPE + r')'
+FIELD_DESCRIPTOR_V = r'\[*(?:' + BASE_TYPE_V + r'|' + OBJECT_TYPE + r')'
+
+RE_NAME_DESCRIPTOR = re.compile(r'(?P<name>\S+):(?P<descriptor>%s|\(%s*\)%s)' %
+                                (FIELD_DESCRIPTOR, FIELD_DESCRIPTOR, FIELD_DESCRIPTOR_V))
+
+# Size of each block of input
+BLOCK_SIZE = 1 << 20
+# Number of demangled descriptors to remember before starting again
+MEMO_LIMIT = 100000
+
+_memo = {}  # descriptor => (text before name, text after name)
+
+
+def _demangled_parts(descriptor):
+    parts = _memo.get(descriptor)
+    if parts is None:
+        udescriptor = descriptor.decode("utf-8")
+        if udescriptor.startswith(u"("):
+            params, return_type = demangle_method_descriptor(udescriptor)
+            parts = ((u"%s " % return_type).encode("utf-8"),
+                     (u"(%s)" % u", ".join(params)).encode("utf-8"))
+        else:
+            field_type = demangle_field_descriptor(udescriptor)[0]
+            parts = ((u"%s " % fqcn(field_type)).encode("utf-8"), "")
+        if len(_memo) >= MEMO_LIMIT:
+            _memo.clear()
+        _memo[descriptor] = parts
+    return parts
+
+
+def _replace(m):
+    try:
+        before, after = _demangled_parts(m.group('descriptor'))
+    except UnicodeDecodeError:
+        return m.group(0)
+    return before + m.group('name') + after
+
+
+def demangle(text):
+    """Replace each name:descriptor in a UTF-8 byte string with its demangled form"""
+    return RE_NAME_DESCRIPTOR.sub(_replace, text)
+
+
+def iter_blocks(infile, block_size=BLOCK_SIZE):
+    """Generate blocks of whole lines read from infile"""
+    partial = ""
+    while True:
+        data = infile.read(block_size)
+        if not data:
+            break
+        data = partial + data
+        end = data.rfind("\n") + 1
+        if end == 0:
+            partial = data
+            continue
+        partial = data[end:]
+        yield data[:end]
+    if partial:
+        yield partial
+
+
+def demangle_stream(infile, outfile):
+    """Copy infile to outfile, demangling a block of lines at a time"""
+    for block in iter_blocks(infile):
+        run_stats.bytes += len(block)
+        outfile.write(demangle(block))
+
+
+def _file_ranges(filename, block_size):
+    # Return (filename, start, end) for blocks of whole lines in a file
+    ranges = []
+    size = os.path.getsize(filename)
+    with open(filename, "rb") as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + block_size, size))
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((filename, start, end))
+            start = end
+    return ranges
+
+
+def _demangle_range(file_range):
+    filename, start, end = file_range
+    with open(filename, "rb") as f:
+        f.seek(start)
+        return demangle(f.read(end - start))
+
+
+def demangle_files_parallel(filenames, outfile, processes, block_size=BLOCK_SIZE):
+    """Demangle files using a pool of processes, writing the results in order"""
+    ranges = []
+    for filename in filenames:
+        ranges.extend(_file_ranges(filename, block_size))
+    pool = multiprocessing.Pool(processes)
+    try:
+        for block in pool.imap(_demangle_range, ranges):
+            run_stats.bytes += len(block)
+            outfile.write(block)
+    finally:
+        pool.terminate()
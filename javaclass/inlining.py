@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Report of the methods whose bytecode is too large for the HotSpot JIT to
+inline or compile them.
+
+HotSpot's limits apply to the length of a method's bytecode:
+ - MaxInlineSize (35): larger methods are only inlined if they are hot
+ - FreqInlineSize (325): larger methods are not inlined even if they are hot
+ - HugeMethodLimit (8000): larger methods are not compiled at all (unless
+   -XX:-DontCompileHugeMethods is given)
+
+Each method is shown with the number of invoke instructions in the input that
+may call it, resolved through the class hierarchy as for the call graph: a
+call made through a subclass counts for the inherited method, and a virtual or
+interface call counts for every method it may dispatch to.
+"""
+from classfile import CodeAttributeInfo
+from jvmspec import fqcn
+from jnm import load_classes
+from callgraph import CallGraphBuilder
+from stats import run_stats
+
+DEFAULT_MAX_INLINE_SIZE = 35
+DEFAULT_FREQ_INLINE_SIZE = 325
+DEFAULT_HUGE_METHOD_LIMIT = 8000
+
+# Names for the limits that a method exceeds, from the most severe
+HUGE = "huge"
+NOT_INLINED = "freq-inline"
+NOT_INLINED_COLD = "max-inline"
+
+
+class Limits(object):
+    """The bytecode sizes at which methods stop being inlined or compiled"""
+
+    def __init__(self, max_inline_size=DEFAULT_MAX_INLINE_SIZE, freq_inline_size=DEFAULT_FREQ_INLINE_SIZE,
+                 huge_method_limit=DEFAULT_HUGE_METHOD_LIMIT):
+        self.max_inline_size = max_inline_size
+        self.freq_inline_size = freq_inline_size
+        self.huge_method_limit = huge_method_limit
+
+    def exceeded(self, size):
+        """Return the name of the most severe limit that a method of the given size exceeds, or None"""
+        if size > self.huge_method_limit:
+            return HUGE
+        elif size > self.freq_inline_size:
+            return NOT_INLINED
+        elif size > self.max_inline_size:
+            return NOT_INLINED_COLD
+        return None
+
+
+class MethodSizes(object):
+    """Code size of each method and count of the call sites that may call it"""
+
+    def __init__(self):
+        self.sizes = {}  # method unique name => bytecode length
+        self.calls = CallGraphBuilder()
+
+    def add_class(self, class_file):
+        self.calls.add_class(class_file)
+        jcls = fqcn(unicode(class_file.this_class))
+        constants = class_file.constants
+        for m in class_file.methods:
+            for attr in m.attributes:
+                if isinstance(attr, CodeAttributeInfo):
+                    name = u"%s.%s:%s" % (jcls, constants[m.name_index - 1], m.get_descriptor())
+                    self.sizes[name] = len(attr.code)
+
+    def add(self, filenames):
+        """Add the methods and call sites of the given class/jar files"""
+        for jarfile, classfile, class_file in load_classes(filenames):
+            with run_stats.phase("scan", classfile):
+                self.add_class(class_file)
+
+    def call_sites(self):
+        """Return method unique name => count of the invoke instructions that may call it"""
+        return self.calls.call_site_counts()
+
+
+def method_report(filenames, limits=None, everything=False, by_sites=False):
+    """Return a list of (size, call sites, limit exceeded, method unique name) for the given class/jar files.
+
+    Only methods that exceed a limit are included unless everything is set.
+    The list is ordered by size, then call sites (or the other way round if
+    by_sites is set), largest first."""
+    if limits is None:
+        limits = Limits()
+    sizes = MethodSizes()
+    sizes.add(filenames)
+    with run_stats.phase("report"):
+        sites = sizes.call_sites()
+        results = []
+        for name, size in sizes.sizes.iteritems():
+            limit = limits.exceeded(size)
+            if limit is not None or everything:
+                results.append((size, sites.get(name, 0), limit, name))
+        if by_sites:
+            results.sort(key=lambda x: (-x[1], -x[0], x[3]))
+        else:
+            results.sort(key=lambda x: (-x[0], -x[1], x[3]))
+    return results
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Symbol-level differences between two jar files.
+
+Class file entries are paired by name.  Entries whose CRC and uncompressed
+size match in the two jars' zip directories are assumed identical and are
+never decompressed; only the remaining entries are parsed and their symbols
+compared.
+"""
+import zipfile
+
+from classfile import ClassFile
+from jnm import resolve_class
+from stats import run_stats
+
+ADDED = u"+"
+REMOVED = u"-"
+CHANGED = u"~"
+
+
+def _class_entries(zf):
+    return dict([(info.filename, info) for info in zf.infolist() if info.filename.endswith(".class")])
+
+
+def _same_entry(old_info, new_info):
+    return old_info.CRC == new_info.CRC and old_info.file_size == new_info.file_size
+
+
+class JarDiff(object):
+    """Iterable of (marker, entry name, symbol, old symbol) for each difference between two jars.
+
+    The marker is ADDED, REMOVED or CHANGED; the old symbol is only set for
+    CHANGED, where a symbol has the same name but a different value or type.
+    Only definitions are compared, unless include_refs is set, in which case
+    references that the class does not resolve itself are compared too."""
+
+    def __init__(self, old_jar, new_jar, include_refs=False):
+        self.old_jar = old_jar
+        self.new_jar = new_jar
+        self.include_refs = include_refs
+        # Entry counts, filled in during iteration
+        self.unchanged = 0
+        self.compared = 0
+        self.added = 0
+        self.removed = 0
+
+    def _symbols(self, zf, name):
+        with run_stats.phase("read"):
+            data = zf.read(name)
+        run_stats.classes += 1
+        run_stats.bytes += len(data)
+        with run_stats.phase("parse", name):
+            c = ClassFile(data)
+        with run_stats.phase("scan", name):
+            symbols = c.dump()
+        run_stats.symbols += len(symbols)
+        with run_stats.phase("resolve"):
+            entries = resolve_class([(None, name, sym) for sym in symbols])
+            return [sym for jarfile, classfile, sym in entries if self.include_refs or sym.is_def()]
+
+    def __iter__(self):
+        old_zf = zipfile.ZipFile(self.old_jar, "r")
+        new_zf = zipfile.ZipFile(self.new_jar, "r")
+        try:
+            old_entries = _class_entries(old_zf)
+            new_entries = _class_entries(new_zf)
+            for name in sorted(set(old_entries) | set(new_entries)):
+                if name not in new_entries:
+                    self.removed += 1
+                    for sym in self._symbols(old_zf, name):
+                        yield REMOVED, name, sym, None
+                elif name not in old_entries:
+                    self.added += 1
+                    for sym in self._symbols(new_zf, name):
+                        yield ADDED, name, sym, None
+                elif _same_entry(old_entries[name], new_entries[name]):
+                    self.unchanged += 1
+                else:
+                    self.compared += 1
+                    for marker, sym, old_sym in diff_symbols(self._symbols(old_zf, name),
+                                                             self._symbols(new_zf, name)):
+                        yield marker, name, sym, old_sym
+        finally:
+            old_zf.close()
+            new_zf.close()
+
+
+def _key(sym):
+    return (sym.is_def(), sym.unique_name)
+
+
+def diff_symbols(old_symbols, new_symbols):
+    """Generate (marker, symbol, old symbol) for the differences between two lists of symbols"""
+    old_by_key = dict([(_key(sym), sym) for sym in old_symbols])
+    new_keys = set([_key(sym) for sym in new_symbols])
+    for sym in old_symbols:
+        if _key(sym) not in new_keys:
+            yield REMOVED, sym, None
+    for sym in new_symbols:
+        old_sym = old_by_key.get(_key(sym))
+        if old_sym is None:
+            yield ADDED, sym, None
+        elif old_sym.value != sym.value or old_sym.symtype != sym.symtype:
+            yield CHANGED, sym, old_sym
@@ -2,22 +2,48 @@ import os
 import zipfile
 
 import classfile
+from tracing import tracer
+
+
+def jar_class_infos(filename):
+    """Return the ZipInfo of each class file in a jar file, without reading them"""
+    zf = zipfile.ZipFile(filename, "r")
+    try:
+        return [info for info in zf.infolist() if os.path.splitext(info.filename)[1] == ".class"]
+    finally:
+        zf.close()
+
+
+def iter_jar_class_data(filename):
+    """Generate the contents of the class files in a jar file.
+
+    Each entry is a 2-tuple of (ZipInfo, data)"""
+    zf = zipfile.ZipFile(filename, "r")
+    try:
+        for info in zf.infolist():
+            _, ext = os.path.splitext(info.filename)
+            if ext == ".class":
+                with tracer.span("read", file=info.filename):
+                    data = zf.open(info).read()
+                yield (info, data)
+    finally:
+        zf.close()
+
+
+def iter_jar_classes(filename):
+    """Generate the classes in a jar file, parsing each one as it is reached.
+
+    Each entry is a 2-tuple of (filename, ClassFile)"""
+    for info, in_data in iter_jar_class_data(filename):
+        jc = classfile.ClassFile(in_data)
+        yield (info.filename, jc)
 
 
 def jar_classes(filename):
     """Return a list of the classes in a jar file.
 
     Each entry is a 2-tuple of (filename, ClassFile)"""
-    zf = zipfile.ZipFile(filename, "r")
-    classes = []
-    for info in zf.infolist():
-        _, ext = os.path.splitext(info.filename)
-        if ext == ".class":
-            in_data = zf.open(info).read()
-            jc = classfile.ClassFile(in_data)
-            classes.append((info.filename, jc))
-    zf.close()
-    return classes
+    return list(iter_jar_classes(filename))
 
 if __name__ == "__main__":
     import sys
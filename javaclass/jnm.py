@@ -18,6 +18,14 @@
 import sys
 import struct
 import getopt
+import io
+import codecs
+import heapq
+import cPickle
+import tempfile
+import itertools
+import hashlib
+import zlib
 
 import jvmspec
 from jvmspec import fqcn
@@ -28,6 +36,29 @@ from classfile import (ClassInfo, FieldRefInfo, MethodRefInfo,
                        FieldInfo, MethodInfo,
                        CodeAttributeInfo, ExceptionsAttributeInfo,
                        ClassFile)
+from jarfile import iter_jar_class_data, jar_class_infos
+from stats import run_stats
+from tracing import tracer
+
+
+# Class names, symbol names and descriptors recur across many symbols, so share
+# a single copy of each.  (The builtin intern() only accepts byte strings.)
+# The table is emptied when it reaches INTERN_LIMIT strings, so that long-lived
+# processes (jnmd, jnm --watch) don't keep every string they have ever seen.
+INTERN_LIMIT = 200000
+
+_interned = {}
+
+
+def _intern(s):
+    if s is None:
+        return None
+    shared = _interned.get(s)
+    if shared is None:
+        if len(_interned) >= INTERN_LIMIT:
+            _interned.clear()
+        shared = _interned[s] = s
+    return shared
 
 
 class Symbol(object):
@@ -53,34 +84,59 @@ class Symbol(object):
 
     DEF_SYMTYPES = set((CLASS, DATA, CODE, INSTANCE_DATA))
     REF_SYMTYPES = set((REF_CLASS, REF_DATA, REF_CODE, REF_INSTANCE_DATA))
+    CLASS_SYMTYPES = set((CLASS, CLASS.lower(), REF_CLASS, REF_CLASS.lower()))
+
+    __slots__ = ('value', 'symtype', 'jcls', 'symname', 'descriptor', '_unique_name', '_hash')
 
     def __init__(self, value, symtype, jcls, symname, descriptor):
         self.value = value
         self.symtype = symtype
         # Class owning the symbol
-        self.jcls = jcls
+        self.jcls = _intern(jcls)
         # Unqualified name of the symbol.  Non-unique even within a class
         # (method overloading means that the signature is needed for
         # uniqueness)
-        self.symname = symname
+        self.symname = _intern(symname)
         # Descriptor of the symbol (None for Classes)
-        self.descriptor = descriptor
-
-        if self.symtype.upper() == Symbol.CLASS or self.symtype.upper() == Symbol.REF_CLASS:
-            self.unique_name = self.jcls
-        else:
-            self.unique_name = "%s.%s:%s" % (self.jcls, self.symname, self.descriptor)
-            # (don't actually need the :<descriptor> suffix to make fields unique)
+        self.descriptor = _intern(descriptor)
+        # Built on first use
+        self._unique_name = None
+        self._hash = None
+
+    def is_class(self):
+        return self.symtype in Symbol.CLASS_SYMTYPES
+
+    @property
+    def unique_name(self):
+        if self._unique_name is None:
+            if self.is_class():
+                self._unique_name = self.jcls
+            else:
+                self._unique_name = u"%s.%s:%s" % (self.jcls, self.symname, self.descriptor)
+                # (don't actually need the :<descriptor> suffix to make fields unique)
+        return self._unique_name
 
+    # Hashing and equality use the fields that make up unique_name, rather
+    # than building it.
     def __hash__(self):
-        return hash(self.value) ^ hash(self.symtype) ^ hash(self.unique_name)
+        if self._hash is None:
+            if self.is_class():
+                self._hash = hash((self.value, self.symtype, self.jcls))
+            else:
+                self._hash = hash((self.value, self.symtype, self.jcls, self.symname, self.descriptor))
+        return self._hash
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if not isinstance(other, Symbol):
             return False
-        return (self.value == other.value and
-                self.symtype == other.symtype and
-                self.unique_name == other.unique_name)
+        if (self.value != other.value or
+            self.symtype != other.symtype or
+            self.jcls != other.jcls):
+            return False
+        return self.is_class() or (self.symname == other.symname and
+                                   self.descriptor == other.descriptor)
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -90,7 +146,7 @@ class Symbol(object):
             intro = u"        "
         else:
             intro = u"%08x" % self.value
-        if self.symtype.upper() == Symbol.CLASS or self.symtype.upper() == Symbol.REF_CLASS:
+        if self.is_class():
             return u"%s %s %s" % (intro, self.symtype, self.jcls)
         else:
             return u"%s %s %s.%s:%s" % (intro, self.symtype, self.jcls, self.symname, self.descriptor)
@@ -109,7 +165,7 @@ class Symbol(object):
             intro = u"        "
         else:
             intro = u"%08x" % self.value
-        if self.symtype.upper() == Symbol.CLASS or self.symtype.upper() == Symbol.REF_CLASS:
+        if self.is_class():
             return u"%s %s %s" % (intro, self.symtype, self.jcls)
         elif self.symtype.upper() == Symbol.CODE or self.symtype.upper() == Symbol.REF_CODE:
             params, return_type = demangle_method_descriptor(self.descriptor)
@@ -208,6 +264,7 @@ MethodInfo.dump = _MethodInfo_dump
 def _CodeAttributeInfo_dump(self):
     results = []
     ii = 0
+    instructions = 0
     while ii < len(self.code):
         opcode = ord(self.code[ii])
         if opcode not in jvmspec.BYTECODES:
@@ -277,6 +334,8 @@ def _CodeAttributeInfo_dump(self):
                 else:  # Symbol.REF_CLASS
                     results.append(Symbol(None, symtype, jcls, jcls, None))
         ii += op_size + 1
+        instructions += 1
+    run_stats.instructions += instructions
     for exc in self.exception_table:
         if exc.catch_type != 0:
             descriptor, jcls, symname = findref(self.class_file, exc.catch_type)
@@ -370,7 +429,23 @@ def find_owner_method(methods, syminfo):
 
 
 def _resolve_scope(scopefn, symlist):
-    """Remove duplicate symbol info and resolve internal references across all classes"""
+    """Remove duplicate symbol info and resolve internal references across all classes.
+
+    Each run of consecutive entries that share a scope is resolved as soon as
+    it is complete, so only one scope's symbols are held in memory at once.
+    The entries of each scope must therefore arrive together; load the files
+    in the order given by _Opts.load_order."""
+    for scope, entries in itertools.groupby(symlist, lambda x: scopefn(x[0], x[1])):
+        if tracer.enabled:
+            # Read the whole run first, so that the span only covers resolution
+            entries = list(entries)
+        with tracer.span("resolve", scope=scope):
+            resolved = _resolve_run(scopefn, entries)
+        for entry in resolved:
+            yield entry
+
+
+def _resolve_run(scopefn, symlist):
     # Pass 1: Remove duplicates and track definitions
     deduped = []
     seen = {}  # map from scope to set of seen symbols
@@ -424,7 +499,8 @@ def _resolve_scope(scopefn, symlist):
     return resolved
 
 
-# Filter functions; take a list of 3-tuples (jarfile, classfile, symbol)
+# Filter functions; take an iterable of 3-tuples (jarfile, classfile, symbol).
+# Only the resolve_* filters need to hold symbols in memory.
 def resolve_class(symlist):
     # Resolve references only within <jarfile, classfile>
     return _resolve_scope(lambda x, y: (x, y), symlist)
@@ -441,47 +517,190 @@ def resolve_all(symlist):
 
 
 def remove_nonclass(symlist):
-    results = []
     for jarfile, classfile, syminfo in symlist:
-        if (syminfo.symtype.upper() == Symbol.CLASS or
-            syminfo.symtype.upper() == Symbol.REF_CLASS):
-            results.append((jarfile, classfile, syminfo))
+        if syminfo.is_class():
+            yield (jarfile, classfile, syminfo)
         # convert a reference to a field or method in a class to a reference to owning class
         elif syminfo.symtype.upper() in Symbol.REF_SYMTYPES:
-            results.append((jarfile, classfile,
-                            Symbol(None,
-                                   Symbol.REF_CLASS,
-                                   syminfo.jcls,
-                                   syminfo.jcls,
-                                   None)))
-    return results
+            yield (jarfile, classfile,
+                   Symbol(None,
+                          Symbol.REF_CLASS,
+                          syminfo.jcls,
+                          syminfo.jcls,
+                          None))
 
 
 def remove_defined(symlist):
-    return [sym for sym in symlist if sym[2].is_ref()]
+    return (sym for sym in symlist if sym[2].is_ref())
 
 
 def remove_undefined(symlist):
-    return [sym for sym in symlist if sym[2].is_def()]
+    return (sym for sym in symlist if sym[2].is_def())
 
 
 def remove_private(symlist):
-    return [sym for sym in symlist if sym[2].symtype.isupper()]
+    return (sym for sym in symlist if sym[2].symtype.isupper())
 
 # All filter functions in the order they should be applied
 ALL_FILTER_FNS = (remove_nonclass, resolve_class, resolve_jar, resolve_all, remove_private, remove_defined, remove_undefined)
 
 
-# Sort functions; take a list of 3-tuples (jarfile, classfile, symbol)
-def alphabetic_sort(symlist):
+# Sorting more than this many symbols spills sorted runs to temporary files,
+# which are then merged as the output is read.
+SORT_MEMORY_LIMIT = 500000
+# Smallest allowed SORT_MEMORY_LIMIT
+MIN_SORT_MEMORY_LIMIT = 1000
+# Number of entries pickled together in a spilled run
+_SPILL_BLOCK_SIZE = 1000
+# Most runs merged at once (each spilled run holds a file open); more runs
+# than this are first merged in groups into longer spilled runs
+_MERGE_FAN_IN = 128
+# Sort position of symbols with no value
+_UNDEFINED_VALUE = 0xFFFFFFFF
+
+
+def set_sort_memory_limit(limit):
+    if limit < MIN_SORT_MEMORY_LIMIT:
+        raise ValueError("Sort memory limit %d is below the minimum of %d" % (limit, MIN_SORT_MEMORY_LIMIT))
+    global SORT_MEMORY_LIMIT
+    SORT_MEMORY_LIMIT = limit
+
+
+class _SpilledRun(object):
+    """Sorted sequence of (key, seq, entry) tuples held in a temporary file"""
+
+    def __init__(self, items):
+        self.tmpfile = tempfile.TemporaryFile()
+        self.offsets = []
+        items = iter(items)
+        while True:
+            block = list(itertools.islice(items, _SPILL_BLOCK_SIZE))
+            if not block:
+                break
+            self.offsets.append(self.tmpfile.tell())
+            cPickle.dump(block, self.tmpfile, cPickle.HIGHEST_PROTOCOL)
+
+    def _block(self, offset):
+        self.tmpfile.seek(offset)
+        return cPickle.load(self.tmpfile)
+
+    def close(self):
+        self.tmpfile.close()
+
+    def __iter__(self):
+        for offset in self.offsets:
+            for item in self._block(offset):
+                yield item
+
+    def __reversed__(self):
+        for offset in reversed(self.offsets):
+            for item in reversed(self._block(offset)):
+                yield item
+
+
+def _merge_runs(runs):
+    """Merge spilled runs into a single new spilled run, closing them"""
+    # The seq values are unique, so the entries themselves are never compared
+    merged = _SpilledRun(heapq.merge(*runs))
+    for run in runs:
+        run.close()
+    return merged
+
+
+class _Descending(object):
+    """Wrapper that inverts the ordering of a sort key"""
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+class _SortedRuns(object):
+    """Iterable over the merge of sorted runs of (key, seq, entry) tuples"""
+
+    def __init__(self, runs, reverse=False):
+        self.runs = runs
+        self.reverse = reverse
+
+    def __iter__(self):
+        if self.reverse:
+            # The seq values make every key unique, so the merge is the exact
+            # reverse of the forward merge.
+            runs = [((_Descending((key, seq)), entry) for key, seq, entry in reversed(run))
+                    for run in self.runs]
+        else:
+            runs = [(((key, seq), entry) for key, seq, entry in run)
+                    for run in self.runs]
+        for _, entry in heapq.merge(*runs):
+            yield entry
+
+    def reversed(self):
+        return _SortedRuns(self.runs, not self.reverse)
+
+
+def _external_sort(symlist, keyfn):
+    """Stable sort by keyfn, using sorted runs on disk beyond SORT_MEMORY_LIMIT entries"""
+    levels = []  # levels[i] holds spilled runs of up to SORT_MEMORY_LIMIT * _MERGE_FAN_IN ** i entries
+    chunk = []
+    seq = 0
+    for entry in symlist:
+        chunk.append(entry)
+        if len(chunk) >= SORT_MEMORY_LIMIT:
+            items = [(keyfn(entry), seq + ii, entry) for ii, entry in enumerate(chunk)]
+            items.sort()
+            run = _SpilledRun(items)
+            seq += len(chunk)
+            chunk = []
+            # Merge each full level into one run of the level above
+            level = 0
+            while True:
+                if level == len(levels):
+                    levels.append([])
+                levels[level].append(run)
+                if len(levels[level]) < _MERGE_FAN_IN:
+                    break
+                run = _merge_runs(levels[level])
+                levels[level] = []
+                level += 1
+    if not levels:
+        chunk.sort(key=keyfn)
+        return chunk
+    runs = [run for level in levels for run in level]
+    while len(runs) >= _MERGE_FAN_IN:
+        runs = [_merge_runs(runs[:_MERGE_FAN_IN])] + runs[_MERGE_FAN_IN:]
+    items = [(keyfn(entry), seq + ii, entry) for ii, entry in enumerate(chunk)]
+    items.sort()
+    runs.append(items)
+    return _SortedRuns(runs)
+
+
+# Sort functions; take an iterable of 3-tuples (jarfile, classfile, symbol)
+def _alphabetic_key(entry):
+    jarfile, classfile, sym = entry
     # Symbols within the class don't have a class prefix; add it, so the alpha sort is sensible
-    return sorted(symlist, key=lambda x: "%s:%s:%s" % (x[0], x[1],
-                                                       "%s.%s" % (x[1], x[2].symname) if x[2].is_def() else x[2].symname))
+    if sym.is_def():
+        return (jarfile, classfile, classfile + u"." + sym.symname)
+    else:
+        return (jarfile, classfile, sym.symname)
+
+
+def _numeric_key(entry):
+    jarfile, classfile, sym = entry
+    return (jarfile, classfile, _UNDEFINED_VALUE if sym.value is None else sym.value)
+
+
+def alphabetic_sort(symlist):
+    return _external_sort(symlist, _alphabetic_key)
 
 
 def numeric_sort(symlist):
-    # Expand numbers and None to ensure alpha sort works as intended
-    return sorted(symlist, key=lambda x: "%s:%s:%s" % (x[0], x[1], "FFFFFFFF" if x[2].value is None else "%08x" % x[2].value))
+    return _external_sort(symlist, _numeric_key)
 
 
 def noop_sort(symlist):
@@ -489,10 +708,125 @@ def noop_sort(symlist):
 
 
 def reverse_sort(symlist):
+    if isinstance(symlist, _SortedRuns):
+        return symlist.reversed()
+    if not isinstance(symlist, list):
+        symlist = list(symlist)
     symlist.reverse()
     return symlist
 
 
+class LoadCounters(object):
+    """Counts of the work done (and skipped) by load_symbols"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.classes = 0
+        self.parsed = 0
+        self.reused = 0
+        self.reused_bytes = 0
+
+    def summary(self):
+        return ("%d classes: %d parsed, %d identical to an earlier class and not parsed (%d bytes)" %
+                (self.classes, self.parsed, self.reused, self.reused_bytes))
+
+load_counters = LoadCounters()
+
+
+def _class_data(filenames):
+    # Generate (jarfile, classfile, (CRC, size), data) for each class
+    for arg in filenames:
+        if arg.endswith(".jar"):
+            # The jar's span covers all the work done on its classes
+            with tracer.span("jar", file=arg):
+                for info, data in run_stats.iterate("read", iter_jar_class_data(arg)):
+                    run_stats.classes += 1
+                    run_stats.bytes += len(data)
+                    yield (arg, info.filename, (info.CRC, info.file_size), data)
+        else:
+            with run_stats.phase("read", arg):
+                with open(arg, "rb") as f:
+                    data = f.read()
+            run_stats.classes += 1
+            run_stats.bytes += len(data)
+            yield (None, arg, (zlib.crc32(data) & 0xFFFFFFFF, len(data)), data)
+
+
+def _shared_content_keys(filenames):
+    # Return the (CRC, size) keys that more than one class in the jar files has;
+    # only the jars' directories are read for this.  (Loose class files would
+    # have to be read in full, so they are left to load_symbols.)
+    counts = {}
+    for arg in filenames:
+        if arg.endswith(".jar"):
+            for info in jar_class_infos(arg):
+                key = (info.CRC, info.file_size)
+                counts[key] = counts.get(key, 0) + 1
+    return set([key for key, count in counts.iteritems() if count > 1])
+
+
+def load_classes(filenames):
+    """Generate (jarfile, classfile, ClassFile) 3-tuples for each of the given class or jar files"""
+    for jarfile, filename, key, data in _class_data(filenames):
+        with run_stats.phase("parse", filename):
+            c = ClassFile(data)
+        yield (jarfile, filename, c)
+
+
+def load_symbols(filenames):
+    """Generate (jarfile, classfile, symbol) 3-tuples for each of the given class or jar files.
+
+    Classes with identical contents (such as copies in fat or shaded jars) are
+    only parsed once; later copies reuse the earlier copy's symbols.  Only loose
+    class files, and jar classes whose CRC and size match another jar class or
+    an earlier loose class file, are hashed and remembered."""
+    shared = _shared_content_keys(filenames)
+    seen = {}  # content digest => (class, superclass, interfaces, symbols)
+    for jarfile, filename, key, data in _class_data(filenames):
+        load_counters.classes += 1
+        digest = None
+        if jarfile is None:
+            shared.add(key)
+        if key in shared:
+            digest = hashlib.sha1(data).digest()
+            if digest in seen:
+                jcls, parent, interfaces, symbols = seen[digest]
+                _class_parent[jcls] = parent
+                _class_interfaces[jcls] = interfaces
+                load_counters.reused += 1
+                load_counters.reused_bytes += len(data)
+                run_stats.symbols += len(symbols)
+                for sym in symbols:
+                    yield (jarfile, filename, sym)
+                continue
+        with run_stats.phase("parse", filename):
+            c = ClassFile(data)
+        with run_stats.phase("scan", filename):
+            symbols = c.dump()
+        run_stats.symbols += len(symbols)
+        load_counters.parsed += 1
+        if digest is not None:
+            jcls = fqcn(unicode(c.this_class))
+            seen[digest] = (jcls, _class_parent[jcls], _class_interfaces[jcls], symbols)
+        for sym in symbols:
+            yield (jarfile, filename, sym)
+
+
+# Size of the buffer used for output
+OUTPUT_BUFFER_SIZE = 1 << 16
+
+
+def output_stream(stream=None):
+    """Return a buffered UTF-8 writer for unicode output to stdout (or to a binary stream)"""
+    if stream is not None:
+        return codecs.getwriter("utf-8")(stream)
+    sys.stdout.flush()
+    return io.open(sys.stdout.fileno(), "w", encoding="utf-8",
+                   buffering=OUTPUT_BUFFER_SIZE, closefd=False)
+
+
 # Display functions
 def normal_display(jarfile, filename, sym, current):
     return unicode(sym)
@@ -516,9 +850,29 @@ def demangle(jarfile, filename, sym, current):
 ALL_DISPLAY_FNS = (name_only, normal_display, demangle, prepend_filename)
 
 
+def _apply(fn, symlist):
+    # A columnar symtable.SymbolTable has its own equivalent of each filter/sort function
+    if hasattr(symlist, "apply"):
+        return symlist.apply(fn)
+    else:
+        return fn(symlist)
+
+
+def _timed(phase, symlist):
+    # Charge the work done as symbols are drawn from a lazy symlist to a phase
+    if hasattr(symlist, "apply") or isinstance(symlist, list):
+        return symlist
+    return run_stats.iterate(phase, symlist)
+
+
 class _Opts(object):
     # short option, long option, help messsage, filter function, sort function, display function
-    OPT_INFO = (("h", "help", "show this help", None, None, None),)
+    OPT_INFO = (("h", "help", "show this help", None, None, None),
+                ("", "stats", "Write the time and memory used by each phase to stderr", None, None, None),
+                ("", "trace=", "Write a Chrome trace-event file of the work done to arg", None, None, None))
+    # Set by --stats and --trace
+    stats = False
+    trace = None
 
     def __init__(self, message):
         self.message = message
@@ -549,18 +903,49 @@ class _Opts(object):
                                                           optinfo[2])
         sys.exit(err)
 
+    def load_order(self, filenames):
+        """Return the files to load for filenames, so that each resolution scope's symbols arrive together.
+
+        The resolve_* filters resolve each run of symbols that share a scope as
+        soon as it ends, so a file named twice is only loaded once, and with
+        resolve_jar (where all loose class files share one scope) the loose
+        class files are loaded together, where the first of them was named."""
+        loaded = []
+        seen = set()
+        for filename in filenames:
+            if filename not in seen:
+                seen.add(filename)
+                loaded.append(filename)
+        if resolve_jar not in self.filters:
+            return loaded
+        loose = [filename for filename in loaded if not filename.endswith(".jar")]
+        if not loose:
+            return loaded
+        first = loaded.index(loose[0])
+        return loaded[:first] + loose + [filename for filename in loaded[first:] if filename.endswith(".jar")]
+
     def process(self, symlist):
+        with run_stats.phase("resolve"):
+            symlist = _timed("resolve", self.filter(symlist))
+        with run_stats.phase("sort"):
+            symlist = _timed("sort", self.sort(symlist))
+        return symlist
+
+    def filter(self, symlist, filter_fns=ALL_FILTER_FNS):
         # Apply filters in order
-        for filter in ALL_FILTER_FNS:
+        for filter in filter_fns:
             if filter in self.filters:
-                symlist = filter(symlist)
+                symlist = _apply(filter, symlist)
+        return symlist
+
+    def sort(self, symlist):
         # Special case -- pull reverse_sort to the end
         if reverse_sort in self.sorts:
             self.sorts.remove(reverse_sort)
             self.sorts.append(reverse_sort)
         # Apply sorts in order.
         for sortfn in self.sorts:
-            symlist = sortfn(symlist)
+            symlist = _apply(sortfn, symlist)
         return symlist
 
     def display(self, jarfile, filename, sym):
@@ -571,11 +956,27 @@ class _Opts(object):
                 result = dispfn(jarfile, filename, sym, result)
         return result
 
+    def report_run(self):
+        """Write the --stats report and the --trace file, if they were asked for"""
+        if self.stats:
+            run_stats.report()
+        if self.trace is not None:
+            tracer.stop()
+            tracer.write(self.trace)
+
     def process_opt(self, opt, arg):
         class_opts = self.all_opts()
         if opt in ("-h", "--help"):
             self.usage(0)
             return True
+        elif opt == "--stats":
+            self.stats = True
+            run_stats.start()
+            return True
+        elif opt == "--trace":
+            self.trace = arg
+            tracer.start()
+            return True
         elif opt in class_opts:
             optinfo = class_opts[opt]
             if optinfo[3] is not None:
@@ -589,6 +990,9 @@ class _Opts(object):
             return False
 
     def getopts(self, argv):
+        # Statistics and traces are only collected if this run asks for them
+        run_stats.reset()
+        tracer.stop()
         try:
             opts, args = getopt.getopt(argv,
                                        "".join([optinfo[0] for optinfo in self.OPT_INFO]),
@@ -333,61 +333,146 @@ def fqcn(s):
     return s.replace(u"/", u".")
 
 
-def size_field_descriptor(s):
-    """Return the size in bytes of the field described by the given descriptor"""
-    ii = 0
-    while ii < len(s):
-        c = s[ii]
-        if c == u"[":
-            pass
-        elif c in DESCRIPTOR_SIZE_MAPPING:
-            return DESCRIPTOR_SIZE_MAPPING[c]
+# Number of parsed descriptors to remember before starting again
+DESCRIPTOR_MEMO_LIMIT = 50000
+
+_descriptor_memo = {}  # descriptor => FieldDescriptor or MethodDescriptor
+
+
+class FieldDescriptor(object):
+    """Parsed field type descriptor; JVMSpec 4.3.2.
+
+    code is the descriptor character of the element type (e.g. u"I", u"L"),
+    classname the (dotted) class name for u"L", and dims the number of array
+    dimensions."""
+    __slots__ = ("code", "classname", "dims", "description")
+
+    def __init__(self, code, classname, dims):
+        self.code = code
+        self.classname = classname
+        self.dims = dims
+        if code == u"L":
+            self.description = classname + dims * u"[]"
         else:
-            raise Exception("Unknown descriptor code %s" % c)
-        ii += 1
-    raise Exception("Failed to find single field in %s" % s)
+            self.description = DESCRIPTOR_TYPE_MAPPING[code] + dims * u"[]"
 
+    def size(self):
+        """Size in bytes of the element type, for the current pointer size"""
+        return DESCRIPTOR_SIZE_MAPPING[self.code]
 
-def demangle_field_descriptor(s, void_allowed=False):
-    """Convert field descriptor to a string describing the field.
+    def slots(self):
+        """Number of local variable/operand stack slots taken by a value of this type; JVMSpec 3.6.1"""
+        if self.code == u"V":
+            return 0
+        elif self.dims == 0 and self.code in (u"J", u"D"):
+            return 2
+        else:
+            return 1
 
-    Returns (description, rest)"""
-    # JVMSpec 4.3.2
+    def __unicode__(self):
+        return self.description
+
+
+class MethodDescriptor(object):
+    """Parsed method descriptor; JVMSpec 4.3.3"""
+    __slots__ = ("params", "return_type")
+
+    def __init__(self, params, return_type):
+        self.params = params  # tuple of FieldDescriptor
+        self.return_type = return_type  # FieldDescriptor, code u"V" for void
+
+    def param_slots(self):
+        """Number of local variable slots taken by the parameters (excluding this)"""
+        return sum([param.slots() for param in self.params])
+
+    def __unicode__(self):
+        return u"%s (%s)" % (self.return_type, u", ".join([param.description for param in self.params]))
+
+
+def _parse_field(s, ii, void_allowed=False):
+    # Parse the field descriptor starting at s[ii]; returns (FieldDescriptor, index after it)
     dim = 0
-    ii = 0
     while ii < len(s):
         c = s[ii]
         if c == u"[":
             dim += 1
-        elif c == "V" and void_allowed:
+        elif c == u"V" and void_allowed:
             if dim > 0:
                 raise Exception("Cannot have array of void")
-            return u"void", s[ii + 1:]
-        elif c == "L":
+            return FieldDescriptor(c, None, 0), ii + 1
+        elif c == u"L":
             endpoint = s.find(u";", ii)
             if endpoint == -1:
                 raise Exception("Failed to find end of classname")
-            classname = fqcn(s[ii + 1:endpoint])
-            return classname + dim * u"[]", s[endpoint + 1:]
+            return FieldDescriptor(c, fqcn(s[ii + 1:endpoint]), dim), endpoint + 1
         elif c in DESCRIPTOR_TYPE_MAPPING:
-            return DESCRIPTOR_TYPE_MAPPING[c] + dim * u"[]", s[ii + 1:]
+            return FieldDescriptor(c, None, dim), ii + 1
         else:
             raise Exception("Unknown descriptor code %s" % c)
         ii += 1
     raise Exception("Failed to find single field in %s" % s)
 
 
+def _remember(s, parsed):
+    if len(_descriptor_memo) >= DESCRIPTOR_MEMO_LIMIT:
+        _descriptor_memo.clear()
+    _descriptor_memo[s] = parsed
+    return parsed
+
+
+def parse_field_descriptor(s):
+    """Return a FieldDescriptor for the given (complete) field descriptor"""
+    parsed = _descriptor_memo.get(s)
+    if not isinstance(parsed, FieldDescriptor):
+        parsed, end = _parse_field(s, 0)
+        if end != len(s):
+            raise Exception("Unexpected extra text in %s" % s)
+        _remember(s, parsed)
+    return parsed
+
+
+def parse_method_descriptor(s):
+    """Return a MethodDescriptor for the given method descriptor"""
+    parsed = _descriptor_memo.get(s)
+    if not isinstance(parsed, MethodDescriptor):
+        if not s.startswith(u"("):
+            raise Exception("Method descriptor %s should start with (" % s)
+        params = []
+        ii = 1
+        while ii < len(s) and s[ii] != u")":
+            param, ii = _parse_field(s, ii)
+            params.append(param)
+        if ii >= len(s):
+            raise Exception("Method descriptor %s should include )" % s)
+        return_type, ii = _parse_field(s, ii + 1, void_allowed=True)
+        if ii != len(s):
+            raise Exception("Unexpected extra text in %s" % s)
+        parsed = _remember(s, MethodDescriptor(tuple(params), return_type))
+    return parsed
+
+
+def size_field_descriptor(s):
+    """Return the size in bytes of the field described by the given descriptor"""
+    return _parse_field(s, 0)[0].size()
+
+
+def demangle_field_descriptor(s, void_allowed=False):
+    """Convert field descriptor to a string describing the field.
+
+    Returns (description, rest)"""
+    # JVMSpec 4.3.2
+    if not void_allowed:
+        parsed = _descriptor_memo.get(s)
+        if isinstance(parsed, FieldDescriptor):
+            return parsed.description, s[len(s):]
+    parsed, end = _parse_field(s, 0, void_allowed)
+    if end == len(s) and not void_allowed:
+        _remember(s, parsed)
+    return parsed.description, s[end:]
+
+
 def demangle_method_descriptor(s):
     """Convert method descriptor to a pair of strings describing parameters and return type."""
     # JVMSpec 4.3.3
-    assert s[0] == u"(", "Method descriptor %s should start with (" % s
-    s = s[1:]
-    params = []
-    while s[0] != u")" and len(s) > 0:
-        result, s = demangle_field_descriptor(s)
-        params.append(result)
-    if (len(s) == 0 or s[0] != u")"):
-        raise Exception("Method descriptor %s should include )" % s)
-    return_type, s = demangle_field_descriptor(s[1:], void_allowed=True)
-    assert len(s) == 0, "Unexpected extra text in %s" % s
-    return (params, return_type)
+    parsed = parse_method_descriptor(s)
+    return ([param.description for param in parsed.params], parsed.return_type.description)
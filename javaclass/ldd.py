@@ -0,0 +1,516 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Implementation of the jldd command, importable so that it can also be run
+by the analysis daemon."""
+import os
+import platform
+import sys
+import re
+import zipfile
+import tempfile
+import subprocess
+import base64
+import urllib
+import hashlib
+import cPickle
+
+from jnm import _Opts, Symbol, resolve_jar, remove_defined, remove_nonclass
+from jnm import load_symbols, load_counters, output_stream
+from findjre import FINDJRE_JAR
+from records import OUTPUT_FORMATS, record_writer, dependency_record, unresolved_record
+from stats import run_stats
+
+USAGE = """jldd [options] file[s]
+
+jldd displays the package dependencies of each file in the argument list.
+
+With --transitive, the dependencies of the jar files that satisfy each
+file's references are included too, as are the jar files named in the
+Class-Path of a jar's META-INF/MANIFEST.MF.  A jar's references are looked
+up in the boot class path, then its manifest Class-Path, then the class path.
+Each jar's unresolved references are only worked out once, and with
+--cache-dir they are kept between runs (until the jar changes).
+"""
+
+# Java classes are searched for and loaded from:
+
+#  - bootstrap classes: the Java platform, and public classes of the Java
+#    Class Library.  Sometimes in $JAVA_HOME/jre/lib/*.jar, particularly
+#    $JAVA_HOME/jre/lib/rt.jar.  On Mac OS X these are instead in
+#    /System/Library/Frameworks/JavaVM.framework/Classes/classes.jar and
+#    /System/Library/Frameworks/JavaVM.framework/Classes/ui.jar.  More
+#    generally, the sun.boot.class.path property holds this path.
+#     in sun.boot.class.path property
+#
+#  - extension classes: Sometimes in $JAVA_HOME/jre/lib/ext/*.jar
+#
+#  - user-defined classes: Search the user's class path (either the
+#    --classpath command-line option or $CLASSPATH environment variable).
+#
+#  - jar-file extended classpath: When classes are loaded from a jar file,
+#    the classpath is extended by the contents of the "Class-Path:" field in
+#    the META-INF/MANIFEST.MF file of the jar file.
+#
+MANIFEST_CLASSPATH_RE = re.compile(r'^Class-Path: (?P<classpath>.*)\s*$', re.MULTILINE)  # space-separated list of relative paths to jarfiles
+
+BOOT_CLASSPATH_RE = re.compile(r'^Boot-Class-Path: (?P<classpath>.*)\s*$', re.MULTILINE)
+CLASSPATH_SEPARATOR_RE = re.compile(r'^Class-Path-Separator: (?P<sep>.)\s*$', re.MULTILINE)
+
+MACOSX_CLASSDIR = "/System/Library/Java/JavaVirtualMachines/1.6.0.jdk/Contents/Classes"
+MACOSX_CLASSJARS = ('jsfd.jar', 'classes.jar', 'ui.jar', 'laf.jar', 'sunrsasign.jar', 'jsse.jar', 'jce.jar', 'charsets.jar')
+
+
+def _default_macosx_boot_classpath():
+    return [os.path.join(MACOSX_CLASSDIR, jarfile) for jarfile in MACOSX_CLASSJARS]
+
+
+def _find_jre_boot_classpath():
+    # Create the jar file we need in a temporary file
+    jarfile = tempfile.NamedTemporaryFile(suffix=".jar", delete=False)
+    jarfile.write(base64.b64decode(FINDJRE_JAR))
+    jarfile.close()
+
+    # Run Java on the class file and slurp results
+    results = subprocess.Popen(('java', '-jar', jarfile.name),
+                               stdout=subprocess.PIPE).communicate()[0]
+    os.remove(jarfile.name)
+    m = BOOT_CLASSPATH_RE.search(results)
+    if m:
+        sep = ':'
+        msep = CLASSPATH_SEPARATOR_RE.search(results)
+        if msep:
+            sep = msep.group('sep')
+        return m.group('classpath').split(sep)
+    return None
+
+
+def boot_classpath():
+    # Try to run FindJRE.class to use the local Java installation to find boot path
+    classpath = _find_jre_boot_classpath()
+    if classpath is not None:
+        return classpath
+    # Fall back to looking in some OS-specific common places
+    if platform.system() == "Darwin":
+        return _default_macosx_boot_classpath()
+    elif os.name == "posix":
+        return None  # @@@
+    elif os.name == "nt":
+        return None  # @@@
+    else:
+        print >> sys.stderr, "Failed to find Java boot class path.  Please ensure java is in your path or set --bootclasspath."
+        return None
+
+
+_boot_classpath = []  # filled in on first use
+
+
+def default_boot_classpath():
+    """Return the boot class path, running Java to find it the first time only"""
+    if not _boot_classpath:
+        _boot_classpath.append(boot_classpath())
+    return _boot_classpath[0]
+
+
+class LDDOpts(_Opts):
+    OPT_INFO = (_Opts.OPT_INFO +
+                (("c:", "classpath=", "class search path of directories and jar files (default $CLASSPATH)", None, None, None),
+                 ("b:", "bootclasspath=", "class search path for bootstrap classes", None, None, None),
+                 ("r", "resolve-all", "check all references are satisfied (slower)", None, None, None),
+                 ("", "format=", "Output format: text (default), jsonl or binary", None, None, None),
+                 ("", "summary", "Write counts of parsed and duplicate classes to stderr", None, None, None),
+                 ("t", "transitive", "Include the dependencies of dependencies", None, None, None),
+                 ("", "cache-dir=", "Keep each jar's unresolved references in directory arg", None, None, None),
+                 ))
+
+    def __init__(self, message):
+        self.message = message
+        self.filters = set([resolve_jar, remove_defined, remove_nonclass])
+        self.sorts = []
+        self.displays = set()
+        self.classpath = os.environ.get("CLASSPATH", ".").split(":")
+        self.bootclasspath = None  # default_boot_classpath() unless set
+        self.resolve_all = False
+        self.format = "text"
+        self.summary = False
+        self.transitive = False
+        self.cache_dir = None
+
+    def process_opt(self, opt, arg):
+        if opt in ("-c", "--classpath"):
+            self.classpath = arg.split(":")
+            return True
+        elif opt in ("-b", "--bootclasspath"):
+            self.bootclasspath = arg.split(":")
+            return True
+        elif opt == "--format":
+            if arg not in OUTPUT_FORMATS:
+                print >> sys.stderr, "Unknown output format %s" % arg
+                self.usage(1)
+            self.format = arg
+            return True
+        elif opt == "--summary":
+            self.summary = True
+            return True
+        elif opt in ("-t", "--transitive"):
+            self.transitive = True
+            return True
+        elif opt == "--cache-dir":
+            self.cache_dir = arg
+            return True
+        elif super(LDDOpts, self).process_opt(opt, arg):
+            return True
+        else:
+            return False
+
+
+def package_name(jcls):
+    idx = jcls.rfind('.')
+    if idx == -1:
+        return None
+    else:
+        return jcls[:idx]
+
+
+def _list_classfiles(results, topdir, subdir):
+    fulldir = os.path.join(topdir, subdir)
+    for filename in os.listdir(fulldir):
+        fullname = os.path.join(fulldir, filename)
+        if os.path.isdir(fullname):
+            _list_classfiles(results, topdir, os.path.join(subdir, filename))
+        elif os.path.isfile(fullname):
+            basename, ext = os.path.splitext(filename)
+            if ext == ".class":
+                classname = os.path.join(subdir, basename)
+                classname = classname.replace(os.sep, ".")
+                if classname not in results:
+                    results[classname] = topdir
+
+
+def get_classes(classpath):
+    results = {}  # classname => set of owning jarfiles/top-level directories
+    for top in classpath:
+        if top.endswith(".jar") and os.path.isfile(top):
+            zf = zipfile.ZipFile(top, "r")
+            for info in zf.infolist():
+                filename, ext = os.path.splitext(info.filename)
+                if ext == ".class":
+                    classname = filename.replace(os.sep, ".")
+                    if classname not in results:
+                        results[classname] = top
+        elif os.path.isdir(top):
+            if not top.endswith(os.sep):
+                top = top + os.sep
+            _list_classfiles(results, top, "")
+    return results
+
+
+MANIFEST_NAME = "META-INF/MANIFEST.MF"
+# Lines of a manifest longer than 72 bytes continue on lines that start with a space
+MANIFEST_CONTINUATION_RE = re.compile(r'\r?\n ')
+
+
+def read_manifest(jarfile):
+    """Return the text of a jar's manifest with continuation lines joined up, or "" if it has none"""
+    zf = zipfile.ZipFile(jarfile, "r")
+    try:
+        try:
+            manifest = zf.read(MANIFEST_NAME)
+        except KeyError:
+            return ""
+    finally:
+        zf.close()
+    return MANIFEST_CONTINUATION_RE.sub("", manifest).replace("\r\n", "\n")
+
+
+def manifest_classpath(jarfile):
+    """Return the files named by the Class-Path in a jar's manifest, relative to the current directory"""
+    m = MANIFEST_CLASSPATH_RE.search(read_manifest(jarfile))
+    if m is None:
+        return []
+    # Entries are URLs relative to the directory holding the jar
+    jardir = os.path.dirname(jarfile)
+    return [os.path.normpath(os.path.join(jardir, urllib.unquote(entry)))
+            for entry in m.group('classpath').split()]
+
+
+# Version of the files written to the --cache-dir directory
+SUMMARY_VERSION = 1
+
+
+class JarSummary(object):
+    """What a jar needs from elsewhere: its manifest Class-Path, and the
+    (classfile, class name) of each reference it does not resolve itself"""
+
+    def __init__(self, classpath, references):
+        self.classpath = classpath
+        self.references = references
+
+
+class JarSummaries(object):
+    """JarSummary for each jar, worked out once per jar (and per change to
+    the jar, if kept in a cache directory)"""
+
+    def __init__(self, opts, loader, cache_dir=None):
+        self.opts = opts
+        self.loader = loader
+        self.cache_dir = cache_dir
+        self.summaries = {}  # jarfile => JarSummary
+
+    def _cache_filename(self, path):
+        return os.path.join(self.cache_dir, hashlib.sha1(path).hexdigest() + ".summary")
+
+    def _load(self, path, stamp):
+        try:
+            with open(self._cache_filename(path), "rb") as f:
+                version, cached_path, cached_stamp, classpath, references = cPickle.load(f)
+        except (EnvironmentError, EOFError, cPickle.UnpicklingError, ValueError):
+            return None
+        if version != SUMMARY_VERSION or cached_path != path or cached_stamp != stamp:
+            return None
+        return JarSummary(classpath, references)
+
+    def _save(self, path, stamp, summary):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        filename = self._cache_filename(path)
+        with open(filename + ".tmp", "wb") as f:
+            cPickle.dump((SUMMARY_VERSION, path, stamp, summary.classpath, summary.references),
+                         f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(filename + ".tmp", filename)
+
+    def _summarize(self, jarfile):
+        references = [(classfile, symbol.jcls)
+                      for _, classfile, symbol in self.opts.process(self.loader([jarfile]))]
+        return JarSummary(manifest_classpath(jarfile), references)
+
+    def summary(self, jarfile):
+        """Return the JarSummary for a jar file"""
+        summary = self.summaries.get(jarfile)
+        if summary is not None:
+            return summary
+        if self.cache_dir is None:
+            summary = self._summarize(jarfile)
+        else:
+            path = os.path.abspath(jarfile)
+            st = os.stat(path)
+            stamp = (st.st_mtime, st.st_size)
+            summary = self._load(path, stamp)
+            if summary is None:
+                summary = self._summarize(jarfile)
+                self._save(path, stamp, summary)
+        self.summaries[jarfile] = summary
+        return summary
+
+
+def _class_ref(jcls):
+    return Symbol(None, Symbol.REF_CLASS, jcls, jcls, None)
+
+
+def transitive_dependencies(filename, root_references, summaries, bootclass, jclass, class_lister):
+    """Find the dependencies of a file and of everything it depends on.
+
+    root_references are the (jarfile, classfile, symbol) references that the
+    file itself does not resolve.  Returns ({package: set of locations},
+    [unresolved (jarfile, classfile, symbol)], [(jarfile, missing Class-Path
+    entry)])."""
+    ref_to = {}
+    unresolved = []
+    missing = []
+    listings = {}  # manifest Class-Path => {classname: location}
+    seen = set([filename])
+    pending = []
+
+    def follow(location):
+        if location.endswith(".jar") and os.path.isfile(location) and location not in seen:
+            seen.add(location)
+            pending.append(location)
+
+    def add_references(references, manifest_classes):
+        for jarfile, classfile, symbol in references:
+            jpkg = package_name(symbol.jcls)
+            locations = ref_to.setdefault(jpkg, set())
+            if symbol.jcls in bootclass:
+                locations.add(bootclass[symbol.jcls])
+            elif symbol.jcls in manifest_classes:
+                locations.add(manifest_classes[symbol.jcls])
+                follow(manifest_classes[symbol.jcls])
+            elif symbol.jcls in jclass:
+                locations.add(jclass[symbol.jcls])
+                follow(jclass[symbol.jcls])
+            else:
+                unresolved.append((jarfile, classfile, symbol))
+
+    def manifest_classes(jarfile, classpath):
+        for entry in classpath:
+            if os.path.exists(entry):
+                follow(entry)
+            else:
+                missing.append((jarfile, entry))
+        key = tuple(classpath)
+        if key not in listings:
+            listings[key] = class_lister(classpath)
+        return listings[key]
+
+    if filename.endswith(".jar"):
+        add_references(root_references, manifest_classes(filename, summaries.summary(filename).classpath))
+    else:
+        add_references(root_references, {})
+    while pending:
+        jarfile = pending.pop(0)
+        summary = summaries.summary(jarfile)
+        add_references([(jarfile, classfile, _class_ref(jcls)) for classfile, jcls in summary.references],
+                       manifest_classes(jarfile, summary.classpath))
+    return ref_to, unresolved, missing
+
+
+def _main_direct(opts, filenames, loader, stream, bootclass, jclass):
+    show_filename_prolog = (len(filenames) > 1)
+    # Resolve references within each of the set of destination files, return only unresolved class symbols.
+    references = opts.process(loader(opts.load_order(filenames)))
+
+    # Now find where each referenced class should get resolved via
+    with run_stats.phase("map"):
+        mappings = []
+        unresolveds = {}
+        ref_to = {}
+        for jarfile, classfile, symbol in references:
+            if jarfile is None:
+                this_file = classfile
+            else:
+                this_file = jarfile
+            if this_file not in ref_to:
+                ref_to[this_file] = {}
+            jpkg = package_name(symbol.jcls)
+            if jpkg not in ref_to[this_file]:
+                ref_to[this_file][jpkg] = set()
+            if symbol.jcls in bootclass:
+                mappings.append((jarfile, classfile, symbol, bootclass[symbol.jcls]))
+                ref_to[this_file][jpkg].add(bootclass[symbol.jcls])
+            elif symbol.jcls in jclass:
+                mappings.append((jarfile, classfile, symbol, jclass[symbol.jcls]))
+                ref_to[this_file][jpkg].add(jclass[symbol.jcls])
+            else:
+                if this_file not in unresolveds:
+                    unresolveds[this_file] = []
+                unresolveds[this_file].append((jarfile, classfile, symbol))
+
+    with run_stats.phase("output"):
+        if opts.format != "text":
+            writer = record_writer(opts.format, stream)
+            for filename in filenames:
+                for jpkg, locations in ref_to.get(filename, {}).items():
+                    writer.write(dependency_record(filename, jpkg, locations))
+                for jarfile, classfile, symbol in unresolveds.get(filename, []):
+                    writer.write(unresolved_record(filename, jarfile, classfile, symbol))
+            writer.flush()
+        else:
+            out = output_stream(stream)
+            for filename in filenames:
+                if show_filename_prolog:
+                    out.write(u"%s:\n" % filename)
+                if filename in ref_to:
+                    for jpkg in ref_to[filename]:
+                        if len(ref_to[filename][jpkg]) == 0:
+                            out.write(u"\t %s => ???\n" % jpkg)
+                        else:
+                            out.write(u"\t %s => %s\n" % (jpkg, u", ".join(ref_to[filename][jpkg])))
+                if filename in unresolveds:
+                    out.write(u"Failed to resolve:\n")
+                    for jarfile, classfile, symbol in unresolveds[filename]:
+                        if jarfile is None:
+                            out.write(u" %s: %s\n" % (classfile, symbol.unique_name))
+                        else:
+                            out.write(u" %s(%s): %s\n" % (jarfile, classfile, symbol.unique_name))
+            out.flush()
+
+
+def _main_transitive(opts, filenames, loader, stream, class_lister, bootclass, jclass):
+    summaries = JarSummaries(opts, loader, opts.cache_dir)
+    # Class files named together resolve references among themselves, as
+    # without --transitive
+    classfiles = [filename for filename in filenames if not filename.endswith(".jar")]
+    class_references = {}
+    if classfiles:
+        for jarfile, classfile, symbol in opts.process(loader(opts.load_order(classfiles))):
+            class_references.setdefault(classfile, []).append((jarfile, classfile, symbol))
+    results = []
+    for filename in filenames:
+        if filename.endswith(".jar"):
+            root_references = [(filename, classfile, _class_ref(jcls))
+                               for classfile, jcls in summaries.summary(filename).references]
+        else:
+            root_references = class_references.get(filename, [])
+        results.append(transitive_dependencies(filename, root_references, summaries,
+                                               bootclass, jclass, class_lister))
+
+    with run_stats.phase("output"):
+        if opts.format != "text":
+            writer = record_writer(opts.format, stream)
+            for filename, (ref_to, unresolved, missing) in zip(filenames, results):
+                for jpkg in sorted(ref_to):
+                    writer.write(dependency_record(filename, jpkg, ref_to[jpkg]))
+                for jarfile, classfile, symbol in unresolved:
+                    writer.write(unresolved_record(filename, jarfile, classfile, symbol))
+            writer.flush()
+        else:
+            out = output_stream(stream)
+            for filename, (ref_to, unresolved, missing) in zip(filenames, results):
+                if len(filenames) > 1:
+                    out.write(u"%s:\n" % filename)
+                for jpkg in sorted(ref_to):
+                    if len(ref_to[jpkg]) == 0:
+                        out.write(u"\t %s => ???\n" % jpkg)
+                    else:
+                        out.write(u"\t %s => %s\n" % (jpkg, u", ".join(sorted(ref_to[jpkg]))))
+                if unresolved or missing:
+                    out.write(u"Failed to resolve:\n")
+                    for jarfile, entry in missing:
+                        out.write(u" %s: Class-Path entry %s\n" % (jarfile, entry))
+                    for jarfile, classfile, symbol in unresolved:
+                        if jarfile is None:
+                            out.write(u" %s: %s\n" % (classfile, symbol.unique_name))
+                        else:
+                            out.write(u" %s(%s): %s\n" % (jarfile, classfile, symbol.unique_name))
+            out.flush()
+
+
+def main(argv, loader=load_symbols, stream=None, class_lister=get_classes):
+    """Run jldd with the given arguments.
+
+    Symbols are read with loader (which has the signature of
+    jnm.load_symbols), the classes available on a class path are found with
+    class_lister (which has the signature of get_classes), and output goes to
+    stream (a binary file-like object) or to stdout."""
+    opts = LDDOpts(USAGE)
+    filenames = opts.getopts(argv)
+    if len(filenames) == 0:
+        print >> sys.stderr, "No files were specified on the command line.  Try --help."
+        return
+    load_counters.reset()
+    # Hunt through the classpaths to find all available classes (but do
+    # not look inside those classes)
+    with run_stats.phase("classpath"):
+        if opts.bootclasspath is None:
+            opts.bootclasspath = default_boot_classpath()
+        bootclass = class_lister(opts.bootclasspath)
+        jclass = class_lister(opts.classpath)
+    if opts.transitive:
+        _main_transitive(opts, filenames, loader, stream, class_lister, bootclass, jclass)
+    else:
+        _main_direct(opts, filenames, loader, stream, bootclass, jclass)
+    if opts.summary:
+        print >> sys.stderr, load_counters.summary()
+    opts.report_run()
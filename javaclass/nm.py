@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Implementation of the jnm command, importable so that it can also be run
+by the analysis daemon."""
+import sys
+
+import jvmspec
+from jnm import _Opts, set_sort_memory_limit, MIN_SORT_MEMORY_LIMIT, load_symbols, load_counters, output_stream
+from jnm import numeric_sort, reverse_sort, alphabetic_sort, noop_sort
+from jnm import remove_defined, remove_undefined, remove_private, remove_nonclass
+from jnm import resolve_all, resolve_class
+from jnm import prepend_filename, name_only, demangle, normal_display
+from symtable import SymbolTable
+from records import OUTPUT_FORMATS, record_writer, symbol_record
+from watch import WATCH_INTERVAL, watch, watched_files
+from stats import run_stats
+
+USAGE = """jnm [options] file[s]
+
+jnm displays the symbol table of each file in the argument list.  If an
+argument is a jarfile, a listing for each class file in the file will be
+produced.
+
+Each symbol name is preceded by its value (blanks if undefined).  This
+value is followed by one of the following characters, representing the
+symbol type:
+
+    C  Class
+    D  Static field
+    I  Instance field
+    T  Method
+
+    K  Undefined reference to class
+    F  Undefined reference to static field
+    J  Undefined reference to instance field
+    R  Undefined reference to method
+
+If the symbol is private, the symbol's type is instead represented by
+the corresponding lowercase letter.
+
+With --format=jsonl or --format=binary, each symbol is instead written as a
+record holding its value, type, class, name, descriptor, jar and class file
+(see javaclass/records.py); the display options do not apply.
+
+With --watch, the arguments may also be directories (which are searched for
+class and jar files).  After the initial listing, jnm keeps checking the files
+and shows each change to the listing as a line starting with "+ " or "- ".
+Only changed files are parsed again.
+"""
+
+
+class NMOpts(_Opts):
+    OPT_INFO = (_Opts.OPT_INFO +
+                # Sort options
+                (("p", "no-sort", "Don't sort; display in order encountered (default)", None, noop_sort, None),
+                 ("n", "numeric-sort", "Sort symbols numerically", None, numeric_sort, None),
+                 ("r", "reverse-sort", "Sort in reverse order", None, reverse_sort, None),
+                 ("a", "alpha-sort", "Sort alphabetically", None, alphabetic_sort, None),
+                 # Filter options
+                 ("u", "undefined-only", "Display only undefined symbols", remove_defined, None, None),
+                 ("U", "defined-only", "Don't display undefined symbols", remove_undefined, None, None),
+                 ("g", "extern-only", "Don't display external (non-private) symbols", remove_private, None, None),
+                 ("c", "class-only", "Only display classes, not fields or methods", remove_nonclass, None, None),
+                 ("f", "flatten", "Resolve references within the set of files specified", resolve_all, None, None),
+                 # Display options
+                 ("A", "print-file-name", "Write the pathname on each line", None, None, prepend_filename),
+                 ("j", "symbols-only", "Just display the symbol names (no value or type)", None, None, name_only),
+                 ("C", "demangle", "Decode symbol names into user-visible names", None, None, demangle),
+                 # Special options
+                 ("", "m64", "Assume pointers are 64-bit (default)", None, None, None),
+                 ("", "m32", "Assume pointers are 32-bit", None, None, None),
+                 ("", "columnar", "Hold symbols in a columnar table (faster for large inputs)", None, None, None),
+                 ("", "format=", "Output format: text (default), jsonl or binary", None, None, None),
+                 ("", "sort-buffer=", "Sort at most arg (>= %d) symbols in memory, then use temporary files" % MIN_SORT_MEMORY_LIMIT, None, None, None),
+                 ("", "summary", "Write counts of parsed and duplicate classes to stderr", None, None, None),
+                 ("", "watch", "Keep watching the files and show changes to the listing", None, None, None),
+                 ("", "interval=", "Seconds between checks for changes with --watch (default %g)" % WATCH_INTERVAL, None, None, None),
+                 ))
+
+    def __init__(self, message):
+        self.message = message
+        self.filters = set([resolve_class])
+        self.sorts = []
+        self.displays = set([normal_display])
+        self.columnar = False
+        self.format = "text"
+        self.summary = False
+        self.watch = False
+        self.interval = WATCH_INTERVAL
+
+    def process_opt(self, opt, arg):
+        if opt in ("-p", "--no-sort"):
+            self.sorts = []
+            return True
+        elif opt == "--m32":
+            jvmspec.set_pointer_size(4)
+            return True
+        elif opt == "--m64":
+            jvmspec.set_pointer_size(8)
+            return True
+        elif opt == "--columnar":
+            self.columnar = True
+            return True
+        elif opt == "--format":
+            if arg not in OUTPUT_FORMATS:
+                print >> sys.stderr, "Unknown output format %s" % arg
+                self.usage(1)
+            self.format = arg
+            return True
+        elif opt == "--sort-buffer":
+            try:
+                set_sort_memory_limit(int(arg))
+            except ValueError:
+                print >> sys.stderr, "Invalid symbol count %s for --sort-buffer (at least %d)" % (arg, MIN_SORT_MEMORY_LIMIT)
+                self.usage(1)
+            return True
+        elif opt == "--summary":
+            self.summary = True
+            return True
+        elif opt == "--watch":
+            self.watch = True
+            return True
+        elif opt == "--interval":
+            try:
+                self.interval = float(arg)
+            except ValueError:
+                print >> sys.stderr, "Invalid interval %s for --interval" % arg
+                self.usage(1)
+            return True
+        elif super(NMOpts, self).process_opt(opt, arg):
+            return True
+        else:
+            return False
+
+
+def write_text(out, opts, resultslist, show_filename_prolog):
+    """Write the text listing of (jarfile, classfile, symbol) entries to out"""
+    prev_file = (None, None)
+    for jarfile, classfile, symbol in resultslist:
+        this_file = (jarfile, classfile)
+        if (show_filename_prolog and
+            prev_file != this_file and
+            prepend_filename not in opts.displays):
+            if jarfile is None:
+                out.write(u"\n%s:\n" % classfile)
+            else:
+                out.write(u"\n%s(%s):\n" % this_file)
+            prev_file = this_file
+        out.write(opts.display(jarfile, classfile, symbol) + u"\n")
+
+
+def main(argv, loader=load_symbols, stream=None, allow_watch=True):
+    """Run jnm with the given arguments.
+
+    Symbols are read with loader (which has the signature of
+    jnm.load_symbols), and output goes to stream (a binary file-like object)
+    or to stdout.  --watch never returns, so callers that must get control
+    back (the analysis daemon) pass allow_watch=False to reject it."""
+    opts = NMOpts(USAGE)
+    args = opts.getopts(argv)
+    if len(args) < 1:
+        print >> sys.stderr, "No classes were specified on the command line.  Try --help."
+        return
+    if opts.watch:
+        if not allow_watch:
+            print >> sys.stderr, "--watch can't be used through the analysis daemon; run jnm directly"
+            opts.usage(1)
+        if opts.format != "text":
+            print >> sys.stderr, "--watch only supports text output"
+            opts.usage(1)
+        files = watched_files(args)
+        show_filename_prolog = (len(files) > 1 or any(filename.endswith(".jar") for filename in files))
+        watch(opts, args, output_stream(stream),
+              lambda out, entries: write_text(out, opts, entries, show_filename_prolog),
+              opts.interval)
+        return
+    show_filename_prolog = (len(args) > 1 or any(arg.endswith(".jar") for arg in args))
+    load_counters.reset()
+    resultslist = loader(opts.load_order(args))
+    if opts.columnar:
+        resultslist = SymbolTable(resultslist)
+    resultslist = opts.process(resultslist)
+
+    with run_stats.phase("output"):
+        if opts.format != "text":
+            writer = record_writer(opts.format, stream)
+            for jarfile, classfile, symbol in resultslist:
+                writer.write(symbol_record(jarfile, classfile, symbol))
+            writer.flush()
+        else:
+            out = output_stream(stream)
+            write_text(out, opts, resultslist, show_filename_prolog)
+            out.flush()
+    if opts.summary:
+        print >> sys.stderr, load_counters.summary()
+    opts.report_run()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Scanner for bytecode patterns that are known to be slow.
+
+Each method's code is decoded once, and every instruction is checked against
+the selected rules:
+ - boxing: a primitive value is boxed by Integer.valueOf(int) and friends
+ - reflection: a class is looked up by name, or a member is found or invoked
+   by reflection
+ - synchronized: a synchronized method, or a monitorenter instruction
+ - exception: an exception is constructed (which fills in its stack trace);
+   exception classes are recognised by their names
+ - loop-allocation: an object or array is allocated between the target of a
+   backward branch and the branch, i.e. inside a loop
+"""
+import bisect
+
+from classfile import CodeAttributeInfo, LineNumberAttributeInfo
+from jvmspec import fqcn, parse_method_descriptor, SYNCHRONIZED
+from jnm import load_classes
+from bytecode import iter_instructions, branch_targets, INVOKE_OPCODES, BRANCH_OPCODES
+from stats import run_stats
+
+BOXING = "boxing"
+REFLECTION = "reflection"
+SYNCHRONIZATION = "synchronized"
+EXCEPTION = "exception"
+LOOP_ALLOCATION = "loop-allocation"
+ALL_RULES = (BOXING, REFLECTION, SYNCHRONIZATION, EXCEPTION, LOOP_ALLOCATION)
+
+_NEW = 187
+_NEWARRAY = 188
+_ANEWARRAY = 189
+_MONITORENTER = 194
+_MULTIANEWARRAY = 197
+ALLOCATION_OPCODES = frozenset((_NEW, _NEWARRAY, _ANEWARRAY, _MULTIANEWARRAY))
+
+BOXED_CLASSES = frozenset((u"java.lang.Boolean", u"java.lang.Byte", u"java.lang.Character", u"java.lang.Short",
+                           u"java.lang.Integer", u"java.lang.Long", u"java.lang.Float", u"java.lang.Double"))
+REFLECTIVE_METHODS = frozenset(((u"java.lang.Class", u"forName"),
+                                (u"java.lang.Class", u"newInstance"),
+                                (u"java.lang.Class", u"getMethod"),
+                                (u"java.lang.Class", u"getDeclaredMethod"),
+                                (u"java.lang.Class", u"getField"),
+                                (u"java.lang.Class", u"getDeclaredField"),
+                                (u"java.lang.Class", u"getConstructor"),
+                                (u"java.lang.Class", u"getDeclaredConstructor"),
+                                (u"java.lang.reflect.Method", u"invoke"),
+                                (u"java.lang.reflect.Constructor", u"newInstance")))
+EXCEPTION_SUFFIXES = (u"Exception", u"Error", u"Throwable")
+
+
+def _is_boxing(jcls, name, descriptor):
+    if jcls not in BOXED_CLASSES or name != u"valueOf":
+        return False
+    params = parse_method_descriptor(descriptor).params
+    return len(params) == 1 and params[0].code != u"L" and params[0].dims == 0
+
+
+def _line_numbers(code_attr):
+    # Return sorted lists of (start offsets, line numbers) from a method's LineNumberTables
+    entries = []
+    for attr in code_attr.attributes:
+        if isinstance(attr, LineNumberAttributeInfo):
+            entries.extend([(ln.start_pc, ln.line_number) for ln in attr.line_number_table])
+    entries.sort()
+    return [start for start, line in entries], [line for start, line in entries]
+
+
+class _MethodScan(object):
+    """Findings for one method, with their lines worked out once the method has been scanned"""
+
+    def __init__(self, code_attr):
+        self.code_attr = code_attr
+        self.findings = []  # (offset, rule, detail)
+
+    def add(self, offset, rule, detail):
+        self.findings.append((offset, rule, detail))
+
+    def located(self):
+        """Return (offset, line, rule, detail) for each finding, in offset order; line is None if unknown"""
+        if self.code_attr is None:
+            starts, lines = [], []
+        else:
+            starts, lines = _line_numbers(self.code_attr)
+        results = []
+        for offset, rule, detail in sorted(self.findings):
+            ii = bisect.bisect_right(starts, offset) - 1
+            results.append((offset, lines[ii] if ii >= 0 else None, rule, detail))
+        return results
+
+
+def scan_class(class_file, rules=ALL_RULES):
+    """Generate (method, offset, line, rule, detail) for each slow pattern in a class"""
+    rules = frozenset(rules)
+    jcls = fqcn(unicode(class_file.this_class))
+    constants = class_file.constants
+    for m in class_file.methods:
+        method = u"%s.%s:%s" % (jcls, constants[m.name_index - 1], m.get_descriptor())
+        code_attr = None
+        for attr in m.attributes:
+            if isinstance(attr, CodeAttributeInfo):
+                code_attr = attr
+        scan = _MethodScan(code_attr)
+        if SYNCHRONIZATION in rules and m.access_flags & SYNCHRONIZED:
+            scan.add(0, SYNCHRONIZATION, u"synchronized method")
+        if code_attr is not None:
+            _scan_code(code_attr.code, constants, rules, scan)
+        for offset, line, rule, detail in scan.located():
+            yield method, offset, line, rule, detail
+
+
+def _scan_code(code, constants, rules, scan):
+    loops = []  # (start, end) offsets of backward branches
+    allocations = []  # (offset, description)
+    for offset, opcode, operands in iter_instructions(code):
+        run_stats.instructions += 1
+        if opcode in INVOKE_OPCODES:
+            if BOXING in rules or REFLECTION in rules:
+                ref = constants[operands[0] - 1]
+                owner = fqcn(unicode(ref.get_class()))
+                name = ref.get_name()
+                if BOXING in rules and _is_boxing(owner, name, ref.get_descriptor()):
+                    scan.add(offset, BOXING, u"%s.%s:%s" % (owner, name, ref.get_descriptor()))
+                elif REFLECTION in rules and (owner, name) in REFLECTIVE_METHODS:
+                    scan.add(offset, REFLECTION, u"%s.%s" % (owner, name))
+        elif opcode in ALLOCATION_OPCODES:
+            if opcode == _NEWARRAY:
+                allocated = u"array"
+            else:
+                allocated = fqcn(unicode(constants[operands[0] - 1]))
+            if opcode == _NEW and EXCEPTION in rules and allocated.endswith(EXCEPTION_SUFFIXES):
+                scan.add(offset, EXCEPTION, u"new %s" % allocated)
+            if LOOP_ALLOCATION in rules:
+                allocations.append((offset, allocated))
+        elif opcode == _MONITORENTER:
+            if SYNCHRONIZATION in rules:
+                scan.add(offset, SYNCHRONIZATION, u"monitorenter")
+        elif opcode in BRANCH_OPCODES:
+            if LOOP_ALLOCATION in rules:
+                for target in branch_targets(offset, opcode, operands):
+                    if target <= offset:
+                        loops.append((target, offset))
+    if loops:
+        for offset, allocated in allocations:
+            for start, end in loops:
+                if start <= offset <= end:
+                    scan.add(offset, LOOP_ALLOCATION, u"new %s in loop at %d-%d" % (allocated, start, end))
+                    break
+
+
+def scan(filenames, rules=ALL_RULES):
+    """Generate (jarfile, classfile, method, offset, line, rule, detail) for each slow pattern in the given files"""
+    for jarfile, classfile, class_file in load_classes(filenames):
+        with run_stats.phase("scan", classfile):
+            findings = list(scan_class(class_file, rules))
+        for finding in findings:
+            yield (jarfile, classfile) + finding
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Machine-readable output records for jnm and jldd.
+
+Each record is a dict with a "type" field and the fields listed in
+RECORD_FIELDS for that type.  Records are written one at a time, either as
+JSON Lines or in a compact binary format:
+
+    file   := "JNM\\x02" record*
+    record := u4 length, then length bytes of:
+              u1 record type code (see RECORD_CODES), then each field in order
+    field  := value:   u4 (0xFFFFFFFF for None)
+              list:    u2 count, then count strings
+              string:  u4 length, then UTF-8 bytes (length 0xFFFFFFFF for None)
+
+All integers are big-endian.  The length prefix lets a consumer skip record
+types it does not know about; a stream that ends part way through a record
+ends the records.
+"""
+import io
+import sys
+import json
+import struct
+from collections import OrderedDict
+
+from classfile import su1, su2, su4
+from jnm import OUTPUT_BUFFER_SIZE
+
+OUTPUT_FORMATS = ("text", "jsonl", "binary")
+
+BINARY_MAGIC = "JNM\x02"
+
+RECORD_FIELDS = {"symbol": ("value", "symtype", "jcls", "symname", "descriptor", "jar", "classfile"),
+                 "dependency": ("file", "package", "locations"),
+                 "unresolved": ("file", "jar", "classfile", "symbol")}
+RECORD_CODES = {"symbol": ord("S"),
+                "dependency": ord("D"),
+                "unresolved": ord("U")}
+_CODE_TYPES = dict([(code, rtype) for rtype, code in RECORD_CODES.items()])
+
+_NO_VALUE = 0xFFFFFFFF
+_NO_STRING = 0xFFFFFFFF
+
+
+def symbol_record(jarfile, classfile, sym):
+    return OrderedDict((("type", "symbol"),
+                        ("value", sym.value),
+                        ("symtype", sym.symtype),
+                        ("jcls", sym.jcls),
+                        ("symname", sym.symname),
+                        ("descriptor", sym.descriptor),
+                        ("jar", jarfile),
+                        ("classfile", classfile)))
+
+
+def dependency_record(filename, package, locations):
+    return OrderedDict((("type", "dependency"),
+                        ("file", filename),
+                        ("package", package),
+                        ("locations", sorted(locations))))
+
+
+def unresolved_record(filename, jarfile, classfile, sym):
+    return OrderedDict((("type", "unresolved"),
+                        ("file", filename),
+                        ("jar", jarfile),
+                        ("classfile", classfile),
+                        ("symbol", sym.unique_name)))
+
+
+class JsonLinesWriter(object):
+    """Write records as one JSON object per line"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, record):
+        self.stream.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def flush(self):
+        self.stream.flush()
+
+
+def _encode_string(s):
+    if s is None:
+        return su4(_NO_STRING)
+    if not isinstance(s, unicode):
+        s = s.decode("utf-8")
+    data = s.encode("utf-8")
+    return su4(len(data)) + data
+
+
+def _encode_field(name, value):
+    if name == "value":
+        return su4(_NO_VALUE if value is None else value)
+    elif name == "locations":
+        return su2(len(value)) + "".join([_encode_string(s) for s in value])
+    else:
+        return _encode_string(value)
+
+
+class BinaryWriter(object):
+    """Write records in the length-prefixed binary format"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.stream.write(BINARY_MAGIC)
+
+    def write(self, record):
+        rtype = record["type"]
+        payload = su1(RECORD_CODES[rtype]) + "".join([_encode_field(name, record[name])
+                                                     for name in RECORD_FIELDS[rtype]])
+        self.stream.write(su4(len(payload)) + payload)
+
+    def flush(self):
+        self.stream.flush()
+
+
+OUTPUT_WRITERS = {"jsonl": JsonLinesWriter,
+                  "binary": BinaryWriter}
+
+
+def _decode_string(data, offset):
+    length = struct.unpack(">L", data[offset:offset + 4])[0]
+    offset += 4
+    if length == _NO_STRING:
+        return None, offset
+    return data[offset:offset + length].decode("utf-8"), offset + length
+
+
+def _decode_field(name, data, offset):
+    if name == "value":
+        value = struct.unpack(">L", data[offset:offset + 4])[0]
+        return (None if value == _NO_VALUE else value), offset + 4
+    elif name == "locations":
+        count = struct.unpack(">H", data[offset:offset + 2])[0]
+        offset += 2
+        values = []
+        for ii in xrange(count):
+            value, offset = _decode_string(data, offset)
+            values.append(value)
+        return values, offset
+    else:
+        return _decode_string(data, offset)
+
+
+def read_binary_records(stream):
+    """Generate the records in a binary stream as they arrive; unknown record types are skipped"""
+    magic = stream.read(len(BINARY_MAGIC))
+    if magic != BINARY_MAGIC:
+        raise ValueError("Not a binary record stream")
+    while True:
+        header = stream.read(4)
+        if len(header) < 4:
+            return
+        length = struct.unpack(">L", header)[0]
+        payload = stream.read(length)
+        if length == 0 or len(payload) != length:
+            # Records always hold a type code, so the stream was cut off (or is corrupt)
+            return
+        rtype = _CODE_TYPES.get(ord(payload[0]))
+        if rtype is None:
+            continue
+        record = OrderedDict((("type", rtype),))
+        offset = 1
+        for name in RECORD_FIELDS[rtype]:
+            record[name], offset = _decode_field(name, payload, offset)
+        yield record
+
+
+def binary_output_stream():
+    """Return a buffered binary writer on top of stdout"""
+    sys.stdout.flush()
+    return io.open(sys.stdout.fileno(), "wb", buffering=OUTPUT_BUFFER_SIZE, closefd=False)
+
+
+def record_writer(output_format, stream=None):
+    """Return a writer for the given machine-readable format on stdout (or a binary stream)"""
+    if stream is None:
+        stream = binary_output_stream()
+    return OUTPUT_WRITERS[output_format](stream)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Reverse-reference index: from a referenced class/field/method to the places
+that reference it.
+
+Each place that makes references (a method, or the class itself for its
+superclass and interfaces) is a "site".  Referenced names and sites are given
+small integer ids, and the sites referencing each name are stored as a single
+array of site ids plus an array of offsets into it, one per name (with the
+names in sorted order, so lookups are a binary search).
+"""
+import array
+import bisect
+import cPickle
+
+from classfile import CodeAttributeInfo, ExceptionsAttributeInfo
+from jvmspec import fqcn
+from jnm import Symbol, load_classes
+from stats import run_stats
+
+INDEX_VERSION = 1
+
+
+def method_references(class_file):
+    """Generate (method, symbol) for each reference made by a class.
+
+    The method is "name:descriptor" for references made by a method's code or
+    throws clause, and None for the superclass and interfaces of the class."""
+    super_class = fqcn(unicode(class_file.super_class))
+    yield None, Symbol(None, Symbol.REF_CLASS, super_class, super_class, None)
+    for interf in class_file.interfaces:
+        interface = fqcn(unicode(interf))
+        yield None, Symbol(None, Symbol.REF_CLASS, interface, interface, None)
+    for m in class_file.methods:
+        method = u"%s:%s" % (class_file.constants[m.name_index - 1], m.get_descriptor())
+        for attr in m.attributes:
+            if isinstance(attr, (CodeAttributeInfo, ExceptionsAttributeInfo)):
+                for sym in attr.dump():
+                    yield method, sym
+
+
+def split_name(name):
+    """Return (jcls, symname, descriptor) for a unique name"""
+    member, _, descriptor = name.partition(u":")
+    if not descriptor:
+        return name, name, None
+    jcls, _, symname = member.rpartition(u".")
+    return jcls, symname, descriptor
+
+
+def _ids(table, values, key):
+    # Return the id of key in table, adding it (and to the values list) if not present
+    result = table.get(key)
+    if result is None:
+        result = table[key] = len(values)
+        values.append(key)
+    return result
+
+
+class ReferenceIndexBuilder(object):
+    """Accumulate references from class and jar files in a single pass"""
+
+    def __init__(self):
+        self.names = {}  # referenced unique name => name id
+        self.name_list = []
+        self.kinds = array.array('c')  # name id => symtype
+        self.postings = []  # name id => array of site ids
+        self.files = {}  # (jarfile, classfile) => file id
+        self.file_list = []
+        self.methods = {}  # method or None => method id
+        self.method_list = []
+        self.sites = {}  # (file id, method id) => site id
+        self.site_files = array.array('I')  # site id => file id
+        self.site_methods = array.array('I')  # site id => method id
+        self.jcls_ids = {}  # class name => class id
+        self.jcls_list = []
+        self.site_classes = array.array('I')  # site id => class id
+
+    def add_class(self, jarfile, classfile, class_file):
+        file_id = _ids(self.files, self.file_list, (jarfile, classfile))
+        class_id = _ids(self.jcls_ids, self.jcls_list, fqcn(unicode(class_file.this_class)))
+        last_method = 0  # methods are visited in turn, so only look up the site when it changes
+        site_id = None
+        for method, sym in method_references(class_file):
+            if site_id is None or method is not last_method:
+                last_method = method
+                method_id = _ids(self.methods, self.method_list, method)
+                site_key = (file_id, method_id)
+                site_id = self.sites.get(site_key)
+                if site_id is None:
+                    site_id = self.sites[site_key] = len(self.site_files)
+                    self.site_files.append(file_id)
+                    self.site_methods.append(method_id)
+                    self.site_classes.append(class_id)
+            name = sym.unique_name
+            name_id = self.names.get(name)
+            if name_id is None:
+                name_id = self.names[name] = len(self.name_list)
+                self.name_list.append(name)
+                self.kinds.append(sym.symtype.encode("ascii"))
+                self.postings.append(array.array('I'))
+            postings = self.postings[name_id]
+            if not postings or postings[-1] != site_id:
+                postings.append(site_id)
+
+    def add(self, filenames):
+        """Add the references from the given class/jar files"""
+        count = 0
+        for jarfile, classfile, class_file in load_classes(filenames):
+            with run_stats.phase("index"):
+                self.add_class(jarfile, classfile, class_file)
+            count += 1
+        return count
+
+    def finish(self):
+        """Return a ReferenceIndex holding the accumulated references"""
+        order = sorted(xrange(len(self.name_list)), key=self.name_list.__getitem__)
+        kinds = array.array('c')
+        offsets = array.array('I', [0])
+        postings = array.array('I')
+        for name_id in order:
+            kinds.append(self.kinds[name_id])
+            postings.extend(self.postings[name_id])
+            offsets.append(len(postings))
+        return ReferenceIndex([self.name_list[name_id] for name_id in order], kinds, offsets, postings,
+                              self.file_list, self.method_list, self.jcls_list,
+                              self.site_files, self.site_methods, self.site_classes)
+
+
+class PickledArrays(object):
+    """Mixin that saves an object made of arrays and lists to a file, and loads it back.
+
+    Subclasses set _ARRAYS and _LISTS to the names of the attributes (which
+    are also the names of the constructor arguments), VERSION to the version
+    of the file format, and DESCRIPTION to what the file holds."""
+    _ARRAYS = ()
+    _LISTS = ()
+    VERSION = None
+    DESCRIPTION = None
+
+    def save(self, filename):
+        data = {"version": self.VERSION}
+        # Arrays are saved as raw strings; pickling them directly goes via a list
+        for attr in self._ARRAYS:
+            value = getattr(self, attr)
+            data[attr] = (value.typecode, value.tostring())
+        for attr in self._LISTS:
+            data[attr] = getattr(self, attr)
+        with open(filename, "wb") as f:
+            cPickle.dump(data, f, cPickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "rb") as f:
+            data = cPickle.load(f)
+        if data.get("version") != cls.VERSION:
+            raise ValueError("%s is not a %s of version %d" % (filename, cls.DESCRIPTION, cls.VERSION))
+        for attr in cls._ARRAYS:
+            typecode, value = data[attr]
+            data[attr] = array.array(typecode)
+            data[attr].fromstring(value)
+        del data["version"]
+        return cls(**data)
+
+
+class ReferenceIndex(PickledArrays):
+    """Lookup of the sites that reference a class, field or method"""
+
+    _ARRAYS = ("kinds", "offsets", "postings", "site_files", "site_methods", "site_classes")
+    _LISTS = ("names", "files", "methods", "classes")
+    VERSION = INDEX_VERSION
+    DESCRIPTION = "reference index"
+
+    def __init__(self, names, kinds, offsets, postings, files, methods, classes,
+                 site_files, site_methods, site_classes):
+        self.names = names
+        self.kinds = kinds
+        self.offsets = offsets
+        self.postings = postings
+        self.files = files
+        self.methods = methods
+        self.classes = classes
+        self.site_files = site_files
+        self.site_methods = site_methods
+        self.site_classes = site_classes
+
+    def _matching(self, name, prefix):
+        # Range of name ids for name, name:<descriptor>, or anything starting with name
+        lo = bisect.bisect_left(self.names, name)
+        hi = lo
+        while hi < len(self.names):
+            candidate = self.names[hi]
+            if not candidate.startswith(name):
+                break
+            if not (prefix or len(candidate) == len(name) or candidate[len(name)] == u":"):
+                # Sorted order interleaves other names sharing the prefix, so keep going
+                hi += 1
+                continue
+            yield hi
+            hi += 1
+
+    def lookup(self, name, prefix=False):
+        """Generate (jarfile, classfile, site, Symbol) for each reference to name.
+
+        The name may be a class (com.foo.Bar), a member (com.foo.Bar.baz) or a
+        member with its descriptor (com.foo.Bar.baz:()V); if prefix is set any
+        referenced name starting with name matches.  The site is the
+        referencing class or class.method:descriptor."""
+        for name_id in self._matching(name, prefix):
+            jcls, symname, descriptor = split_name(self.names[name_id])
+            sym = Symbol(None, self.kinds[name_id].decode("ascii"), jcls, symname, descriptor)
+            for ii in xrange(self.offsets[name_id], self.offsets[name_id + 1]):
+                site_id = self.postings[ii]
+                jarfile, classfile = self.files[self.site_files[site_id]]
+                jcls = self.classes[self.site_classes[site_id]]
+                method = self.methods[self.site_methods[site_id]]
+                if method is None:
+                    site = jcls
+                else:
+                    site = u"%s.%s" % (jcls, method)
+                yield jarfile, classfile, site, sym
+
+
+def build_index(filenames):
+    """Return a ReferenceIndex for the given class/jar files, built in one pass"""
+    builder = ReferenceIndexBuilder()
+    builder.add(filenames)
+    return builder.finish()
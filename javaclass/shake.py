@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Removal of the classes of a jar file that can't be reached from its entry points.
+
+A class is reachable if it is an entry point, matches a keep rule, is named
+in a META-INF/services provider file, or is referenced by a reachable class.
+The references are jnm's K, F, J and R symbols (which include each class's
+superclass and interfaces), the classes named in the descriptors of the
+class's own and referenced fields and methods, and the classes named in its
+Signature attributes and annotations.
+
+Classes that are only loaded by reflection (Class.forName() with a computed
+name, for example) can't be found this way, and need keep rules.
+"""
+import fnmatch
+import itertools
+import os
+import re
+import zipfile
+
+from classfile import (SignatureAttributeInfo, RuntimeAnnotationsAttributeInfo,
+                       RuntimeParameterAnnotationsAttributeInfo, AnnotationDefaultAttributeInfo,
+                       EnumConstValue, ClassInfoValue, AnnotationValue, ArrayValue)
+from jnm import Symbol, load_classes
+from jvmspec import fqcn, parse_field_descriptor, parse_method_descriptor
+from ldd import read_manifest
+from stats import run_stats
+
+MANIFEST_MAIN_CLASS_RE = re.compile(r'^Main-Class: (?P<classname>.*?)\s*$', re.MULTILINE)
+SERVICES_DIR = "META-INF/services/"
+# Class types in a generic signature; JVMSpec 4.3.4.  (Type variables are
+# T<name>; and so never match; the names of nested classes after a "." are
+# not followed.)
+SIGNATURE_CLASS_RE = re.compile(ur'(?:^|[()\[;<>:+\-*^])L([^<;.:]+)')
+
+
+def manifest_main_class(jarfile):
+    """Return the Main-Class named in a jar's manifest, or None"""
+    m = MANIFEST_MAIN_CLASS_RE.search(read_manifest(jarfile))
+    if m is None:
+        return None
+    return m.group('classname').decode("utf-8")
+
+
+def service_providers(jarfile):
+    """Return the classes named in the jar's META-INF/services provider-configuration files"""
+    providers = []
+    zf = zipfile.ZipFile(jarfile, "r")
+    try:
+        for info in zf.infolist():
+            if info.filename.startswith(SERVICES_DIR) and not info.filename.endswith("/"):
+                for line in zf.read(info).decode("utf-8").splitlines():
+                    line = line.split(u"#", 1)[0].strip()
+                    if line:
+                        providers.append(line)
+    finally:
+        zf.close()
+    return providers
+
+
+def descriptor_classes(descriptor):
+    """Return the classes named in a field or method descriptor"""
+    if descriptor.startswith(u"("):
+        parsed = parse_method_descriptor(descriptor)
+        types = parsed.params + (parsed.return_type,)
+    else:
+        types = (parse_field_descriptor(descriptor),)
+    return [t.classname for t in types if t.classname is not None]
+
+
+def _element_value_classes(class_file, value, refs):
+    if isinstance(value, EnumConstValue):
+        refs.update(descriptor_classes(unicode(class_file.constants[value.type_name_index - 1])))
+    elif isinstance(value, ClassInfoValue):
+        descriptor = unicode(class_file.constants[value.class_info_index - 1])
+        if descriptor != u"V":
+            refs.update(descriptor_classes(descriptor))
+    elif isinstance(value, AnnotationValue):
+        _annotation_classes(class_file, value.annotation_value, refs)
+    elif isinstance(value, ArrayValue):
+        for v in value.values:
+            _element_value_classes(class_file, v, refs)
+
+
+def _annotation_classes(class_file, annotation, refs):
+    refs.update(descriptor_classes(unicode(class_file.constants[annotation.type_index - 1])))
+    for _, value in annotation.element_value_pairs:
+        _element_value_classes(class_file, value, refs)
+
+
+def attribute_classes(class_file, attributes, refs):
+    """Add the classes named in Signature and annotation attributes to refs"""
+    for attr in attributes:
+        if isinstance(attr, SignatureAttributeInfo):
+            signature = unicode(class_file.constants[attr.signature_index - 1])
+            refs.update([fqcn(name) for name in SIGNATURE_CLASS_RE.findall(signature)])
+        elif isinstance(attr, RuntimeAnnotationsAttributeInfo):
+            for annotation in attr.annotations:
+                _annotation_classes(class_file, annotation, refs)
+        elif isinstance(attr, RuntimeParameterAnnotationsAttributeInfo):
+            for annotations in attr.parameter_annotations:
+                for annotation in annotations:
+                    _annotation_classes(class_file, annotation, refs)
+        elif isinstance(attr, AnnotationDefaultAttributeInfo):
+            _element_value_classes(class_file, attr.default_value, refs)
+
+
+def class_references(filenames):
+    """Return class name => (class file name, set of referenced class names) for the given class/jar files"""
+    classes = {}
+    for jarfile, filename, class_file in load_classes(filenames):
+        with run_stats.phase("scan", filename):
+            jcls = fqcn(unicode(class_file.this_class))
+            refs = set()
+            for sym in class_file.dump():
+                if sym.symtype in Symbol.REF_SYMTYPES:
+                    refs.add(sym.jcls)
+                if sym.descriptor is not None:
+                    refs.update(descriptor_classes(sym.descriptor))
+            attribute_classes(class_file, class_file.attributes, refs)
+            for member in itertools.chain(class_file.fields, class_file.methods):
+                attribute_classes(class_file, member.attributes, refs)
+            refs.discard(jcls)
+            classes[jcls] = (filename, refs)
+    return classes
+
+
+def read_keep_file(filename):
+    """Return the keep rules in a file, one per line, ignoring blank lines and # comments"""
+    rules = []
+    with open(filename, "r") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                rules.append(line.decode("utf-8"))
+    return rules
+
+
+def entry_class(classes, entry):
+    """Return the class for an entry point, which is either a class or a method (com.foo.Main.main)"""
+    if entry in classes:
+        return entry
+    jcls = entry.partition(u":")[0].rpartition(u".")[0]
+    if jcls in classes:
+        return jcls
+    raise KeyError("Entry point %s is not a class or method in the jar" % entry)
+
+
+def reachable_classes(classes, roots, keep_rules=()):
+    """Return the set of classes reachable from the root classes and the classes matching keep_rules.
+
+    A keep rule is a class name pattern, with * and ? as for shell filenames."""
+    pending = [jcls for jcls in roots if jcls in classes]
+    for rule in keep_rules:
+        pending.extend(fnmatch.filter(classes, rule))
+    reached = set(pending)
+    while pending:
+        jcls = pending.pop()
+        for ref in classes[jcls][1]:
+            if ref not in reached and ref in classes:
+                reached.add(ref)
+                pending.append(ref)
+    return reached
+
+
+def write_pruned_jar(injar, outjar, classes, keep):
+    """Copy injar to outjar, leaving out the class files of the classes that aren't in keep.
+
+    Returns (names of the class files left out, their total size)."""
+    dropped = set([classes[jcls][0] for jcls in classes if jcls not in keep])
+    removed = []
+    removed_bytes = 0
+    zin = zipfile.ZipFile(injar, "r")
+    try:
+        zout = zipfile.ZipFile(outjar, "w", zipfile.ZIP_DEFLATED)
+        try:
+            for info in zin.infolist():
+                if info.filename in dropped:
+                    removed.append(info.filename)
+                    removed_bytes += info.file_size
+                    continue
+                with run_stats.phase("write", info.filename):
+                    zout.writestr(info, zin.read(info))
+        finally:
+            zout.close()
+    finally:
+        zin.close()
+    return removed, removed_bytes
+
+
+def shake_jar(injar, outjar, entries=(), keep_rules=()):
+    """Write a copy of injar to outjar holding only the classes reachable from its entry points.
+
+    If no entry points are given, the jar manifest's Main-Class is used.
+    Returns (number of classes kept, names of the class files removed, their total size)."""
+    if os.path.abspath(injar) == os.path.abspath(outjar):
+        raise ValueError("Output jar %s would overwrite the input jar" % outjar)
+    classes = class_references([injar])
+    if not entries:
+        main_class = manifest_main_class(injar)
+        if main_class is None and not keep_rules:
+            raise KeyError("No entry points given, and %s has no Main-Class" % injar)
+        entries = [main_class] if main_class is not None else []
+    with run_stats.phase("reach"):
+        roots = [entry_class(classes, entry) for entry in entries]
+        roots.extend(service_providers(injar))
+        keep = reachable_classes(classes, roots, keep_rules)
+    removed, removed_bytes = write_pruned_jar(injar, outjar, classes, keep)
+    return len(keep), removed, removed_bytes
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Shrinking of class files by removing debug attributes and unused constants.
+
+After the chosen attributes are removed, the constant pool entries that
+nothing refers to any more are dropped and the rest renumbered, keeping their
+order.  Indices therefore only ever get smaller, so ldc instructions (with
+their one-byte index) still fit.  Classes holding attributes that aren't
+understood keep their constant pool as it is, as the attributes might refer to
+entries in it.
+
+Jars are shrunk an entry at a time by a pool of worker processes, and the
+output jar is written as the results come back, in the original order.
+"""
+import itertools
+import multiprocessing
+import os
+import struct
+import zipfile
+
+from classfile import (ClassFile, ConstantInfo, ClassInfo, StringInfo, RefInfo, NameAndTypeInfo, LargeNumInfo,
+                       CodeAttributeInfo, SourceFileAttributeInfo, ConstantValueAttributeInfo,
+                       ExceptionsAttributeInfo, InnerClassesAttributeInfo, LocalVariableAttributeInfo,
+                       LocalVariableTypeAttributeInfo, StackMapTableAttributeInfo, ObjectVariableInfo,
+                       EnclosingMethodAttributeInfo, SignatureAttributeInfo, RuntimeAnnotationsAttributeInfo,
+                       RuntimeParameterAnnotationsAttributeInfo, AnnotationDefaultAttributeInfo,
+                       ConstValue, EnumConstValue, ClassInfoValue, AnnotationValue, ArrayValue,
+                       UnknownAttributeInfo, UndecodedCodeAttributeInfo)
+from bytecode import iter_instructions
+import jvmspec
+from stats import run_stats
+
+LINE_NUMBERS = (u"LineNumberTable",)
+LOCAL_VARIABLES = (u"LocalVariableTable", u"LocalVariableTypeTable")
+SOURCE = (u"SourceFile", u"SourceDebugExtension")
+DEBUG_ATTRIBUTES = LINE_NUMBERS + LOCAL_VARIABLES + SOURCE
+
+# Opcodes whose first operand is a constant pool index => size of the index
+_CONSTANT_OPERANDS = dict([(opcode, 1 if struct_code[0] == "B" else 2)
+                           for opcode, (name, size, struct_code, info_types) in jvmspec.BYTECODES.items()
+                           if info_types.startswith("c")])
+# Number of jar entries to hand to the worker processes at a time
+BATCH_SIZE = 64
+
+
+def _attribute_name(class_file, attr):
+    return unicode(class_file.constants[attr.attribute_name_index - 1])
+
+
+def strip_attributes(class_file, names):
+    """Remove the attributes with the given names from a class, its fields, methods and code"""
+    names = frozenset(names)
+
+    def strip(attributes):
+        kept = [attr for attr in attributes if _attribute_name(class_file, attr) not in names]
+        return kept, sum([6 + attr.attribute_length for attr in attributes if attr not in kept])
+
+    for item in class_file.fields + class_file.methods:
+        item.attributes, removed = strip(item.attributes)
+        for attr in item.attributes:
+            if isinstance(attr, CodeAttributeInfo):
+                attr.attributes, removed = strip(attr.attributes)
+                attr.attribute_length -= removed
+    class_file.attributes, removed = strip(class_file.attributes)
+    if class_file.sourcefile_attribute not in class_file.attributes:
+        class_file.sourcefile_attribute = None
+
+
+def _all_attributes(class_file):
+    # Generate every attribute of a class, including those nested in Code attributes
+    for item in [class_file] + class_file.fields + class_file.methods:
+        for attr in item.attributes:
+            yield attr
+            if isinstance(attr, CodeAttributeInfo):
+                for nested in attr.attributes:
+                    yield nested
+
+
+def _remap_element_value(value, fn):
+    if isinstance(value, ConstValue):
+        value.const_value_index = fn(value.const_value_index)
+    elif isinstance(value, EnumConstValue):
+        value.type_name_index = fn(value.type_name_index)
+        value.const_name_index = fn(value.const_name_index)
+    elif isinstance(value, ClassInfoValue):
+        value.class_info_index = fn(value.class_info_index)
+    elif isinstance(value, AnnotationValue):
+        _remap_annotation(value.annotation_value, fn)
+    elif isinstance(value, ArrayValue):
+        for element in value.values:
+            _remap_element_value(element, fn)
+
+
+def _remap_annotation(annotation, fn):
+    annotation.type_index = fn(annotation.type_index)
+    annotation.element_value_pairs = [(fn(name_index), value) for name_index, value in annotation.element_value_pairs]
+    for name_index, value in annotation.element_value_pairs:
+        _remap_element_value(value, fn)
+
+
+def _remap_code(code, fn):
+    # Return the code with the constant pool index operands replaced by fn(index)
+    patched = None
+    for offset, opcode, operands in iter_instructions(code):
+        size = _CONSTANT_OPERANDS.get(opcode)
+        if size is not None:
+            index = fn(operands[0])
+            if index != operands[0]:
+                if patched is None:
+                    patched = bytearray(code)
+                if size == 1:
+                    patched[offset + 1] = index
+                else:
+                    patched[offset + 1:offset + 3] = struct.pack(">H", index)
+    return code if patched is None else str(patched)
+
+
+def _remap_attribute(attr, fn):
+    # Replace each constant pool index held by an attribute with fn(index)
+    attr.attribute_name_index = fn(attr.attribute_name_index)
+    if isinstance(attr, CodeAttributeInfo):
+        attr.code = _remap_code(attr.code, fn)
+        for exception in attr.exception_table:
+            if exception.catch_type != 0:
+                exception.catch_type = fn(exception.catch_type)
+    elif isinstance(attr, SourceFileAttributeInfo):
+        attr.sourcefile_index = fn(attr.sourcefile_index)
+    elif isinstance(attr, ConstantValueAttributeInfo):
+        attr.constant_value_index = fn(attr.constant_value_index)
+    elif isinstance(attr, ExceptionsAttributeInfo):
+        attr.exception_index_table = [fn(index) for index in attr.exception_index_table]
+    elif isinstance(attr, InnerClassesAttributeInfo):
+        for inner in attr.classes:
+            inner.inner_class_info_index = fn(inner.inner_class_info_index)
+            if inner.outer_class_info_index != 0:
+                inner.outer_class_info_index = fn(inner.outer_class_info_index)
+            if inner.inner_name_index != 0:
+                inner.inner_name_index = fn(inner.inner_name_index)
+    elif isinstance(attr, LocalVariableAttributeInfo):
+        for local in attr.local_variable_table:
+            local.name_index = fn(local.name_index)
+            local.descriptor_index = fn(local.descriptor_index)
+    elif isinstance(attr, LocalVariableTypeAttributeInfo):
+        for local in attr.local_variable_type_table:
+            local.name_index = fn(local.name_index)
+            local.descriptor_index = fn(local.descriptor_index)
+    elif isinstance(attr, StackMapTableAttributeInfo):
+        for frame in attr.entries:
+            for info in getattr(frame, "locals", []) + getattr(frame, "stack", []):
+                if isinstance(info, ObjectVariableInfo):
+                    info.cpool_index = fn(info.cpool_index)
+    elif isinstance(attr, EnclosingMethodAttributeInfo):
+        attr.class_index = fn(attr.class_index)
+        if attr.method_index != 0:
+            attr.method_index = fn(attr.method_index)
+    elif isinstance(attr, SignatureAttributeInfo):
+        attr.signature_index = fn(attr.signature_index)
+    elif isinstance(attr, RuntimeAnnotationsAttributeInfo):
+        for annotation in attr.annotations:
+            _remap_annotation(annotation, fn)
+    elif isinstance(attr, RuntimeParameterAnnotationsAttributeInfo):
+        for annotations in attr.parameter_annotations:
+            for annotation in annotations:
+                _remap_annotation(annotation, fn)
+    elif isinstance(attr, AnnotationDefaultAttributeInfo):
+        _remap_element_value(attr.default_value, fn)
+
+
+def _remap_constant(const, fn):
+    # Replace each constant pool index held by a constant with fn(index)
+    if isinstance(const, ClassInfo):
+        const.name_index = fn(const.name_index)
+    elif isinstance(const, StringInfo):
+        const.string_index = fn(const.string_index)
+    elif isinstance(const, RefInfo):
+        const.class_index = fn(const.class_index)
+        const.name_and_type_index = fn(const.name_and_type_index)
+    elif isinstance(const, NameAndTypeInfo):
+        const.name_index = fn(const.name_index)
+        const.descriptor_index = fn(const.descriptor_index)
+
+
+def _remap_indices(class_file, fn):
+    # Replace every constant pool index in the class, other than in the constants themselves, with fn(index)
+    for item in class_file.fields + class_file.methods:
+        item.name_index = fn(item.name_index)
+        item.descriptor_index = fn(item.descriptor_index)
+    for attr in _all_attributes(class_file):
+        _remap_attribute(attr, fn)
+
+
+def compact_constants(class_file):
+    """Drop the constant pool entries that nothing refers to, renumbering the rest.
+
+    Returns the number of entries dropped, or None if the class has attributes
+    that might refer to constants without being understood."""
+    for attr in _all_attributes(class_file):
+        if isinstance(attr, (UnknownAttributeInfo, UndecodedCodeAttributeInfo)):
+            return None
+    constants = class_file.constants
+    used = bytearray(len(constants) + 1)
+    pending = []
+
+    def mark(index):
+        if not used[index]:
+            used[index] = 1
+            pending.append(index)
+        return index
+
+    for const in [class_file.this_class, class_file.super_class] + class_file.interfaces:
+        if const is not None:
+            mark(constants.index(const) + 1)
+    _remap_indices(class_file, mark)
+    while pending:
+        _remap_constant(constants[pending.pop() - 1], mark)
+
+    new_index = [0] * (len(constants) + 1)
+    kept = []
+    for index, const in enumerate(constants, 1):
+        if isinstance(const, ConstantInfo) and used[index]:
+            kept.append(const)
+            new_index[index] = len(kept)
+            if isinstance(const, LargeNumInfo):
+                kept.append(None)
+    dropped = len(constants) - len(kept)
+    if dropped:
+        renumber = new_index.__getitem__
+        _remap_indices(class_file, renumber)
+        for const in kept:
+            _remap_constant(const, renumber)
+        class_file.constants = kept
+        class_file.attribute_class_to_index = None
+    return dropped
+
+
+def shrink_class(data, strip=DEBUG_ATTRIBUTES, compact=True):
+    """Return the contents of a class file with the given attributes removed and its constant pool compacted"""
+    class_file = ClassFile(data)
+    if strip:
+        strip_attributes(class_file, strip)
+    if compact:
+        compact_constants(class_file)
+    return class_file.serialize()
+
+
+def _shrink_entry(args):
+    # Worker process function: returns (shrunk data or None if unchanged, error message or None)
+    data, strip, compact = args
+    if data is None:
+        return None, None
+    try:
+        return shrink_class(data, strip, compact), None
+    except Exception, e:
+        return None, "%s: %s" % (e.__class__.__name__, e)
+
+
+def _entries(injar, strip, compact):
+    # Generate (ZipInfo, worker arguments) for the entries of a jar; only class files are read
+    zf = zipfile.ZipFile(injar, "r")
+    try:
+        for info in zf.infolist():
+            if info.filename.endswith(".class"):
+                yield info, (zf.read(info), strip, compact)
+            else:
+                yield info, (None, strip, compact)
+    finally:
+        zf.close()
+
+
+class ShrinkCounts(object):
+    """Totals for a shrunk jar"""
+
+    def __init__(self):
+        self.classes = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.failed = []  # (class file, error message) for classes copied unchanged
+
+
+def shrink_jar(injar, outjar, strip=DEBUG_ATTRIBUTES, compact=True, jobs=None):
+    """Write a copy of injar to outjar with each class file shrunk; returns ShrinkCounts.
+
+    The classes are shrunk by jobs worker processes (default one per CPU, and
+    none if jobs is 1).  Entries that are not class files, and classes that
+    can't be parsed, are copied unchanged."""
+    if os.path.abspath(injar) == os.path.abspath(outjar):
+        raise ValueError("Output jar %s would overwrite the input jar" % outjar)
+    counts = ShrinkCounts()
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    pool = None
+    zin = zipfile.ZipFile(injar, "r")
+    try:
+        zout = zipfile.ZipFile(outjar, "w", zipfile.ZIP_DEFLATED)
+        try:
+            if jobs > 1:
+                pool = multiprocessing.Pool(jobs)
+            entries = _entries(injar, strip, compact)
+            while True:
+                # Hand the workers a batch at a time, so that only a batch of entries is in memory
+                batch = list(itertools.islice(entries, BATCH_SIZE))
+                if not batch:
+                    break
+                args = [arg for info, arg in batch]
+                with run_stats.phase("shrink"):
+                    if pool is not None:
+                        results = pool.map(_shrink_entry, args)
+                    else:
+                        results = map(_shrink_entry, args)
+                for (info, (data, _, _)), (shrunk, error) in zip(batch, results):
+                    with run_stats.phase("write", info.filename):
+                        if data is None:
+                            zout.writestr(info, zin.read(info))
+                            continue
+                        counts.classes += 1
+                        counts.bytes_in += len(data)
+                        if shrunk is None:
+                            counts.failed.append((info.filename, error))
+                            shrunk = data
+                        counts.bytes_out += len(shrunk)
+                        zout.writestr(info, shrunk)
+        finally:
+            zout.close()
+    finally:
+        zin.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return counts
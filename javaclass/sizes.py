@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Breakdown of the bytes of class files into the parts that use them.
+
+Every byte of a class file is counted in exactly one category:
+ - constants: the constant pool entries (also broken down by tag)
+ - code: Code attributes, less the attributes nested inside them
+ - debug: LineNumberTable, LocalVariableTable and LocalVariableTypeTable
+ - stackmap: StackMapTable
+ - annotations: the Runtime*Annotations and AnnotationDefault attributes
+ - other: every other attribute (SourceFile, Signature, InnerClasses, ...)
+ - structure: the rest -- the header, counts, and the fixed parts of the
+   field and method entries
+"""
+from classfile import CodeAttributeInfo, UndecodedCodeAttributeInfo, ConstantInfo
+from jvmspec import fqcn
+from jnm import load_classes
+from stats import run_stats
+
+CONSTANTS = "constants"
+CODE = "code"
+DEBUG = "debug"
+STACKMAP = "stackmap"
+ANNOTATIONS = "annotations"
+OTHER = "other"
+STRUCTURE = "structure"
+CATEGORIES = (CONSTANTS, CODE, DEBUG, STACKMAP, ANNOTATIONS, OTHER, STRUCTURE)
+
+# Constant pool tags; JVMSpec 4.4
+CONSTANT_TAG_NAMES = {1: "Utf8", 3: "Integer", 4: "Float", 5: "Long", 6: "Double", 7: "Class", 8: "String",
+                      9: "Fieldref", 10: "Methodref", 11: "InterfaceMethodref", 12: "NameAndType"}
+
+DEBUG_ATTRIBUTES = frozenset((u"LineNumberTable", u"LocalVariableTable", u"LocalVariableTypeTable"))
+ANNOTATION_ATTRIBUTES = frozenset((u"RuntimeVisibleAnnotations", u"RuntimeInvisibleAnnotations",
+                                   u"RuntimeVisibleParameterAnnotations", u"RuntimeInvisibleParameterAnnotations",
+                                   u"RuntimeVisibleTypeAnnotations", u"RuntimeInvisibleTypeAnnotations",
+                                   u"AnnotationDefault"))
+
+
+class SizeBreakdown(object):
+    """Bytes used by each category, and by each kind of constant"""
+
+    def __init__(self):
+        self.total = 0
+        self.categories = dict([(category, 0) for category in CATEGORIES])
+        self.constants = {}  # tag name => bytes
+        self.constant_counts = {}  # tag name => number of constants
+
+    def add(self, other):
+        """Add the sizes from another breakdown to this one"""
+        self.total += other.total
+        for category, size in other.categories.iteritems():
+            self.categories[category] += size
+        for tag, size in other.constants.iteritems():
+            self.constants[tag] = self.constants.get(tag, 0) + size
+            self.constant_counts[tag] = self.constant_counts.get(tag, 0) + other.constant_counts[tag]
+
+    def _add_attributes(self, class_file, attributes):
+        # Charge each attribute to its category, returning their total size
+        total = 0
+        for attr in attributes:
+            size = 6 + attr.attribute_length
+            total += size
+            name = unicode(class_file.constants[attr.attribute_name_index - 1])
+            if isinstance(attr, CodeAttributeInfo):
+                self.categories[CODE] += size - self._add_attributes(class_file, attr.attributes)
+            elif isinstance(attr, UndecodedCodeAttributeInfo):
+                self.categories[CODE] += size
+            elif name in DEBUG_ATTRIBUTES:
+                self.categories[DEBUG] += size
+            elif name == u"StackMapTable":
+                self.categories[STACKMAP] += size
+            elif name in ANNOTATION_ATTRIBUTES:
+                self.categories[ANNOTATIONS] += size
+            else:
+                self.categories[OTHER] += size
+        return total
+
+
+def class_breakdown(class_file):
+    """Return (SizeBreakdown, list of (method, bytes)) for a class.
+
+    The size of a method is that of its entry in the class file, including
+    its attributes."""
+    breakdown = SizeBreakdown()
+    breakdown.total = class_file.size
+    for const in class_file.constants:
+        if isinstance(const, ConstantInfo):
+            tag = CONSTANT_TAG_NAMES[const.TAG]
+            size = 1 + len(const.serialize())
+            breakdown.constants[tag] = breakdown.constants.get(tag, 0) + size
+            breakdown.constant_counts[tag] = breakdown.constant_counts.get(tag, 0) + 1
+            breakdown.categories[CONSTANTS] += size
+    for f in class_file.fields:
+        breakdown._add_attributes(class_file, f.attributes)
+    jcls = fqcn(unicode(class_file.this_class))
+    methods = []
+    for m in class_file.methods:
+        size = 8 + breakdown._add_attributes(class_file, m.attributes)
+        methods.append((u"%s.%s:%s" % (jcls, class_file.constants[m.name_index - 1], m.get_descriptor()), size))
+    breakdown._add_attributes(class_file, class_file.attributes)
+    breakdown.categories[STRUCTURE] = breakdown.total - sum([breakdown.categories[category]
+                                                             for category in CATEGORIES if category != STRUCTURE])
+    return breakdown, methods
+
+
+def file_breakdowns(filenames):
+    """Generate (jarfile, classfile, class name, SizeBreakdown, methods) for each class in the given files"""
+    for jarfile, classfile, class_file in load_classes(filenames):
+        with run_stats.phase("measure", classfile):
+            breakdown, methods = class_breakdown(class_file)
+        yield jarfile, classfile, fqcn(unicode(class_file.this_class)), breakdown, methods
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Per-phase timing and work counts for the --stats option.
+
+The tools stream data through chains of generators, so the phases of a run
+(reading jar entries, parsing, scanning bytecode, resolving, output) are
+interleaved rather than consecutive.  Time is therefore charged to the
+innermost active phase: entering a phase pauses the enclosing one until the
+inner phase is left again.
+
+While a trace is being recorded (see tracing.py), each phase is also recorded
+as a trace span."""
+import sys
+import time
+import resource
+
+from tracing import tracer
+
+
+class _Phase(object):
+    """Context manager that charges the time spent inside it to a phase"""
+    __slots__ = ('stats', 'name', 'detail', 'start')
+
+    def __init__(self, stats, name, detail):
+        self.stats = stats
+        self.name = name
+        self.detail = detail
+
+    def __enter__(self):
+        if self.stats.enabled:
+            self.stats._enter(self.name)
+        if tracer.enabled:
+            self.start = time.time()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.stats.enabled:
+            self.stats._leave()
+        if tracer.enabled:
+            if self.detail is None:
+                tracer.add(self.name, self.start, time.time())
+            else:
+                tracer.add(self.name, self.start, time.time(), {"file": self.detail})
+
+
+class _NoPhase(object):
+    """Context manager used while statistics are disabled"""
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_NO_PHASE = _NoPhase()
+
+# Name of the phase charged with time outside any other phase
+OTHER = "other"
+
+
+def peak_memory_kb():
+    """Return the peak resident set size of this process in kilobytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # Reported in bytes rather than kilobytes
+        peak //= 1024
+    return peak
+
+
+class RunStats(object):
+    """Wall and CPU time per phase, and counts of the work done, for one run"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Clear all statistics and stop collecting them"""
+        self.enabled = False
+        self.wall = {}  # phase => seconds
+        self.cpu = {}  # phase => seconds
+        self.phases = []  # phase names in order of first use
+        self._stack = []
+        self.classes = 0
+        self.bytes = 0
+        self.instructions = 0
+        self.symbols = 0
+
+    def start(self):
+        """Start collecting statistics"""
+        self.reset()
+        self.enabled = True
+        self._start_wall = self._last_wall = time.time()
+        self._start_cpu = self._last_cpu = time.clock()
+        self._stack = [OTHER]
+        self._add_phase(OTHER)
+
+    def _add_phase(self, name):
+        if name not in self.wall:
+            self.wall[name] = 0.0
+            self.cpu[name] = 0.0
+            self.phases.append(name)
+
+    def _charge(self):
+        # Charge the time since the last change to the current phase
+        now_wall = time.time()
+        now_cpu = time.clock()
+        current = self._stack[-1]
+        self.wall[current] += now_wall - self._last_wall
+        self.cpu[current] += now_cpu - self._last_cpu
+        self._last_wall = now_wall
+        self._last_cpu = now_cpu
+
+    def _enter(self, name):
+        self._charge()
+        self._add_phase(name)
+        self._stack.append(name)
+
+    def _leave(self):
+        self._charge()
+        self._stack.pop()
+
+    def phase(self, name, detail=None):
+        """Return a context manager that charges the time spent inside it to a phase.
+
+        If a trace is being recorded, the phase is also traced, with detail
+        (if given) as the name of the file being worked on."""
+        if not (self.enabled or tracer.enabled):
+            return _NO_PHASE
+        return _Phase(self, name, detail)
+
+    def iterate(self, name, iterable):
+        """Return an iterable over iterable whose time in producing each item is charged to a phase"""
+        if not self.enabled:
+            return iterable
+        return self._iterate(name, iter(iterable))
+
+    def _iterate(self, name, iterator):
+        while True:
+            self._enter(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._leave()
+            yield item
+
+    def report(self, stream=None):
+        """Write the statistics to stream (default stderr)"""
+        if stream is None:
+            stream = sys.stderr
+        self._charge()
+        total_wall = time.time() - self._start_wall
+        total_cpu = time.clock() - self._start_cpu
+        stream.write("%-12s %10s %10s %7s\n" % ("phase", "wall(s)", "cpu(s)", "wall%"))
+        for name in self.phases:
+            if name == OTHER and self.wall[name] < 0.0005:
+                continue
+            stream.write("%-12s %10.3f %10.3f %6.1f%%\n" %
+                         (name, self.wall[name], self.cpu[name],
+                          100.0 * self.wall[name] / total_wall if total_wall > 0 else 0.0))
+        stream.write("%-12s %10.3f %10.3f\n" % ("total", total_wall, total_cpu))
+        counts = []
+        rates = []
+        for label, count in (("classes", self.classes), ("bytes", self.bytes),
+                             ("instructions", self.instructions), ("symbols", self.symbols)):
+            if count:
+                counts.append("%d %s" % (count, label))
+                if total_wall > 0:
+                    rates.append("%.0f %s/s" % (count / total_wall, label))
+        if counts:
+            stream.write("processed: %s\n" % ", ".join(counts))
+            stream.write("throughput: %s\n" % ", ".join(rates))
+        stream.write("peak memory: %d KB\n" % peak_memory_kb())
+
+run_stats = RunStats()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""SQLite database of the symbols in a set of class and jar files.
+
+Symbols are stored with their unique name (as used for resolution) and their
+member name (class.member, without descriptor) so that definitions of and
+references to a name can be found with indexed queries rather than by
+re-reading every jar.
+"""
+import sqlite3
+
+from jnm import Symbol, load_symbols, _class_parent, _class_interfaces
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY,
+                                  jar TEXT,
+                                  classfile TEXT);
+CREATE TABLE IF NOT EXISTS classes (jcls TEXT,
+                                    superclass TEXT,
+                                    file_id INTEGER);
+CREATE TABLE IF NOT EXISTS interfaces (jcls TEXT,
+                                       interface TEXT,
+                                       file_id INTEGER);
+CREATE TABLE IF NOT EXISTS symbols (file_id INTEGER,
+                                    value INTEGER,
+                                    symtype TEXT,
+                                    jcls TEXT,
+                                    symname TEXT,
+                                    descriptor TEXT,
+                                    is_def INTEGER,
+                                    name TEXT,
+                                    member TEXT);
+CREATE INDEX IF NOT EXISTS files_jar ON files (jar);
+CREATE INDEX IF NOT EXISTS classes_jcls ON classes (jcls);
+CREATE INDEX IF NOT EXISTS classes_file ON classes (file_id);
+CREATE INDEX IF NOT EXISTS interfaces_jcls ON interfaces (jcls);
+CREATE INDEX IF NOT EXISTS interfaces_file ON interfaces (file_id);
+CREATE INDEX IF NOT EXISTS symbols_name ON symbols (name, is_def);
+CREATE INDEX IF NOT EXISTS symbols_member ON symbols (member, is_def);
+CREATE INDEX IF NOT EXISTS symbols_file ON symbols (file_id);
+"""
+
+# Number of rows inserted with each executemany() call
+BATCH_SIZE = 10000
+
+_SYMBOL_COLUMNS = "files.jar, files.classfile, value, symtype, jcls, symname, descriptor"
+
+
+def member_name(sym):
+    """Return the name of a symbol without its descriptor"""
+    if sym.is_class():
+        return sym.jcls
+    else:
+        return u"%s.%s" % (sym.jcls, sym.symname)
+
+
+class SymbolDatabase(object):
+    def __init__(self, filename):
+        self.conn = sqlite3.connect(filename)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _remove(self, cursor, jarfile, classfile):
+        # One statement per table for a whole jar, using the file_id indexes
+        if jarfile is not None:
+            where, args = "jar = ?", (jarfile,)
+        else:
+            where, args = "jar IS NULL AND classfile = ?", (classfile,)
+        for table in ("symbols", "classes", "interfaces"):
+            cursor.execute("DELETE FROM %s WHERE file_id IN (SELECT id FROM files WHERE %s)" % (table, where), args)
+        cursor.execute("DELETE FROM files WHERE %s" % where, args)
+
+    def add(self, filenames):
+        """Add the symbols from the given class/jar files, replacing any earlier copies"""
+        self.conn.execute("PRAGMA synchronous = OFF")
+        cursor = self.conn.cursor()
+        file_ids = {}  # (jarfile, classfile) => id
+        jarfiles = set()
+        rows = []
+        with self.conn:  # one transaction for the whole load
+            for jarfile, classfile, sym in load_symbols(filenames):
+                this_file = (jarfile, classfile)
+                if this_file not in file_ids:
+                    if jarfile is None or jarfile not in jarfiles:
+                        self._remove(cursor, jarfile, classfile)
+                        jarfiles.add(jarfile)
+                    cursor.execute("INSERT INTO files (jar, classfile) VALUES (?, ?)", this_file)
+                    file_ids[this_file] = cursor.lastrowid
+                file_id = file_ids[this_file]
+                if sym.symtype.upper() == Symbol.CLASS:
+                    cursor.execute("INSERT INTO classes VALUES (?, ?, ?)",
+                                   (sym.jcls, _class_parent.get(sym.jcls), file_id))
+                    cursor.executemany("INSERT INTO interfaces VALUES (?, ?, ?)",
+                                       [(sym.jcls, interface, file_id)
+                                        for interface in _class_interfaces.get(sym.jcls, [])])
+                rows.append((file_id, sym.value, sym.symtype, sym.jcls, sym.symname, sym.descriptor,
+                             sym.is_def(), sym.unique_name, member_name(sym)))
+                if len(rows) >= BATCH_SIZE:
+                    cursor.executemany("INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                    rows = []
+            cursor.executemany("INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(file_ids)
+
+    def _query(self, name, is_def):
+        # The name may be a class, a class.member or a full class.member:descriptor
+        return self.conn.execute("SELECT DISTINCT " + _SYMBOL_COLUMNS + " FROM symbols"
+                                 " JOIN files ON files.id = symbols.file_id"
+                                 " WHERE (symbols.name = ? OR symbols.member = ?) AND is_def = ?"
+                                 " ORDER BY files.jar, files.classfile",
+                                 (name, name, is_def))
+
+    def definitions(self, name):
+        """Generate (jarfile, classfile, Symbol) for each definition of name"""
+        return _symbols(self._query(name, 1))
+
+    def references(self, name):
+        """Generate (jarfile, classfile, Symbol) for each reference to name"""
+        return _symbols(self._query(name, 0))
+
+    def _is_defined(self, unique_name):
+        return self.conn.execute("SELECT 1 FROM symbols WHERE name = ? AND is_def = 1 LIMIT 1",
+                                 (unique_name,)).fetchone() is not None
+
+    def _superclass(self, jcls):
+        row = self.conn.execute("SELECT superclass FROM classes WHERE jcls = ? LIMIT 1", (jcls,)).fetchone()
+        if row is None or row[0] is None:
+            return "java.lang.Object"
+        return row[0]
+
+    def _interfaces(self, jcls):
+        return [row[0] for row in self.conn.execute("SELECT interface FROM interfaces WHERE jcls = ?", (jcls,))]
+
+    def _find_owner(self, sym, interfaces):
+        # Equivalent of find_owner_superclass_interfaces/find_owner_superclass in jnm.py
+        if self._is_defined(sym.unique_name):
+            return True
+        if sym.jcls == "java.lang.Object":
+            return False
+        potentials = [self._superclass(sym.jcls)]
+        if interfaces:
+            potentials.extend(self._interfaces(sym.jcls))
+        elif potentials[0] == "java.lang.Object":
+            return False
+        for potential in potentials:
+            if self._find_owner(Symbol(None, sym.symtype, potential, sym.symname, sym.descriptor), interfaces):
+                return True
+        return False
+
+    def unresolved(self, jarfile=None):
+        """Generate (jarfile, classfile, Symbol) for each reference that is not defined in the database"""
+        query = ("SELECT DISTINCT " + _SYMBOL_COLUMNS + " FROM symbols"
+                 " JOIN files ON files.id = symbols.file_id"
+                 " WHERE is_def = 0 AND NOT EXISTS"
+                 " (SELECT 1 FROM symbols AS defs WHERE defs.name = symbols.name AND defs.is_def = 1)")
+        params = ()
+        if jarfile is not None:
+            query += " AND files.jar = ?"
+            params = (jarfile,)
+        query += " ORDER BY files.jar, files.classfile"
+        resolved = {}  # (symtype, unique_name) => bool
+        for jarfile, classfile, sym in _symbols(self.conn.execute(query, params)):
+            if sym.is_class():
+                yield jarfile, classfile, sym
+                continue
+            # Fields and methods might be defined in a superclass or interface
+            key = (sym.symtype, sym.unique_name)
+            if key not in resolved:
+                resolved[key] = self._find_owner(sym, sym.symtype != Symbol.REF_INSTANCE_DATA)
+            if not resolved[key]:
+                yield jarfile, classfile, sym
+
+
+def _symbols(rows):
+    for jarfile, classfile, value, symtype, jcls, symname, descriptor in rows:
+        yield jarfile, classfile, Symbol(value, symtype, jcls, symname, descriptor)
@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Columnar symbol table.
+
+Holds the same information as a list of (jarfile, classfile, Symbol) 3-tuples,
+but as one column per attribute: strings are interned to integer ids, and the
+type, visibility and value of each symbol are held in compact arrays.  The
+filter and sort functions from jnm.py are applied as mask and argsort
+operations over those columns, using NumPy if it is available and the array
+module otherwise.
+"""
+import array
+
+# NumPy is optional; without it the columns are held in array.array objects
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import jnm
+from jnm import Symbol, _class_parent, _class_interfaces
+
+NO_ID = -1  # string id used for None
+NO_VALUE = -1  # value used for None (symbol values are never negative)
+UNDEFINED_VALUE = 0xFFFFFFFF  # numeric sort position of symbols with no value
+
+_CLASS_KINDS = (ord(Symbol.CLASS), ord(Symbol.REF_CLASS))
+_DEF_KINDS = tuple([ord(symtype) for symtype in Symbol.DEF_SYMTYPES])
+_REF_KINDS = tuple([ord(symtype) for symtype in Symbol.REF_SYMTYPES])
+_FIELD_KINDS = (ord(Symbol.DATA), ord(Symbol.INSTANCE_DATA))
+
+# (name, array typecode) for each column
+_COLUMNS = (("jarfile", "i"),
+            ("classfile", "i"),
+            ("kind", "B"),  # uppercase symbol type character
+            ("private", "B"),
+            ("value", "l"),
+            ("jcls", "i"),
+            ("symname", "i"),
+            ("descriptor", "i"))
+
+
+def _new_column(typecode):
+    return array.array(typecode)
+
+
+def _take(column, indices):
+    if numpy is not None:
+        return column[indices]
+    else:
+        return array.array(column.typecode, [column[ii] for ii in indices])
+
+
+def _isin(column, values):
+    if numpy is not None:
+        return numpy.in1d(column, values)
+    else:
+        return [x in values for x in column]
+
+
+def _nonzero(mask):
+    if numpy is not None:
+        return numpy.nonzero(mask)[0]
+    else:
+        return [ii for ii, x in enumerate(mask) if x]
+
+
+def _argsort(*keys):
+    """Return the indices that stably sort by the given key columns (most significant first)"""
+    if numpy is not None:
+        # lexsort treats its last key as the primary key
+        return numpy.lexsort(tuple(numpy.asarray(key) for key in reversed(keys)))
+    else:
+        rows = zip(*keys)
+        return sorted(range(len(rows)), key=rows.__getitem__)
+
+
+class SymbolTable(object):
+    """Columnar equivalent of a list of (jarfile, classfile, Symbol) 3-tuples"""
+
+    def __init__(self, symlist=(), strings=None):
+        # Interned strings; the id of a string is its index in self.strings
+        if strings is None:
+            self.strings = []
+            self._string_ids = {}
+        else:
+            self.strings, self._string_ids = strings
+        for name, typecode in _COLUMNS:
+            setattr(self, name, _new_column(typecode))
+        for jarfile, classfile, sym in symlist:
+            self.append(jarfile, classfile, sym)
+        if numpy is not None:
+            for name, typecode in _COLUMNS:
+                setattr(self, name, numpy.array(getattr(self, name), dtype=typecode))
+
+    def intern(self, s):
+        """Return the integer id for the given string"""
+        if s is None:
+            return NO_ID
+        try:
+            return self._string_ids[s]
+        except KeyError:
+            self._string_ids[s] = len(self.strings)
+            self.strings.append(s)
+            return len(self.strings) - 1
+
+    def string(self, string_id):
+        if string_id == NO_ID:
+            return None
+        return self.strings[string_id]
+
+    def append(self, jarfile, classfile, sym):
+        # Only valid while the table is being built from a symbol list
+        self.jarfile.append(self.intern(jarfile))
+        self.classfile.append(self.intern(classfile))
+        self.kind.append(ord(sym.symtype.upper()))
+        self.private.append(sym.symtype.islower())
+        self.value.append(NO_VALUE if sym.value is None else sym.value)
+        self.jcls.append(self.intern(sym.jcls))
+        self.symname.append(self.intern(sym.symname))
+        self.descriptor.append(self.intern(sym.descriptor))
+
+    def __len__(self):
+        return len(self.kind)
+
+    def __iter__(self):
+        strings = self.strings
+        for jarfile, classfile, kind, private, value, jcls, symname, descriptor in zip(
+                *[getattr(self, name).tolist() for name, typecode in _COLUMNS]):
+            symtype = unichr(kind)
+            if private:
+                symtype = symtype.lower()
+            yield (None if jarfile == NO_ID else strings[jarfile],
+                   strings[classfile],
+                   Symbol(None if value == NO_VALUE else value,
+                          symtype,
+                          strings[jcls],
+                          None if symname == NO_ID else strings[symname],
+                          None if descriptor == NO_ID else strings[descriptor]))
+
+    def take(self, indices):
+        """Return a new table holding the given rows, in the given order"""
+        result = SymbolTable(strings=(self.strings, self._string_ids))
+        for name, typecode in _COLUMNS:
+            setattr(result, name, _take(getattr(self, name), indices))
+        return result
+
+    def select(self, mask):
+        """Return a new table holding the rows where mask is true"""
+        return self.take(_nonzero(mask))
+
+    # Filters; each is the equivalent of the same-named filter function in jnm.py
+    def remove_defined(self):
+        return self.select(_isin(self.kind, _REF_KINDS))
+
+    def remove_undefined(self):
+        return self.select(_isin(self.kind, _DEF_KINDS))
+
+    def remove_private(self):
+        if numpy is not None:
+            return self.select(self.private == 0)
+        else:
+            return self.select([not x for x in self.private])
+
+    def remove_nonclass(self):
+        result = self.select(_isin(self.kind, _CLASS_KINDS + _REF_KINDS))
+        # convert a reference to a field or method in a class to a reference to owning class
+        member_refs = _nonzero([not x for x in _isin(result.kind, _CLASS_KINDS)])
+        if numpy is not None:
+            result.kind[member_refs] = ord(Symbol.REF_CLASS)
+            result.private[member_refs] = 0
+            result.value[member_refs] = NO_VALUE
+            result.symname[member_refs] = result.jcls[member_refs]
+            result.descriptor[member_refs] = NO_ID
+        else:
+            for ii in member_refs:
+                result.kind[ii] = ord(Symbol.REF_CLASS)
+                result.private[ii] = 0
+                result.value[ii] = NO_VALUE
+                result.symname[ii] = result.jcls[ii]
+                result.descriptor[ii] = NO_ID
+        return result
+
+    def resolve_class(self):
+        return self._resolve_scope(self.jarfile, self.classfile)
+
+    def resolve_jar(self):
+        return self._resolve_scope(self.jarfile)
+
+    def resolve_all(self):
+        return self._resolve_scope()
+
+    def _resolve_scope(self, *scope_columns):
+        """Remove duplicate symbols and resolve references within each scope"""
+        # Scopes are identified by a single integer per row
+        if scope_columns:
+            scope_ids = {}
+            scope = array.array("i", [scope_ids.setdefault(key, len(scope_ids))
+                                      for key in zip(*[column.tolist() for column in scope_columns])])
+        else:
+            scope = array.array("i", [0]) * len(self)
+        if numpy is not None:
+            scope = numpy.array(scope, dtype="i")
+        identity = (scope, self.value, self.kind, self.private, self.jcls, self.symname, self.descriptor)
+
+        # Pass 1: Remove duplicates, keeping the first occurrence in each scope
+        if numpy is not None:
+            keys = numpy.column_stack([column.astype("int64") for column in identity])
+            _, first = numpy.unique(keys, axis=0, return_index=True)
+            first = numpy.sort(first)
+        else:
+            seen = set()
+            first = []
+            for ii, key in enumerate(zip(*identity)):
+                if key not in seen:
+                    seen.add(key)
+                    first.append(ii)
+        deduped = self.take(first)
+        rows = zip(_take(scope, first).tolist(), deduped.kind.tolist(),
+                   deduped.jcls.tolist(), deduped.symname.tolist(), deduped.descriptor.tolist())
+
+        # Track definitions in each scope
+        classes = set()  # (scope, jcls)
+        fields = set()  # (scope, jcls, symname, descriptor)
+        methods = set()
+        for scope, kind, jcls, symname, descriptor in rows:
+            if kind == ord(Symbol.CLASS):
+                classes.add((scope, jcls))
+            elif kind in _FIELD_KINDS:
+                fields.add((scope, jcls, symname, descriptor))
+            elif kind in _DEF_KINDS:
+                methods.add((scope, jcls, symname, descriptor))
+
+        # Pass 2: Remove references where there is a matching definition; each
+        # distinct reference is only resolved once.
+        resolved = {}
+        keep = []
+        for key in rows:
+            if key[1] in _DEF_KINDS:
+                keep.append(True)
+                continue
+            if key not in resolved:
+                resolved[key] = self._is_resolved(key, classes, fields, methods)
+            keep.append(not resolved[key])
+        return deduped.select(keep)
+
+    def _is_resolved(self, key, classes, fields, methods):
+        scope, kind, jcls, symname, descriptor = key
+        if kind == ord(Symbol.REF_CLASS):
+            # Classes can only be resolved directly
+            return (scope, jcls) in classes
+        elif kind == ord(Symbol.REF_DATA):
+            # Static fields might be resolved in superclass or implemented interface
+            return self._find_owner(fields, scope, self.strings[jcls], symname, descriptor, True)
+        elif kind == ord(Symbol.REF_INSTANCE_DATA):
+            # Instance fields might be resolved in superclass
+            return self._find_owner(fields, scope, self.strings[jcls], symname, descriptor, False)
+        else:
+            # Methods might be resolved in superclass or implemented interface
+            return self._find_owner(methods, scope, self.strings[jcls], symname, descriptor, True)
+
+    def _find_owner(self, defs, scope, classname, symname, descriptor, interfaces):
+        """Equivalent of find_owner_superclass_interfaces/find_owner_superclass in jnm.py"""
+        if (scope, self._string_ids.get(classname), symname, descriptor) in defs:
+            return True
+        if interfaces:
+            if classname == "java.lang.Object":
+                return False
+            potentials = [_class_parent.get(classname, "java.lang.Object")]
+            potentials.extend(_class_interfaces.get(classname, []))
+        else:
+            parent = _class_parent.get(classname, "java.lang.Object")
+            if parent == "java.lang.Object":
+                return False
+            potentials = [parent]
+        for potential in potentials:
+            if self._find_owner(defs, scope, potential, symname, descriptor, interfaces):
+                return True
+        return False
+
+    # Sorts; each is the equivalent of the same-named sort function in jnm.py
+    def _string_ranks(self):
+        """Return a column mapping each string id to its position in sorted order"""
+        order = sorted(range(len(self.strings)), key=self.strings.__getitem__)
+        ranks = array.array("i", [0]) * len(self.strings)
+        for rank, string_id in enumerate(order):
+            ranks[string_id] = rank
+        if numpy is not None:
+            # Append an entry so that NO_ID (-1) maps to a rank below all others
+            return numpy.append(numpy.array(ranks, dtype="i"), -1)
+        else:
+            return ranks + array.array("i", [-1])
+
+    def alphabetic_sort(self):
+        ranks = self._string_ranks()
+        # Symbols within the class don't have a class prefix; add it, so the alpha sort is sensible
+        names = []
+        for classfile, kind, symname in zip(self.classfile, self.kind, self.symname):
+            symname = self.string(symname)
+            if kind in _DEF_KINDS:
+                names.append(u"%s.%s" % (self.strings[classfile], symname))
+            else:
+                names.append(symname)
+        name_order = dict([(name, rank) for rank, name in enumerate(sorted(set(names)))])
+        return self.take(_argsort(_take(ranks, self.jarfile),
+                                  _take(ranks, self.classfile),
+                                  [name_order[name] for name in names]))
+
+    def numeric_sort(self):
+        ranks = self._string_ranks()
+        if numpy is not None:
+            values = numpy.where(self.value == NO_VALUE, UNDEFINED_VALUE, self.value)
+        else:
+            values = [UNDEFINED_VALUE if value == NO_VALUE else value for value in self.value]
+        return self.take(_argsort(_take(ranks, self.jarfile), _take(ranks, self.classfile), values))
+
+    def noop_sort(self):
+        return self
+
+    def reverse_sort(self):
+        return self.take(range(len(self) - 1, -1, -1))
+
+    FILTER_METHODS = {jnm.resolve_class: resolve_class,
+                      jnm.resolve_jar: resolve_jar,
+                      jnm.resolve_all: resolve_all,
+                      jnm.remove_nonclass: remove_nonclass,
+                      jnm.remove_defined: remove_defined,
+                      jnm.remove_undefined: remove_undefined,
+                      jnm.remove_private: remove_private,
+                      jnm.alphabetic_sort: alphabetic_sort,
+                      jnm.numeric_sort: numeric_sort,
+                      jnm.noop_sort: noop_sort,
+                      jnm.reverse_sort: reverse_sort}
+
+    def apply(self, fn):
+        """Apply the columnar equivalent of the given jnm.py filter or sort function"""
+        return self.FILTER_METHODS[fn](self)
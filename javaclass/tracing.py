@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Recording of spans of work as Chrome trace events, for the --trace option.
+
+Each span becomes a complete ("X") event, so the file written by
+Tracer.write can be loaded into chrome://tracing or another trace viewer:
+
+    {"traceEvents": [{"name": ..., "cat": "jnm", "ph": "X", "ts": start,
+                      "dur": duration, "pid": ..., "tid": ..., "args": {...}},
+                     ...],
+     "displayTimeUnit": "ms"}
+
+Times are in microseconds from the start of tracing.  Spans for reading,
+parsing and scanning a class carry the class file name in their args.
+
+Spans are only recorded between start() and stop(); otherwise span() returns
+a shared no-op context manager.  Attribute decoding is traced by wrapping
+ClassFile._get_attribute_from_table while tracing is on, so the parser itself
+has no tracing code."""
+import os
+import json
+import time
+import thread
+
+from classfile import ClassFile
+
+# Category of every event
+CATEGORY = "jnm"
+
+
+class _Span(object):
+    """Context manager that records the time spent inside it as a trace event"""
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.add(self.name, self.start, time.time(), self.args)
+
+
+class _NoSpan(object):
+    """Context manager used while tracing is disabled"""
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_NO_SPAN = _NoSpan()
+
+_original_get_attribute = ClassFile._get_attribute_from_table
+
+
+def _traced_get_attribute(self, s):
+    start = time.time()
+    attribute, rest = _original_get_attribute(self, s)
+    tracer.add("attribute", start, time.time(),
+               {"name": self.constants[attribute.attribute_name_index - 1].bytes})
+    return attribute, rest
+
+
+class Tracer(object):
+    """Collects spans of work and writes them as Chrome trace-event JSON"""
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.origin = 0.0
+
+    def start(self):
+        """Start recording spans, discarding any recorded earlier"""
+        self.events = []
+        self.origin = time.time()
+        self.enabled = True
+        ClassFile._get_attribute_from_table = _traced_get_attribute
+
+    def stop(self):
+        """Stop recording spans; those already recorded are kept"""
+        self.enabled = False
+        ClassFile._get_attribute_from_table = _original_get_attribute
+
+    def span(self, name, **args):
+        """Return a context manager that records the time spent inside it"""
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, name, args)
+
+    def add(self, name, start, end, args=None):
+        """Record a span from start to end (both time.time() values)"""
+        self.events.append((name, start, end, thread.get_ident(), args))
+
+    def write(self, filename):
+        """Write the recorded spans to filename as Chrome trace-event JSON"""
+        pid = os.getpid()
+        events = []
+        for name, start, end, tid, args in self.events:
+            event = {"name": name,
+                     "cat": CATEGORY,
+                     "ph": "X",
+                     "ts": round((start - self.origin) * 1e6, 1),
+                     "dur": round((end - start) * 1e6, 1),
+                     "pid": pid,
+                     "tid": tid}
+            if args:
+                event["args"] = args
+            events.append(event)
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, separators=(",", ":"))
+            f.write("\n")
+
+tracer = Tracer()
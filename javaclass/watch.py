@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 David Drysdale <dmd@lurklurk.org>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Watch mode for jnm: re-analyse class and jar files as they change.
+
+Each watched file is remembered with its modification time, size and a hash
+of its contents, and only files whose contents have changed (or that have been
+added) are parsed again.  When references are resolved across all files (-f),
+resolution results are kept between scans and only references to classes whose
+definitions or ancestry might have changed are resolved again.  After the
+initial listing, changes are shown as lines starting with "+ " or "- ".
+"""
+import os
+import sys
+import errno
+import time
+import hashlib
+
+from jnm import Symbol, load_symbols, ALL_FILTER_FNS, resolve_all
+from jnm import find_owner_field, find_owner_static_field, find_owner_method
+from jnm import prepend_filename, _class_parent, _class_interfaces
+
+# Seconds between scans for changes
+WATCH_INTERVAL = 1.0
+
+# Filters that run before resolve_all only ever look within a single class, so
+# they can be applied to each file as it is parsed; the rest run on the whole
+# listing.
+_FILE_FILTER_FNS = ALL_FILTER_FNS[:ALL_FILTER_FNS.index(resolve_all)]
+_LISTING_FILTER_FNS = ALL_FILTER_FNS[ALL_FILTER_FNS.index(resolve_all) + 1:]
+
+
+def watched_files(paths):
+    """Return the class and jar files named by paths, looking inside directories"""
+    results = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if filename.endswith(".class") or filename.endswith(".jar"):
+                        results.append(os.path.join(dirpath, filename))
+        elif os.path.isfile(path):
+            results.append(path)
+    return results
+
+
+def _digest(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), ""):
+            md5.update(block)
+    return md5.digest()
+
+
+class _WatchedFile(object):
+    def __init__(self, stamp, digest, entries, hierarchy):
+        self.stamp = stamp
+        self.digest = digest
+        self.entries = entries  # (jarfile, classfile, symbol) after the per-file filters
+        self.hierarchy = hierarchy  # class => (superclass, interfaces)
+
+
+class Watcher(object):
+    def __init__(self, opts, paths):
+        self.opts = opts
+        self.paths = paths
+        self.files = {}  # path => _WatchedFile
+        self.order = []
+        self.flatten = resolve_all in opts.filters
+        self.definitions = {}  # unique name => number of definitions, for -f
+        self.resolved = {}  # reference symbol => whether it is resolved, for -f
+        self.entries = []  # current listing
+
+    def _parse(self, path):
+        entries = list(load_symbols([path]))
+        hierarchy = {}
+        for jarfile, classfile, sym in entries:
+            if sym.symtype == Symbol.CLASS:
+                hierarchy[sym.jcls] = (_class_parent.get(sym.jcls), _class_interfaces.get(sym.jcls, []))
+        return list(self.opts.filter(entries, _FILE_FILTER_FNS)), hierarchy
+
+    def _count_definitions(self, watched, delta):
+        for jarfile, classfile, sym in watched.entries:
+            if sym.is_def():
+                count = self.definitions.get(sym.unique_name, 0) + delta
+                if count:
+                    self.definitions[sym.unique_name] = count
+                else:
+                    del self.definitions[sym.unique_name]
+
+    def _changed_classes(self, watched):
+        # Classes whose definitions or ancestry depend on this file
+        classes = set(watched.hierarchy)
+        classes.update([sym.jcls for jarfile, classfile, sym in watched.entries if sym.is_def()])
+        return classes
+
+    def _forget(self, path):
+        watched = self.files.pop(path)
+        self._count_definitions(watched, -1)
+        return self._changed_classes(watched)
+
+    def scan(self):
+        """Re-read any changed files, returning True if anything changed"""
+        current = watched_files(self.paths)
+        changed = False
+        changed_classes = set()
+        for path in set(self.files) - set(current):
+            changed_classes.update(self._forget(path))
+            changed = True
+        for path in current:
+            old = self.files.get(path)
+            try:
+                st = os.stat(path)
+                stamp = (st.st_mtime, st.st_size)
+                if old is not None and old.stamp == stamp:
+                    continue
+                digest = _digest(path)
+                if old is not None and old.digest == digest:
+                    old.stamp = stamp
+                    continue
+                entries, hierarchy = self._parse(path)
+            except Exception, e:
+                if isinstance(e, EnvironmentError) and e.errno == errno.ENOENT:
+                    # Removed since the files were listed (by a clean or a build)
+                    if old is not None:
+                        changed_classes.update(self._forget(path))
+                        changed = True
+                else:
+                    # Probably still being written; try again on the next scan
+                    print >> sys.stderr, "Failed to read %s: %s" % (path, e)
+                continue
+            if old is not None:
+                changed_classes.update(self._forget(path))
+            watched = _WatchedFile(stamp, digest, entries, hierarchy)
+            self.files[path] = watched
+            self._count_definitions(watched, 1)
+            changed_classes.update(self._changed_classes(watched))
+            changed = True
+        self.order = [path for path in current if path in self.files]
+        if changed:
+            self._update_hierarchy()
+            self._invalidate(changed_classes)
+        return changed
+
+    def _update_hierarchy(self):
+        # The hierarchy is rebuilt as if all the files had just been parsed in order
+        _class_parent.clear()
+        _class_interfaces.clear()
+        for path in self.order:
+            for jcls, (parent, interfaces) in self.files[path].hierarchy.iteritems():
+                if parent is not None:
+                    _class_parent[jcls] = parent
+                _class_interfaces[jcls] = interfaces
+
+    def _invalidate(self, changed_classes):
+        # A resolution result can only change if the referenced class or one of
+        # its ancestors has changed.
+        ancestry = {}
+        for sym in self.resolved.keys():
+            if not _ancestors(sym.jcls, ancestry).isdisjoint(changed_classes):
+                del self.resolved[sym]
+
+    def _is_resolved(self, sym):
+        # Equivalent of pass 2 of jnm._resolve_run, with every file in scope
+        result = self.resolved.get(sym)
+        if result is None:
+            symtype = sym.symtype.upper()
+            if symtype == Symbol.REF_CLASS:
+                result = sym.unique_name in self.definitions
+            elif symtype == Symbol.REF_DATA:
+                result = find_owner_static_field(self.definitions, sym) is not None
+            elif symtype == Symbol.REF_INSTANCE_DATA:
+                result = find_owner_field(self.definitions, sym) is not None
+            elif symtype == Symbol.REF_CODE:
+                result = find_owner_method(self.definitions, sym) is not None
+            else:
+                result = False
+            self.resolved[sym] = result
+        return result
+
+    def _all_entries(self):
+        if not self.flatten:
+            for path in self.order:
+                for entry in self.files[path].entries:
+                    yield entry
+            return
+        seen = set()
+        for path in self.order:
+            for entry in self.files[path].entries:
+                sym = entry[2]
+                if sym in seen:
+                    continue
+                seen.add(sym)
+                if sym.is_def() or not self._is_resolved(sym):
+                    yield entry
+
+    def listing(self):
+        """Return the current listing as a list of (jarfile, classfile, symbol)"""
+        entries = self.opts.filter(self._all_entries(), _LISTING_FILTER_FNS)
+        self.entries = list(self.opts.sort(entries))
+        return self.entries
+
+    def delta(self):
+        """Update the listing, returning lists of the (removed, added) entries"""
+        old = self.entries
+        new = self.listing()
+        old_set = set(old)
+        new_set = set(new)
+        return ([entry for entry in old if entry not in new_set],
+                [entry for entry in new if entry not in old_set])
+
+
+def _ancestors(jcls, memo):
+    # jcls with all of its superclasses and interfaces
+    result = memo.get(jcls)
+    if result is None:
+        result = memo[jcls] = set([jcls])
+        if jcls != "java.lang.Object":
+            for parent in [_class_parent.get(jcls, "java.lang.Object")] + _class_interfaces.get(jcls, []):
+                result.update(_ancestors(parent, memo))
+    return result
+
+
+def _delta_line(opts, marker, jarfile, classfile, sym):
+    text = opts.display(jarfile, classfile, sym)
+    if prepend_filename in opts.displays:
+        return u"%s %s\n" % (marker, text)
+    elif jarfile is None:
+        return u"%s %s: %s\n" % (marker, classfile, text)
+    else:
+        return u"%s %s(%s): %s\n" % (marker, jarfile, classfile, text)
+
+
+def watch(opts, paths, out, write_listing, interval=WATCH_INTERVAL):
+    """Show the listing for paths, then show changes to it until interrupted.
+
+    The initial listing is shown with write_listing(out, entries)."""
+    watcher = Watcher(opts, paths)
+    watcher.scan()
+    write_listing(out, watcher.listing())
+    out.flush()
+    try:
+        while True:
+            time.sleep(interval)
+            if watcher.scan():
+                removed, added = watcher.delta()
+                for entry in removed:
+                    out.write(_delta_line(opts, u"-", *entry))
+                for entry in added:
+                    out.write(_delta_line(opts, u"+", *entry))
+                out.flush()
+    except KeyboardInterrupt:
+        pass
@@ -45,7 +45,7 @@ distutils.core.setup(name='jnm',
                      url='https://github.com/daviddrysdale/jnm',
                      license='GNU Lesser General Public License version 3 or later',
                      packages=['javaclass'],
-                     scripts=['jnm', 'jldd', 'jdump', 'jdemangle'],
+                     scripts=['jnm', 'jldd', 'jdump', 'jdemangle', 'jsymdb', 'jrefs', 'jcallgraph', 'jshake', 'jinline', 'jperf', 'jsize', 'jshrink', 'jnmd', 'jnmc', 'jdiff'],
                      platforms='Posix; MacOS X; Windows',
                      classifiers=['Development Status :: 3 - Alpha',
                                   'Intended Audience :: Developers',
@@ -0,0 +1,4 @@
+public class ShakeFieldType {
+}
+
+// vim: tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,4 @@
+public class ShakeReturnType {
+}
+
+// vim: tabstop=4 expandtab shiftwidth=4
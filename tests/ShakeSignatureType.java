@@ -0,0 +1,4 @@
+public class ShakeSignatureType {
+}
+
+// vim: tabstop=4 expandtab shiftwidth=4
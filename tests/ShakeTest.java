@@ -0,0 +1,24 @@
+import java.util.List;
+
+// The Shake*Type classes are only named in descriptors and signatures here,
+// never in code, but jshake -e ShakeTest must keep them.
+public class ShakeTest {
+    public ShakeFieldType field;
+    public List<ShakeSignatureType> list;
+
+    @AnnotationMarker
+    public ShakeReturnType get() {
+        return null;
+    }
+
+    public static void main(String[] args) {
+        ShakeTest t = new ShakeTest();
+        if (t.get() != null) {
+            System.err.println("ShakeTest.get() failed!");
+        } else {
+            System.out.println("ShakeTest.get() correct: null");
+        }
+    }
+}
+
+// vim: tabstop=4 expandtab shiftwidth=4